@@ -1,17 +1,26 @@
 import sys
 import os
-import threading
 import json
-import cv2
 from fastapi import FastAPI, Request
-from starlette.responses import StreamingResponse, FileResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse, FileResponse, Response
 from pydantic import BaseModel
 import uvicorn
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
-from src.detection.counter import track_and_count_pizzas, get_camera_key, draw_polygon
-from src.detection.tracking import pizza_tracker
-from src.config.camera_zones import CAMERA_ZONES
+from src.detection.counter import get_camera_key
+from src.detection.session import PipelineSession
+from src.detection.zones import camera_zone_spec
+from src.detection.capture import is_live_source
+from src.detection.video_output import VIDEO_MODES, clips_dir
+from src.api.jobs import JobScheduler, ACTIVE_STATES
+from src.api.results import ResultStore, result_key, live_key
+from src.api.feedback import FeedbackStore
+from src.detection.model_registry import DEFAULT_MODEL_PATH, preload_models
+from src.detection.backends import DETECTOR_BACKENDS, DEFAULT_BACKEND
+from src.detection.tracking import TRACKER_BACKENDS
+from src.detection.metrics import METRICS
+from src.config.camera_zones import CAMERA_ZONES, DEFAULT_ROI_PADDING
 
 app = FastAPI(title="Pizza Sales Counting System")
 
@@ -20,87 +29,192 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..
 def abs_path(relative_path):
     return os.path.abspath(os.path.join(project_root, relative_path))
 
-feedback_dir = abs_path("data/feedback")
-os.makedirs(feedback_dir, exist_ok=True)
+# Old per-video JSON files are imported into the store when it is first created
+feedback = FeedbackStore(abs_path("data/feedback/feedback.sqlite3"), legacy_dir=abs_path("data/feedback"))
 
-process_threads = {}
-stop_flags = {}
-stream_stop_flags = {}
+def make_session(job):
+    return PipelineSession(camera_key=job.camera_key, **job.params)
+
+def job_result_key(job):
+    return os.path.basename(os.path.dirname(job.params["output_path"]))
+
+results = ResultStore(
+    root=abs_path("data/results"),
+    active_keys=lambda: {job_result_key(job) for job in scheduler.list() if job.state in ACTIVE_STATES}
+)
+
+scheduler = JobScheduler(
+    state_dir=abs_path("data/jobs"),
+    make_session=make_session,
+    max_workers=int(os.environ["PIZZA_MAX_JOBS"]) if os.environ.get("PIZZA_MAX_JOBS") else None,
+    threads_per_job=int(os.environ["PIZZA_THREADS_PER_JOB"]) if os.environ.get("PIZZA_THREADS_PER_JOB") else None,
+    max_finished=int(os.environ.get("PIZZA_MAX_FINISHED_JOBS", 500)),
+    on_finish=lambda job: results.finish(job.params["output_path"], job.state, job.summary),
+    # Load and warm up the shared models in each worker process so the first /process does not pay for it
+    worker_init=preload_models if os.environ.get("PIZZA_PRELOAD_MODELS", "1") == "1" else None
+)
+
+@app.on_event("startup")
+def start_scheduler():
+    scheduler.start()
+
+@app.on_event("shutdown")
+def stop_scheduler():
+    scheduler.stop()
 
 class ProcessRequest(BaseModel):
-    video_path: str
+    video_path: str  # file under data/, or a live source: RTSP/HTTP URL or camera device index
+    camera_key: str = None  # required for live sources, taken from the file name otherwise
+    batch_size: int = 1  # frames per forward pass
+    use_roi: bool = False  # detect only around the camera's counting polygon
+    adaptive: bool = False  # skip YOLO on idle frames (no motion, no live tracks)
+    parquet: bool = False  # also roll sale events over into Parquet part files
+    resume: bool = False  # continue from the camera's last checkpoint instead of frame 0
+    shards: int = 1  # >1: count time segments of the video in parallel processes (no live stream)
+    video_mode: str = "full"  # full / preview (downscaled) / events (clips around sales) / none
+    backend: str = None  # detector backend: torch / onnx / onnx-int8 / openvino; camera's "detector_backend" by default
+    tracker: str = None  # deepsort / deepsort-sparse (fewer embeddings) / iou (no appearance); camera's "tracker_backend" by default
+    force: bool = False  # re-process even if this video was already counted with the same model, zone and parameters
 
 @app.post("/process")
 async def process_video(req: ProcessRequest):
-    video_path = abs_path(req.video_path)
-    if not os.path.exists(video_path):
-        return {"error": f"Video file not found: {video_path}"}
-    camera_key = get_camera_key(video_path)
+    if req.video_mode not in VIDEO_MODES:
+        return {"error": f"Unknown video_mode: {req.video_mode} (expected one of {', '.join(VIDEO_MODES)})"}
+    if is_live_source(req.video_path):
+        video_path = req.video_path
+        if req.camera_key is None:
+            return {"error": "camera_key is required for live sources"}
+        if req.shards > 1:
+            return {"error": "Live sources cannot be sharded"}
+    else:
+        video_path = abs_path(req.video_path)
+        if not os.path.exists(video_path):
+            return {"error": f"Video file not found: {video_path}"}
+    if req.shards > 1:
+        # Shards run in worker processes and only merge the CSV and, for "full", the video
+        if req.video_mode not in ("full", "none"):
+            return {"error": f"video_mode {req.video_mode} is not supported with shards (use full or none)"}
+        if req.parquet or req.resume:
+            return {"error": "parquet and resume are not supported with shards"}
+    camera_key = req.camera_key or get_camera_key(video_path)
+    if camera_key not in CAMERA_ZONES:
+        return {"error": f"Unknown camera: {camera_key}"}
     zone = CAMERA_ZONES[camera_key]
-    count_polygon = zone.get("count_polygon") or zone.get("count_box")
-    output_path = abs_path(f"data/results/counted_{camera_key}.mp4")
-    stop_flags[camera_key] = False
-
-    def run_process():
-        track_and_count_pizzas(
-            video_path=video_path,
-            output_path=output_path,
-            conf_thres=0.5,
-            count_polygon=count_polygon,
-            stop_flag=lambda: stop_flags[camera_key]
-        )
-
-    t = threading.Thread(target=run_process)
-    t.start()
-    process_threads[camera_key] = t
+    count_polygon = camera_zone_spec(camera_key)  # compiled into a CountingZone by the counter
+    roi_padding = zone.get("roi_padding", DEFAULT_ROI_PADDING) if req.use_roi else None
+    backend = req.backend or zone.get("detector_backend", DEFAULT_BACKEND)
+    if backend not in DETECTOR_BACKENDS:
+        return {"error": f"Unknown backend: {backend} (expected one of {', '.join(DETECTOR_BACKENDS)})"}
+    tracker_backend = req.tracker or zone.get("tracker_backend", "deepsort")
+    if tracker_backend not in TRACKER_BACKENDS:
+        return {"error": f"Unknown tracker: {tracker_backend} (expected one of {', '.join(TRACKER_BACKENDS)})"}
+
+    params = dict(
+        video_path=video_path,
+        conf_thres=0.5,
+        count_polygon=count_polygon,
+        batch_size=req.batch_size,
+        roi_padding=roi_padding,
+        adaptive=req.adaptive,
+        proximity=zone.get("proximity"),
+        parquet=req.parquet,
+        resume=req.resume,
+        shards=req.shards,
+        video_mode=req.video_mode,
+        backend=backend,
+        tracker_backend=tracker_backend
+    )
+
+    # Results are stored by content address: the same video, model, zone and parameters
+    # give the same key, so a repeated request returns the finished CSV/MP4 right away
+    if is_live_source(req.video_path):
+        key = live_key(camera_key)
+    else:
+        # Hashes ~1 MB of the video (memoised per size/mtime) off the event loop
+        try:
+            key = await run_in_threadpool(result_key, camera_key, video_path, DEFAULT_MODEL_PATH, params)
+        except FileNotFoundError as e:
+            return {"error": str(e)}
+        cached = None if req.force else results.lookup(key)
+        if cached is not None:
+            return {
+                "status": "cached",
+                "job_id": None,
+                "video_id": camera_key,
+                "result_key": key,
+                "summary": cached["summary"],
+                "output_video": cached["output_path"],
+                "output_csv": cached["output_path"].replace(".mp4", "_sales.csv")
+            }
+
+    active = scheduler.active_for_camera(camera_key)
+    if active is not None:
+        return {"error": f"Camera {camera_key} already has an active job", "job_id": active.id, "state": active.state}
+
+    # One session per job: counting, MP4 writing and /stream all share a single tracker run
+    output_path, previous = results.begin(key, camera_key)
+    job, active = scheduler.submit(camera_key, dict(params, output_path=output_path))
+    if job is None:
+        # Lost a race with another request for this camera: leave its entry as it was
+        results.abort(output_path, previous)
+        return {"error": f"Camera {camera_key} already has an active job", "job_id": active.id, "state": active.state}
 
     return {
-        "status": "processing",
+        "status": job.state,
+        "job_id": job.id,
         "video_id": camera_key,
+        "result_key": key,
         "output_video": output_path,
         "output_csv": output_path.replace(".mp4", "_sales.csv")
     }
 
+@app.get("/jobs")
+def list_jobs():
+    return {"jobs": [job.to_dict() for job in scheduler.list()]}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = scheduler.get(job_id)
+    if job is None:
+        return {"error": "Job not found"}
+    return job.to_dict()
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    job = scheduler.cancel(job_id)
+    if job is None:
+        return {"error": "Job not found"}
+    return job.to_dict()
+
 @app.post("/stop/{video_id}")
 def stop_process(video_id: str):
-    stop_flags[video_id] = True
-    stream_stop_flags[video_id] = True
+    job = scheduler.active_for_camera(video_id)
+    if job is not None:
+        scheduler.cancel(job.id)
     return {"status": "stopping"}
 
 @app.get("/stream/{video_name}")
-def stream_video(video_name: str):
-    video_path = abs_path(f"data/raw_videos/cut_video_test/{video_name}")
-    camera_key = get_camera_key(video_path)
-    zone = CAMERA_ZONES[camera_key]
-    count_polygon = zone.get("count_polygon") or zone.get("count_box")
+def stream_video(video_name: str, width: int = None, max_fps: float = 15.0, quality: int = 70):
+    """
+    MJPEG stream of a camera's annotated frames, downscaled to `width` and capped at `max_fps`.
+    Each frame is encoded once per (width, quality) and shared by every viewer asking for it.
+    """
+    camera_key = get_camera_key(video_name)
+    job = scheduler.active_for_camera(camera_key) or scheduler.latest_for_camera(camera_key)
+    session = job.session if job is not None else None
+    if session is None:
+        return {"error": f"No processing session for camera: {camera_key}"}
+
+    width = max(64, width) if width else None
+    quality = min(95, max(10, quality))
 
     def gen():
-        frame_count = 0
         try:
-            for frame, tracks in pizza_tracker(video_path, conf_thres=0.5):
-                frame_count += 1
-                if frame_count % 45 == 0:
-                    continue  
-                if frame is None:
-                    break
-                # Draw polygon overlay
-                if count_polygon:
-                    draw_polygon(frame, count_polygon, color=(0, 0, 255), thickness=2)
-                # Draw tracks and center points
-                for track in tracks or []:
-                    x1, y1, x2, y2 = map(int, track[:4])
-                    track_id = int(track[5])
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 165, 255), 2)
-                    cv2.putText(frame, f"ID {track_id}", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 165, 255), 2)
-                    cx = int((x1 + x2) / 2)
-                    cy = int((y1 + y2) / 2)
-                    cv2.circle(frame, (cx, cy), 4, (255, 0, 0), -1)
-                # Encode frame to JPEG
-                encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 70]
+            # Frames are already annotated (polygon, tracks, count) by the counting run
+            for jpeg in session.jpeg_frames(width=width, max_fps=max_fps, quality=quality):
                 try:
-                    _, jpeg = cv2.imencode('.jpg', frame, encode_param)
                     yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + jpeg.tobytes() + b'\r\n')
+                           b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
                 except Exception as e:
                     print("Client disconnected or yield error:", e)
                     break
@@ -110,34 +224,116 @@ def stream_video(video_name: str):
             print("Stream error:", e)
     return StreamingResponse(gen(), media_type='multipart/x-mixed-replace; boundary=frame')
 
+@app.get("/models")
+def list_models():
+    # Jobs run in the scheduler's worker processes, each with its own models
+    return {"models": scheduler.models()}
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text: per-camera stage latency histograms, frames, fps, queue depths, model load times."""
+    return Response(METRICS.render(models=scheduler.models()), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/events/{video_id}")
+def stream_events(video_id: str, max_fps: float = 5.0):
+    """Server-Sent Events with per-frame count, active tracks and sale events of a camera's job."""
+    job = scheduler.active_for_camera(video_id) or scheduler.latest_for_camera(video_id)
+    session = job.session if job is not None else None
+    if session is None:
+        return {"error": f"No processing session for camera: {video_id}"}
+
+    def gen():
+        try:
+            for info in session.updates(max_fps=max_fps):
+                yield f"event: frame\ndata: {json.dumps(info)}\n\n"
+            yield f"event: end\ndata: {json.dumps({'job_id': job.id})}\n\n"
+        except GeneratorExit:
+            print("Event stream closed (client disconnected)")
+    return StreamingResponse(gen(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.post("/feedback")
 async def receive_feedback(request: Request):
     data = await request.json()
     video_id = data.get("video_id")
-    feedback_path = os.path.join(feedback_dir, f"{video_id}_feedback.json")
-    if os.path.exists(feedback_path):
-        with open(feedback_path, "r") as f:
-            feedbacks = json.load(f)
-    else:
-        feedbacks = []
-    feedbacks.append(data)
-    with open(feedback_path, "w") as f:
-        json.dump(feedbacks, f, indent=2)
-    return {"status": "received"}
+    if not video_id:
+        return {"error": "video_id is required"}
+    # Link the feedback to the run it is about, so predicted and corrected counts can be compared
+    entry = results.resolve(str(video_id))
+    summary = (entry or {}).get("summary") or {}
+    stored = await run_in_threadpool(
+        feedback.add, data,
+        camera_key=entry["camera"] if entry is not None else None,
+        result_key=entry["key"] if entry is not None else None,
+        predicted_count=summary.get("pizza_count")
+    )
+    return {"status": "received", "id": stored["id"], "received_at": stored["received_at"]}
+
+@app.get("/feedback")
+def list_feedback(after_id: int = 0, limit: int = 1000, camera_key: str = None):
+    """Every camera's feedback in submission order; pass the last `id` as after_id to pull only new entries."""
+    return {"feedback": feedback.query(camera_key=camera_key, after_id=after_id, limit=min(limit, 10000))}
+
+@app.get("/feedback/summary")
+def feedback_summary():
+    """Per camera: number of submissions and predicted vs corrected pizza counts."""
+    return {"cameras": feedback.summary()}
+
+@app.get("/feedback/{video_id}")
+def get_feedback(video_id: str, after_id: int = 0, limit: int = 1000):
+    return {"video_id": video_id, "feedback": feedback.query(video_id=video_id, after_id=after_id, limit=min(limit, 10000))}
+
+def result_output(video_id):
+    """(output MP4 path, result entry) for a result key or a camera's latest result."""
+    entry = results.resolve(video_id)
+    if entry is None:
+        # Results written before they were content-addressed
+        return abs_path(f"data/results/counted_{os.path.basename(video_id)}.mp4"), None
+    return entry["output_path"], entry
+
+@app.get("/results")
+def list_results():
+    return {"results": results.list(), "max_bytes": results.max_bytes}
 
 @app.get("/results/{video_id}")
 def get_results(video_id: str):
-    csv_path = abs_path(f"data/results/counted_{video_id}_sales.csv")
+    """Sales CSV by camera (its latest run) or by the result_key returned from /process."""
+    output_path, entry = result_output(video_id)
+    csv_path = output_path.replace(".mp4", "_sales.csv")
     if not os.path.exists(csv_path):
         return {"error": "Result not found"}
+    job = scheduler.active_for_camera(entry["camera"]) if entry is not None else None
+    if job is not None and job.state == "running" and job.params["output_path"] == output_path:
+        # The CSV is still being appended to: serve a snapshot of the events so far
+        with open(csv_path, "rb") as f:
+            content = f.read()
+        return Response(content, media_type="text/csv", headers={
+            "Content-Disposition": f'attachment; filename="{os.path.basename(csv_path)}"',
+            "X-Result-Partial": "true",
+            "X-Job-Id": job.id
+        })
     return FileResponse(csv_path, media_type="text/csv", filename=os.path.basename(csv_path))
     
 @app.get("/video/{video_id}")
 def get_video(video_id: str):
-    video_path = abs_path(f"data/results/counted_{video_id}.mp4")
+    video_path, _ = result_output(video_id)
     if not os.path.exists(video_path):
         return {"error": "Video not found"}
     return FileResponse(video_path, media_type="video/mp4", filename=os.path.basename(video_path))
 
+@app.get("/clips/{video_id}")
+def list_clips(video_id: str):
+    """Sale clips of a run processed with video_mode='events'."""
+    clip_dir = clips_dir(result_output(video_id)[0])
+    if not os.path.isdir(clip_dir):
+        return {"clips": []}
+    return {"clips": sorted(name for name in os.listdir(clip_dir) if name.endswith(".mp4"))}
+
+@app.get("/clips/{video_id}/{clip_name}")
+def get_clip(video_id: str, clip_name: str):
+    clip_path = os.path.join(clips_dir(result_output(video_id)[0]), os.path.basename(clip_name))
+    if not os.path.exists(clip_path):
+        return {"error": "Clip not found"}
+    return FileResponse(clip_path, media_type="video/mp4", filename=os.path.basename(clip_path))
+
 if __name__ == "__main__":
     uvicorn.run(app, host="localhost", port=8000)
@@ -0,0 +1,150 @@
+# src/api/feedback.py
+import os
+import json
+import glob
+import time
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS feedback (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    video_id TEXT NOT NULL,
+    camera_key TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    result_key TEXT,
+    predicted_count INTEGER,
+    correct_count INTEGER,
+    feedback TEXT,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS feedback_video ON feedback (video_id, id);
+CREATE INDEX IF NOT EXISTS feedback_camera ON feedback (camera_key, id);
+"""
+
+COLUMNS = ("id", "video_id", "camera_key", "received_at", "result_key", "predicted_count", "correct_count", "feedback", "payload")
+
+# ============== Feedback store ==============
+class FeedbackStore:
+    """
+    Append-only feedback log in SQLite (WAL mode): each submission is one INSERT, atomic and
+    O(1) whatever the history, readers never block the writer, and concurrent API workers
+    cannot lose each other's entries. Every row keeps the full submitted JSON (`payload`)
+    plus the columns the retraining loop queries by: camera, receive time, the count the
+    run predicted and the count the user corrected it to.
+
+    Calls block on disk I/O: from async code, run them in the threadpool.
+    """
+
+    def __init__(self, path, legacy_dir=None):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+        created = not os.path.exists(path)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        if created and legacy_dir:
+            self._import_legacy(legacy_dir)
+
+    def _connect(self):
+        # One connection per thread: sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # durable across crashes of the app; WAL keeps it consistent
+            self._local.conn = conn
+        return conn
+
+    def _import_legacy(self, legacy_dir):
+        """One-off import of the old per-video <video_id>_feedback.json arrays."""
+        imported = 0
+        for path in sorted(glob.glob(os.path.join(legacy_dir, "*_feedback.json"))):
+            try:
+                with open(path, "r") as f:
+                    entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Skipping legacy feedback {path}: {e}")
+                continue
+            received_at = os.path.getmtime(path)
+            for data in entries:
+                self.add(data, received_at=received_at)
+                imported += 1
+        if imported:
+            print(f"Imported {imported} legacy feedback entries from {legacy_dir}")
+
+    # ---- writes ----
+    def add(self, data, camera_key=None, result_key=None, predicted_count=None, received_at=None):
+        """Append one submission. Returns its stored row as a dict."""
+        received_at = received_at or time.time()
+        video_id = str(data.get("video_id") or "")
+        row = (
+            video_id,
+            camera_key or video_id,
+            received_at,
+            result_key,
+            _int_or_none(predicted_count),
+            _int_or_none(data.get("correct_count")),
+            data.get("feedback"),
+            json.dumps(data)
+        )
+        with self._connect() as conn:  # commits on success, rolls back on error
+            cursor = conn.execute(
+                "INSERT INTO feedback (video_id, camera_key, received_at, result_key, predicted_count, "
+                "correct_count, feedback, payload) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+        return _row_dict((cursor.lastrowid, *row))
+
+    # ---- reads ----
+    def query(self, video_id=None, camera_key=None, after_id=0, limit=1000):
+        """Entries in submission order, optionally for one video or camera, with id > after_id."""
+        where, args = ["id > ?"], [after_id]
+        if video_id is not None:
+            where.append("video_id = ?")
+            args.append(video_id)
+        if camera_key is not None:
+            where.append("camera_key = ?")
+            args.append(camera_key)
+        rows = self._connect().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM feedback WHERE {' AND '.join(where)} ORDER BY id LIMIT ?",
+            (*args, limit)).fetchall()
+        return [_row_dict(row) for row in rows]
+
+    def summary(self):
+        """Per camera: submissions, and predicted vs corrected counts where both are known."""
+        rows = self._connect().execute("""
+            SELECT camera_key,
+                   COUNT(*),
+                   COUNT(correct_count),
+                   SUM(CASE WHEN predicted_count IS NOT NULL AND correct_count IS NOT NULL THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN correct_count IS NOT NULL THEN predicted_count END),
+                   SUM(CASE WHEN predicted_count IS NOT NULL THEN correct_count END),
+                   AVG(ABS(predicted_count - correct_count)),
+                   AVG(predicted_count - correct_count),
+                   MAX(received_at)
+            FROM feedback GROUP BY camera_key ORDER BY camera_key
+        """).fetchall()
+        cameras = {}
+        for camera, total, corrected, compared, predicted, correct, abs_error, error, last in rows:
+            cameras[camera] = {
+                "feedback": total,
+                "with_correct_count": corrected,
+                "compared": compared,
+                "predicted_total": predicted,
+                "correct_total": correct,
+                "mean_abs_error": round(abs_error, 3) if abs_error is not None else None,
+                "mean_error": round(error, 3) if error is not None else None,  # > 0: overcounting
+                "last_received_at": last
+            }
+        return cameras
+
+
+def _int_or_none(value):
+    try:
+        return int(value) if value is not None and value != "" else None
+    except (TypeError, ValueError):
+        return None
+
+def _row_dict(row):
+    entry = dict(zip(COLUMNS, row))
+    entry["payload"] = json.loads(entry["payload"])
+    return entry
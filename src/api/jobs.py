@@ -0,0 +1,380 @@
+# src/api/jobs.py
+import os
+import glob
+import json
+import time
+import uuid
+import queue
+import atexit
+import threading
+import traceback
+import multiprocessing as mp
+
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+ACTIVE_STATES = ("queued", "running")
+
+# ============== Jobs ==============
+class Job:
+    def __init__(self, camera_key, params, job_id=None, state="queued", created_at=None,
+                 started_at=None, finished_at=None, error=None, summary=None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.camera_key = camera_key
+        self.params = params  # PipelineSession keyword arguments, JSON-serialisable
+        self.state = state
+        self.created_at = created_at or time.time()
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.error = error
+        self.summary = summary  # count, fps and per-stage timing of the finished run
+        self.session = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "camera_key": self.camera_key,
+            "state": self.state,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "summary": self.summary,
+            "params": self.params
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            camera_key=data["camera_key"],
+            params=data["params"],
+            job_id=data["job_id"],
+            state=data["state"],
+            created_at=data.get("created_at"),
+            started_at=data.get("started_at"),
+            finished_at=data.get("finished_at"),
+            error=data.get("error"),
+            summary=data.get("summary")
+        )
+
+
+# ============== Worker processes ==============
+def _limit_threads(threads):
+    # Process-wide settings: a worker process runs one job at a time, so they are its budget
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    try:
+        import cv2
+        cv2.setNumThreads(threads)
+    except ImportError:
+        pass
+
+def _serve(tasks, messages, status, cancel, want_frames, threads, init):
+    """Worker process loop: run (function, kwargs) tasks one at a time until None arrives."""
+    from src.detection.model_registry import REGISTRY
+    _limit_threads(threads)
+    if init is not None:
+        init()
+    status.put(REGISTRY.stats())
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        function, kwargs = task
+        try:
+            result = function(messages=messages, stop_flag=cancel.is_set,
+                              want_frames=lambda: bool(want_frames.value), **kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            messages.put(("error", str(e)))
+        else:
+            messages.put(("done", result))
+        status.put(REGISTRY.stats())
+
+
+class WorkerProcess:
+    """
+    A long-lived process that runs one job at a time with its own torch / OpenCV thread
+    budget; models it loads stay resident for its next jobs. A task sends its results back
+    over `messages`, ending with ("done", result) or ("error", message). A process that
+    dies is replaced by a fresh one.
+    """
+
+    def __init__(self, name, threads, init=None):
+        self.name = name
+        self.threads = threads
+        self.init = init  # picklable function the process runs first, e.g. to preload models
+        self.process = None
+        self._ctx = mp.get_context("spawn")  # CUDA and the model registry do not survive fork
+        self._models = []
+
+    def start(self):
+        ctx = self._ctx
+        self.tasks = ctx.Queue()
+        self.messages = ctx.Queue(maxsize=64)
+        self.status = ctx.Queue()
+        self.cancel = ctx.Event()
+        self.want_frames = ctx.Value("b", 0, lock=False)
+        self._models = []
+        # Not a daemon: a sharded job starts processes of its own
+        self.process = ctx.Process(target=_serve, name=self.name, args=(
+            self.tasks, self.messages, self.status, self.cancel, self.want_frames, self.threads, self.init))
+        self.process.start()
+        return self
+
+    def submit(self, function, **kwargs):
+        """Run function(messages=, stop_flag=, want_frames=, **kwargs) in the process."""
+        if not self.process.is_alive():
+            print(f"{self.name} exited with code {self.process.exitcode}, starting a new one")
+            self.start()
+        self.cancel.clear()
+        self.want_frames.value = 0
+        self.tasks.put((function, kwargs))
+
+    def receive(self, timeout=1.0):
+        """Next message of the running task; raises RuntimeError if the process died."""
+        while True:
+            try:
+                return self.messages.get(timeout=timeout)
+            except queue.Empty:
+                if self.process.is_alive():
+                    continue
+            code = self.process.exitcode
+            print(f"{self.name} exited with code {code}, starting a new one")
+            self.start()
+            raise RuntimeError(f"Worker process exited with code {code}")
+
+    def models(self):
+        """The models resident in the process (see ModelRegistry.stats), as of its last job."""
+        while True:
+            try:
+                self._models = self.status.get_nowait()
+            except queue.Empty:
+                return self._models
+
+    def stop(self, timeout=5.0):
+        if self.process is None or not self.process.is_alive():
+            return
+        self.cancel.set()
+        self.tasks.put(None)
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+# ============== Scheduler ==============
+class JobScheduler:
+    """
+    Bounded pool of worker processes pulling processing jobs from a FIFO queue.
+
+    Each job is persisted to its own <state_dir>/<job_id>.json when its state changes, and
+    the saved jobs are loaded by start(). A job drops its PipelineSession once it finishes,
+    and only the `max_finished` most recently finished jobs are kept.
+
+    Every worker is a WorkerProcess limited to threads_per_job torch / OpenCV intra-op
+    threads, so jobs neither share a GIL nor a thread pool. A thread of the API process per
+    worker hands it jobs and relays each job's frames, metadata and metrics into the job's
+    PipelineSession (see PipelineSession.run_in), which /stream and /events read from.
+    """
+
+    def __init__(self, state_dir, make_session, max_workers=None, threads_per_job=None, on_finish=None,
+                 max_finished=500, worker_init=None):
+        cores = os.cpu_count() or 1
+        self.threads_per_job = threads_per_job or max(1, min(4, cores))
+        self.max_workers = max_workers or max(1, cores // self.threads_per_job)
+        self.max_finished = max_finished
+        self.state_dir = state_dir
+        self.make_session = make_session
+        self.on_finish = on_finish  # called with each job once it leaves the active states
+        self.worker_init = worker_init  # run first in each worker process (picklable)
+        self._jobs = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._processes = []
+
+    # ---- persistence ----
+    def _load(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        records = []
+        for path in glob.glob(os.path.join(self.state_dir, "*.json")):
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Could not read job state {path}: {e}")
+                continue
+            # jobs.json of earlier versions holds a list of every job
+            records.extend(data if isinstance(data, list) else [data])
+        legacy_path = os.path.join(self.state_dir, "jobs.json")
+        legacy = os.path.exists(legacy_path)
+        for record in sorted(records, key=lambda record: record.get("created_at") or 0):
+            job = Job.from_dict(record)
+            interrupted = job.state == "running"
+            if interrupted:
+                job.state = "failed"
+                job.error = "interrupted by backend restart"
+                job.finished_at = time.time()
+            self._jobs[job.id] = job
+            if legacy or interrupted:
+                self._save(job)
+            if job.state == "queued":
+                job.session = self.make_session(job)
+                self._queue.put(job)
+        if legacy:
+            os.remove(legacy_path)  # every job now has its own file
+        with self._lock:
+            self._prune()
+
+    def _job_path(self, job_id):
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _save(self, job):
+        # Caller holds self._lock (or is still loading)
+        path = self._job_path(job.id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def _set_state(self, job, state, error=None):
+        with self._lock:
+            job.state = state
+            if state not in ACTIVE_STATES:
+                job.finished_at = time.time()
+            job.error = error
+            self._save(job)
+            if state not in ACTIVE_STATES:
+                self._release(job)
+
+    def _release(self, job):
+        # Caller holds self._lock. Finished jobs keep their record but not the frames and
+        # models their session holds; viewers already attached keep their own reference.
+        job.session = None
+        self._prune()
+
+    def _prune(self):
+        # Caller holds self._lock
+        finished = sorted((job for job in self._jobs.values() if job.state not in ACTIVE_STATES),
+                          key=lambda job: job.finished_at or 0)
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job.id]
+            try:
+                os.remove(self._job_path(job.id))
+            except OSError:
+                pass
+
+    # ---- workers ----
+    def start(self):
+        if self._workers:
+            return
+        # Loaded here rather than in __init__: a spawned process that re-imports the module
+        # creating the scheduler must not touch the job files
+        self._load()
+        for i in range(self.max_workers):
+            process = WorkerProcess(f"job-worker-{i}", self.threads_per_job, self.worker_init).start()
+            self._processes.append(process)
+            t = threading.Thread(target=self._worker, args=(process,), name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+        atexit.register(self.stop)
+        print(f"Job scheduler: {self.max_workers} worker processes with {self.threads_per_job} intra-op threads each")
+
+    def stop(self):
+        """Stop the worker processes; jobs still running are cancelled."""
+        for process in self._processes:
+            process.stop()
+
+    def _claim(self, job):
+        with self._lock:
+            if job.state != "queued":
+                return False  # cancelled while waiting
+            job.state = "running"
+            job.started_at = time.time()
+            self._save(job)
+            return True
+
+    def _worker(self, process):
+        while True:
+            job = self._queue.get()
+            if not self._claim(job):
+                continue
+            try:
+                job.session.run_in(process)
+            except Exception as e:
+                print(f"Job {job.id} failed: {e}")
+                self._set_state(job, "failed", error=str(e))
+            else:
+                job.summary = job.session.stats
+                self._set_state(job, "cancelled" if job.session.cancelled() else "done")
+            self._finished(job)
+
+    def _finished(self, job):
+        if self.on_finish is None:
+            return
+        try:
+            self.on_finish(job)
+        except Exception as e:
+            print(f"Job {job.id} finish hook failed: {e}")
+
+    # ---- API ----
+    def submit(self, camera_key, params):
+        """Queue a job. Returns (job, None), or (None, active_job) if the camera is already busy."""
+        with self._lock:
+            active = self._active_for_camera(camera_key)
+            if active is not None:
+                return None, active
+            job = Job(camera_key, params)
+            job.session = self.make_session(job)
+            self._jobs[job.id] = job
+            self._save(job)
+        self._queue.put(job)
+        return job, None
+
+    def cancel(self, job_id):
+        dequeued = False
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.state not in ACTIVE_STATES:
+                return job
+            if job.session is not None:
+                job.session.stop()
+            if job.state == "queued":
+                job.state = "cancelled"
+                job.finished_at = time.time()
+                if job.session is not None:
+                    job.session.close()
+                self._save(job)
+                self._release(job)
+                dequeued = True
+        if dequeued:
+            self._finished(job)
+        return job
+
+    def _active_for_camera(self, camera_key):
+        for job in self._jobs.values():
+            if job.camera_key == camera_key and job.state in ACTIVE_STATES:
+                return job
+        return None
+
+    def active_for_camera(self, camera_key):
+        with self._lock:
+            return self._active_for_camera(camera_key)
+
+    def latest_for_camera(self, camera_key):
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.camera_key == camera_key]
+        return max(jobs, key=lambda job: job.created_at) if jobs else None
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def models(self):
+        """Models resident in each worker process (see ModelRegistry.stats), tagged with its name."""
+        return [dict(info, worker=process.name) for process in self._processes for info in process.models()]
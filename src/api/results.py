@@ -0,0 +1,206 @@
+# src/api/results.py
+import os
+import json
+import time
+import shutil
+import threading
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from src.detection.fingerprint import video_fingerprint, weights_hash, settings_hash
+
+RESULT_VERSION = 1
+# Results directory budget; least recently used finished results are removed beyond it
+DEFAULT_MAX_BYTES = int(float(os.environ.get("PIZZA_RESULTS_MAX_GB", "20")) * 1024 ** 3)
+
+# Session parameters that change what a run writes. batch_size and resume do not.
+RESULT_PARAMS = ("conf_thres", "count_polygon", "roi_padding", "adaptive", "proximity", "parquet",
+                 "shards", "video_mode", "backend", "tracker_backend")
+
+# ============== Result keys ==============
+def result_key(camera_key, video_path, model_path, params):
+    """
+    Content address of a /process run: the camera, the video (size plus a hash of chunks sampled
+    across the file), the model weights, the counting zone and every parameter in RESULT_PARAMS.
+    Renaming, copying or touching the video keeps the key; re-encoding or trimming it does not.
+    """
+    settings = {name: params.get(name) for name in RESULT_PARAMS}
+    return settings_hash(RESULT_VERSION, camera_key, video_fingerprint(video_path), weights_hash(model_path), settings)
+
+def live_key(camera_key):
+    """Live streams are not content-addressable: one slot per camera, never a cache hit."""
+    return f"live-{camera_key}"
+
+# ============== Result store ==============
+class ResultStore:
+    """
+    Results directory laid out as <root>/<key>/counted_<camera>.mp4 (+ _sales.csv, clips,
+    Parquet parts), with an index of every entry's state, size and last access, and the
+    latest key per camera so /results/<camera> keeps working.
+
+    Only "done" entries are cache hits. After each run the least recently used entries are
+    deleted until the directory fits in `max_bytes`; entries of queued or running jobs
+    (`active_keys()`) are never deleted.
+    """
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES, active_keys=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.active_keys = active_keys or (lambda: set())
+        self.index_path = os.path.join(root, "index.json")
+        self._lock = threading.Lock()
+        self._entries = {}  # key: {"camera", "state", "created_at", "last_access", "bytes", "summary"}
+        self._latest = {}   # camera: key
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    # ---- persistence ----
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not read result index {self.index_path}: {e}")
+            return
+        self._entries = {key: entry for key, entry in data.get("entries", {}).items()
+                         if os.path.isdir(os.path.join(self.root, key))}
+        self._latest = {camera: key for camera, key in data.get("latest", {}).items() if key in self._entries}
+        for entry in self._entries.values():
+            if entry["state"] == "running":
+                # Interrupted by a restart; a requeued job marks it again when it finishes
+                entry["state"] = "failed"
+
+    def _save(self):
+        # Caller holds self._lock
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"entries": self._entries, "latest": self._latest}, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    # ---- entries ----
+    def output_path(self, key, camera_key):
+        return os.path.join(self.root, key, f"counted_{camera_key}.mp4")
+
+    def lookup(self, key):
+        """A finished entry for `key` whose files are still on disk (marked as used), or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["state"] != "done":
+                return None
+            output_path = self.output_path(key, entry["camera"])
+            if not os.path.exists(output_path.replace(".mp4", "_sales.csv")):
+                return None
+            entry["last_access"] = time.time()
+            self._latest[entry["camera"]] = key
+            self._save()
+            return dict(entry, key=key, output_path=output_path)
+
+    def begin(self, key, camera_key):
+        """
+        Reserve `key` for a new run and make it the camera's latest result.
+        Returns (output path, undo state); pass the latter to abort() if the run is never queued.
+        """
+        output_path = self.output_path(key, camera_key)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        now = time.time()
+        with self._lock:
+            previous = self._entries.get(key)
+            latest = self._latest.get(camera_key)
+            entry = {
+                "camera": camera_key,
+                "state": "running",
+                "created_at": (previous or {}).get("created_at", now),
+                "last_access": now,
+                "bytes": (previous or {}).get("bytes", 0),
+                "summary": None
+            }
+            self._entries[key] = entry
+            self._latest[camera_key] = key
+            self._save()
+        return output_path, (previous, latest, entry)
+
+    def abort(self, output_path, previous):
+        """Undo begin() for a run that was never queued: cancel the entry if begin created it, else restore it."""
+        key = os.path.basename(os.path.dirname(output_path))
+        entry, latest, ours = previous
+        with self._lock:
+            if self._entries.get(key) is not ours:
+                return  # another request has begun this key since; it owns the entry now
+            if latest in self._entries:
+                self._latest[ours["camera"]] = latest
+            if entry is not None:
+                self._entries[key] = entry
+                self._save()
+                return
+        self.finish(output_path, "cancelled")
+
+    def finish(self, output_path, state, summary=None):
+        """Record how the run writing `output_path` ended (done / failed / cancelled), then evict."""
+        key = os.path.basename(os.path.dirname(output_path))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["state"] = state
+                entry["summary"] = summary
+                entry["bytes"] = _dir_size(os.path.join(self.root, key))
+                self._save()
+        self.evict()
+
+    def resolve(self, video_id):
+        """Output path for a result key, or for the camera's latest result."""
+        with self._lock:
+            key = video_id if video_id in self._entries else self._latest.get(video_id)
+            if key is None:
+                return None
+            entry = self._entries[key]
+            entry["last_access"] = time.time()
+            return dict(entry, key=key, output_path=self.output_path(key, entry["camera"]))
+
+    def list(self):
+        with self._lock:
+            return [dict(entry, key=key) for key, entry in
+                    sorted(self._entries.items(), key=lambda item: item[1]["last_access"], reverse=True)]
+
+    # ---- eviction ----
+    def evict(self):
+        """Delete least recently used inactive entries until the results fit in max_bytes."""
+        active = self.active_keys()
+        removed, trash_dirs = [], []
+        with self._lock:
+            total = sum(entry["bytes"] for entry in self._entries.values())
+            candidates = sorted(
+                (key for key, entry in self._entries.items() if key not in active and entry["state"] != "running"),
+                key=lambda key: self._entries[key]["last_access"]
+            )
+            for key in candidates:
+                if total <= self.max_bytes:
+                    break
+                total -= self._entries.pop(key)["bytes"]
+                # Moved aside under the lock so a new run of the same key starts from an empty directory
+                trash = os.path.join(self.root, f".evicted-{key}")
+                try:
+                    os.replace(os.path.join(self.root, key), trash)
+                except OSError:
+                    trash = None  # already gone
+                removed.append(key)
+                trash_dirs.append(trash)
+            if removed:
+                self._latest = {camera: key for camera, key in self._latest.items() if key in self._entries}
+                self._save()
+        for key, trash in zip(removed, trash_dirs):
+            if trash is not None:
+                shutil.rmtree(trash, ignore_errors=True)
+            print(f"Evicted result {key}")
+        return removed
+
+
+def _dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                continue
+    return total
@@ -1,3 +1,16 @@
+# Padding (px) around the counting polygon used when detection runs on a region of interest.
+# It must leave room for pizzas to be tracked *before* they cross into the polygon.
+DEFAULT_ROI_PADDING = 200
+
+# Duplicate suppression: a track first seen inside the zone is not counted if another track
+# was lost within `radius` px less than `match_frames` ago. Lost positions are kept for
+# `retain_frames`. Override per camera with a "proximity" dict.
+DEFAULT_PROXIMITY = {"radius": 40, "match_frames": 20, "retain_frames": 30}
+
+# Each camera defines "count_polygon" (or legacy "count_box") with any number of x1/y1..xN/yN
+# vertices, or "count_polygons": [polygon, ...] to count entries into several zones.
+# "detector_backend" optionally picks the detector for the camera (torch, onnx, onnx-int8, openvino)
+# and "tracker_backend" its tracker (deepsort, deepsort-sparse, iou).
 CAMERA_ZONES = {
     "1461_CH01": {
         "count_box": {
@@ -5,7 +18,8 @@ CAMERA_ZONES = {
             'x2': 682, 'y2': 400, 
             'x3': 1388, 'y3': 342, 
             'x4': 1324, 'y4': 78},
-        "direction": "in"  # or "out", for future logic
+        "direction": "in",  # or "out", for future logic
+        "roi_padding": 200
     },
     "1462_CH03": {
         "count_box": {
@@ -13,7 +27,8 @@ CAMERA_ZONES = {
             'x2': 560, 'y2': 1034, 
             'x3': 1256, 'y3': 934, 
             'x4': 834, 'y4': 328},
-        "direction": "in"
+        "direction": "in",
+        "roi_padding": 160
     },
     "1462_CH04": {
         "count_box": {
@@ -21,7 +36,8 @@ CAMERA_ZONES = {
             'x2': 250, 'y2': 1064, 
             'x3': 1128, 'y3': 1076, 
             'x4': 1390, 'y4': 594},
-        "direction": "in"
+        "direction": "in",
+        "roi_padding": 160
     },
     "1464_CH02": {
         "count_box": {
@@ -29,7 +45,8 @@ CAMERA_ZONES = {
             'x2': 946, 'y2': 1074, 
             'x3': 1278, 'y3': 1074, 
             'x4': 1424, 'y4': 776},
-        "direction": "in"
+        "direction": "in",
+        "roi_padding": 240
     },
     "1465_CH02":{
         "count_polygon": {
@@ -37,7 +54,8 @@ CAMERA_ZONES = {
             'x2': 202, 'y2': 1076, 
             'x3': 660, 'y3': 1076, 
             'x4': 658, 'y4': 696},
-        "direction": "in"
+        "direction": "in",
+        "roi_padding": 240
     },
     "1467_CH04": {
         "count_polygon": {
@@ -46,6 +64,7 @@ CAMERA_ZONES = {
             "x3": 1252, "y3": 1064,
             "x4": 1598, "y4": 468
         },
-        "direction": "in"
+        "direction": "in",
+        "roi_padding": 200
     }
 }
\ No newline at end of file
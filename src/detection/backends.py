@@ -0,0 +1,272 @@
+# src/detection/backends.py
+import os
+import ast
+import time
+import numpy as np
+import cv2
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from src.detection.utils import iou_matrix
+
+DETECTOR_BACKENDS = ("torch", "onnx", "onnx-int8", "openvino")
+DEFAULT_BACKEND = os.environ.get("PIZZA_DETECTOR_BACKEND", "torch")
+
+# ============== Detections ==============
+class FrameDetections:
+    """Detections of one frame as arrays: boxes (N, 4) xyxy in frame pixels, scores (N,), classes (N,)."""
+    __slots__ = ("boxes", "scores", "classes")
+
+    def __init__(self, boxes, scores, classes):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        self.classes = np.asarray(classes, dtype=np.int32).reshape(-1)
+
+    def __len__(self):
+        return len(self.scores)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros((0, 4)), np.zeros(0), np.zeros(0))
+
+
+# ============== Backends ==============
+class TorchBackend:
+    """
+    The ultralytics PyTorch model (the original path).
+    Like every backend, it leaves the seconds spent per stage of its last call
+    (preprocess, inference, nms) in `last_timings`.
+    """
+    name = "torch"
+
+    def __init__(self, model_path, device=None):
+        from ultralytics import YOLO
+        self.model = YOLO(model_path)
+        self.device = device
+        self.names = self.model.model.names
+        self.last_timings = {}
+
+    def predict(self, frames):
+        results = self.model(frames, device=self.device, verbose=False)
+        # ultralytics reports per-image milliseconds; postprocess is mostly NMS
+        self.last_timings = {
+            stage: sum(r.speed.get(key) or 0.0 for r in results) / 1000
+            for stage, key in (("preprocess", "preprocess"), ("inference", "inference"), ("nms", "postprocess"))
+        }
+        return [
+            FrameDetections(r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy(), r.boxes.cls.cpu().numpy())
+            for r in results
+        ]
+
+
+def letterbox(frame, size, color=(114, 114, 114)):
+    """Resize keeping the aspect ratio and pad to size x size. Returns (image, gain, (pad_x, pad_y))."""
+    h, w = frame.shape[:2]
+    gain = min(size / h, size / w)
+    new_w, new_h = round(w * gain), round(h * gain)
+    if (new_w, new_h) != (w, h):
+        frame = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size - new_w) / 2, (size - new_h) / 2
+    top, bottom = round(pad_y - 0.1), round(pad_y + 0.1)
+    left, right = round(pad_x - 0.1), round(pad_x + 0.1)
+    image = cv2.copyMakeBorder(frame, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return image, gain, (left, top)
+
+
+class OnnxBackend:
+    """
+    A YOLOv8 model exported to ONNX (dynamic batch), run with ONNX Runtime.
+    Frames are letterboxed to `imgsz`, decoded from the raw (B, 4 + classes, anchors) output
+    and filtered with class-aware NMS, matching ultralytics' conf/iou defaults.
+    providers: ONNX Runtime execution providers to try, in order (CPU is always the fallback).
+    """
+    name = "onnx"
+
+    def __init__(self, onnx_path, imgsz=640, conf=0.25, iou=0.7, max_det=300, providers=None, threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = int(threads)
+        available = ort.get_available_providers()
+        providers = [p for p in (providers or []) if p in available] + ["CPUExecutionProvider"]
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        self.max_det = max_det
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(meta["names"]) if "names" in meta else {}
+        self.providers = self.session.get_providers()
+        self.last_timings = {}
+
+    def _preprocess(self, frames):
+        batch, transforms = [], []
+        for frame in frames:
+            image, gain, pad = letterbox(frame, self.imgsz)
+            batch.append(image)
+            transforms.append((gain, pad, frame.shape[:2]))
+        # BGR HWC uint8 -> RGB CHW float in [0, 1]
+        x = np.stack(batch)[..., ::-1].transpose(0, 3, 1, 2)
+        return np.ascontiguousarray(x, dtype=np.float32) / 255.0, transforms
+
+    def _postprocess(self, pred, gain, pad, shape):
+        pred = pred.T  # (anchors, 4 + classes)
+        class_scores = pred[:, 4:]
+        classes = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(classes)), classes]
+        keep = scores >= self.conf
+        if not keep.any():
+            return FrameDetections.empty()
+        xywh, scores, classes = pred[keep, :4], scores[keep], classes[keep]
+        # NMSBoxesBatched wants top-left x, y, w, h
+        tlwh = np.concatenate([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, 2:]], axis=1)
+        idx = cv2.dnn.NMSBoxesBatched(tlwh.tolist(), scores.tolist(), classes.tolist(), self.conf, self.iou)
+        idx = np.asarray(idx, dtype=np.int64).reshape(-1)[:self.max_det]
+        tlwh, scores, classes = tlwh[idx], scores[idx], classes[idx]
+        boxes = np.concatenate([tlwh[:, :2], tlwh[:, :2] + tlwh[:, 2:]], axis=1)
+        # Undo the letterbox and clip to the frame
+        boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad[0]) / gain).clip(0, shape[1])
+        boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad[1]) / gain).clip(0, shape[0])
+        return FrameDetections(boxes, scores, classes)
+
+    def predict(self, frames):
+        if not len(frames):
+            return []
+        t0 = time.perf_counter()
+        x, transforms = self._preprocess(frames)
+        t1 = time.perf_counter()
+        preds = self.session.run(None, {self.input_name: x})[0]
+        t2 = time.perf_counter()
+        detections = [self._postprocess(pred, *t) for pred, t in zip(preds, transforms)]
+        self.last_timings = {"preprocess": t1 - t0, "inference": t2 - t1, "nms": time.perf_counter() - t2}
+        return detections
+
+
+# ============== Export ==============
+def _is_stale(path, source):
+    return not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(source)
+
+def export_onnx(model_path, imgsz=640, int8=False):
+    """
+    ONNX export of a .pt model next to it (models/yolov8l.onnx, models/yolov8l.int8.onnx),
+    redone only when the weights are newer. int8 applies ONNX Runtime dynamic quantization
+    (int8 weights, activations quantized at run time), which needs no calibration data.
+    """
+    if model_path.endswith(".onnx"):
+        return model_path
+    onnx_path = os.path.splitext(model_path)[0] + ".onnx"
+    if _is_stale(onnx_path, model_path):
+        from ultralytics import YOLO
+        print(f"Exporting {model_path} to ONNX")
+        exported = YOLO(model_path).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+        if os.path.abspath(exported) != os.path.abspath(onnx_path):
+            os.replace(exported, onnx_path)
+    if not int8:
+        return onnx_path
+    int8_path = os.path.splitext(model_path)[0] + ".int8.onnx"
+    if _is_stale(int8_path, onnx_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        print(f"Quantizing {onnx_path} to INT8")
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+    return int8_path
+
+def load_backend(backend, model_path, device=None, imgsz=640):
+    """Instantiate one of DETECTOR_BACKENDS for `model_path` (a .pt file; ONNX files are exported from it)."""
+    if backend == "torch":
+        return TorchBackend(model_path, device=device)
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxBackend(export_onnx(model_path, imgsz, int8=backend == "onnx-int8"), imgsz=imgsz)
+    if backend == "openvino":
+        # ONNX Runtime with the OpenVINO execution provider (onnxruntime-openvino), CPU otherwise
+        return OnnxBackend(export_onnx(model_path, imgsz), imgsz=imgsz, providers=["OpenVINOExecutionProvider"])
+    raise ValueError(f"Unknown detector backend: {backend} (expected one of {', '.join(DETECTOR_BACKENDS)})")
+
+
+# ============== Parity and benchmark ==============
+def match_detections(reference, candidate, conf_thres=0.5, iou_thres=0.8, score_tol=0.1):
+    """
+    Greedily pair confident reference boxes with candidate boxes of the same class.
+    Returns (matched, missed, extra): a pair matches at IoU >= iou_thres and a score
+    difference <= score_tol; `extra` are confident candidate boxes left unmatched.
+    """
+    ref = np.flatnonzero(reference.scores >= conf_thres)
+    cand = np.flatnonzero(candidate.scores >= conf_thres)
+    if not len(ref) or not len(cand):
+        return 0, len(ref), len(cand)
+    ious = iou_matrix(reference.boxes[ref], candidate.boxes[cand])
+    ious[reference.classes[ref][:, None] != candidate.classes[cand][None, :]] = 0
+    matched, used = 0, set()
+    for i in np.argsort(-reference.scores[ref]):
+        j = int(ious[i].argmax())
+        if ious[i, j] < iou_thres:
+            continue
+        if abs(float(reference.scores[ref[i]]) - float(candidate.scores[cand[j]])) > score_tol:
+            continue
+        used.add(j)
+        ious[:, j] = 0  # each candidate box matches once
+        matched += 1
+    return matched, len(ref) - matched, len(cand) - len(used)
+
+def sample_frames(video_path, n=16):
+    """`n` frames spread evenly over a video."""
+    cap = cv2.VideoCapture(video_path)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frames = []
+    for idx in np.linspace(0, max(0, total - 1), n).astype(int):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(idx))
+        ret, frame = cap.read()
+        if ret:
+            frames.append(frame)
+    cap.release()
+    return frames
+
+def benchmark(backend, frames, batch_size=1, warmup=2, repeats=3):
+    """Per-frame latency (ms) of `backend` over `frames`: mean, p50 and p90 of the batch times."""
+    batches = [frames[i:i + batch_size] for i in range(0, len(frames), batch_size)]
+    for batch in batches[:warmup]:
+        backend.predict(batch)
+    per_frame = []
+    for _ in range(repeats):
+        for batch in batches:
+            start = time.perf_counter()
+            backend.predict(batch)
+            per_frame.append(1000 * (time.perf_counter() - start) / len(batch))
+    per_frame = np.array(per_frame)
+    return {
+        "mean_ms": round(float(per_frame.mean()), 2),
+        "p50_ms": round(float(np.percentile(per_frame, 50)), 2),
+        "p90_ms": round(float(np.percentile(per_frame, 90)), 2)
+    }
+
+def compare_backends(model_path, frames, backends=("torch", "onnx", "onnx-int8"), batch_size=1,
+                     conf_thres=0.5, iou_thres=0.8, score_tol=0.1, min_recall=0.95):
+    """
+    Check every backend against the first one on `frames` and benchmark them all.
+    A backend passes parity when it recovers at least `min_recall` of the reference's
+    confident boxes (see match_detections) and adds no more than that fraction in extras.
+    """
+    loaded = {name: load_backend(name, model_path) for name in backends}
+    reference_name = backends[0]
+    reference = loaded[reference_name].predict(frames)
+    report = {}
+    for name, backend in loaded.items():
+        entry = {"latency": benchmark(backend, frames, batch_size=batch_size)}
+        if name != reference_name:
+            matched = missed = extra = 0
+            for ref, cand in zip(reference, backend.predict(frames)):
+                m, mi, ex = match_detections(ref, cand, conf_thres, iou_thres, score_tol)
+                matched, missed, extra = matched + m, missed + mi, extra + ex
+            total = matched + missed
+            recall = matched / total if total else 1.0
+            entry.update(matched=matched, missed=missed, extra=extra, recall=round(recall, 4),
+                         parity=recall >= min_recall and extra <= (1 - min_recall) * max(total, 1))
+        report[name] = entry
+    return report
+
+
+if __name__ == "__main__":
+    import json
+    frames = sample_frames("data/raw_videos/cut_video_test/1465_CH02_20250607170555_172408 - Trim.mp4", n=16)
+    report = compare_backends("models/yolov8l.pt", frames, batch_size=4)
+    print(json.dumps(report, indent=2))
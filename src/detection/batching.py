@@ -0,0 +1,172 @@
+# src/detection/batching.py
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from src.detection.model_registry import REGISTRY
+
+# ============== Batched inference ==============
+class BatchedDetector:
+    """
+    Runs frames from any number of callers (one video, or several cameras at once)
+    through a shared detector (see backends.py) in as few forward passes as possible.
+
+    Each caller submits its own chunk of frames and gets the per-frame results back
+    in the same order, so every camera keeps feeding its own tracker sequentially.
+    A caller's StageTimer is credited its share (by frame count) of each batch's
+    preprocess / inference / nms time.
+
+    Callers register() before submitting and unregister() when done. A detector replaced
+    by a reloaded model is retired: it keeps serving its clients and shuts down when the
+    last one unregisters. Submitting to a closed detector raises RuntimeError.
+    """
+
+    def __init__(self, model_entry, max_batch_size=8, max_wait_ms=10):
+        self.model_entry = model_entry
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max_wait_ms / 1000.0
+        self._requests = queue.Queue()
+        self._clients = 0
+        self._closed = False
+        self._retired = False
+        self._clients_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # ---- clients ----
+    def register(self):
+        with self._clients_lock:
+            self._clients += 1
+
+    def unregister(self):
+        with self._clients_lock:
+            self._clients = max(0, self._clients - 1)
+            if self._retired and not self._clients:
+                self._close()
+
+    def retire(self):
+        """Close once no client is left (now, if there is none)."""
+        with self._clients_lock:
+            self._retired = True
+            if not self._clients:
+                self._close()
+
+    def submit(self, frames, timer=None):
+        fut = Future()
+        with self._clients_lock:
+            if self._closed:
+                raise RuntimeError("BatchedDetector is closed")
+            self._requests.put((list(frames), fut, timer))
+        return fut
+
+    def detect(self, frames, timer=None):
+        return self.submit(frames, timer).result()
+
+    def pending(self):
+        """Requests waiting for the model, from every caller."""
+        return self._requests.qsize()
+
+    def close(self):
+        with self._clients_lock:
+            self._close()
+
+    def _close(self):
+        # Caller holds self._clients_lock; nothing is queued after the sentinel
+        if not self._closed:
+            self._closed = True
+            self._requests.put(None)
+
+    # ---- worker ----
+    def _collect(self):
+        first = self._requests.get()
+        if first is None:
+            return None
+        batch = [first]
+        n_frames = len(first[0])
+        # Only wait for more work when other cameras could contribute to this batch
+        deadline = time.monotonic() + self.max_wait
+        while n_frames < self.max_batch_size and self._clients > 1:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                req = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if req is None:
+                self._requests.put(None)
+                break
+            batch.append(req)
+            n_frames += len(req[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                self._fail_pending()
+                return
+            frames = [frame for req_frames, _, _ in batch for frame in req_frames]
+            try:
+                results = []
+                timings = {}
+                model = self.model_entry.model
+                with self.model_entry.lock:
+                    for i in range(0, len(frames), self.max_batch_size):
+                        results.extend(model.predict(frames[i:i + self.max_batch_size]))
+                        for stage, seconds in getattr(model, "last_timings", {}).items():
+                            timings[stage] = timings.get(stage, 0.0) + seconds
+            except Exception as e:
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+                continue
+            # Route results back to each caller in submission order
+            offset = 0
+            for req_frames, fut, timer in batch:
+                if timer is not None and frames:
+                    share = len(req_frames) / len(frames)
+                    for stage, seconds in timings.items():
+                        timer.add(stage, seconds * share)
+                fut.set_result(results[offset:offset + len(req_frames)])
+                offset += len(req_frames)
+
+    def _fail_pending(self):
+        while True:
+            try:
+                req = self._requests.get_nowait()
+            except queue.Empty:
+                return
+            if req is not None:
+                req[1].set_exception(RuntimeError("BatchedDetector is closed"))
+
+
+_detectors = {}
+_detectors_lock = threading.Lock()
+
+def get_batched_detector(model_entry, max_batch_size=8, max_wait_ms=10):
+    """
+    One shared BatchedDetector per loaded model, so concurrent cameras batch together.
+    The caller is registered as a client and must unregister() when done.
+    """
+    with _detectors_lock:
+        detector = _detectors.get(model_entry.key)
+        if detector is None or detector.model_entry is not model_entry:
+            if detector is not None:
+                detector.retire()  # the model was reloaded; its current clients finish on the old one
+            detector = BatchedDetector(model_entry, max_batch_size, max_wait_ms)
+            _detectors[model_entry.key] = detector
+        detector.register()  # under the lock, so it cannot be retired in between
+        return detector
+
+def _model_evicted(entry):
+    """Registry callback: drop the unloaded model's detector so its weights and thread go too."""
+    with _detectors_lock:
+        detector = _detectors.get(entry.key)
+        if detector is None or detector.model_entry is not entry:
+            return
+        del _detectors[entry.key]
+    detector.retire()  # closes now, or when a client still using it unregisters
+
+REGISTRY.on_evict(_model_evicted)
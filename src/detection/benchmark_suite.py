@@ -0,0 +1,390 @@
+# src/detection/benchmark_suite.py
+import os
+import json
+import time
+import platform
+import argparse
+import subprocess
+import threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import cv2
+import numpy as np
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from src.detection.backends import FrameDetections
+from src.detection.model_registry import REGISTRY, DEFAULT_MODEL_PATH
+from src.detection.fingerprint import settings_hash
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+BENCHMARK_DIR = os.path.join(project_root, "data", "benchmarks")
+
+# Synthetic scene: pizzas slide in from the left along three lanes and stop inside the
+# counting polygon (each one is a sale); decoys cross the frame below it and never count.
+SYNTHETIC_DEFAULTS = dict(width=960, height=540, fps=25, seconds=30, pizzas=8, decoys=3, seed=0)
+SYNTHETIC_POLYGON = {'x1': 560, 'y1': 150, 'x2': 560, 'y2': 420, 'x3': 820, 'y3': 420, 'x4': 820, 'y4': 150}
+PIZZA_RADIUS = 28
+PIZZA_BGR = (40, 140, 230)
+LANES = (200, 285, 370)
+DECOY_LANE = 480
+
+# ============== Synthetic videos ==============
+def _draw_pizza(frame, cx, cy, toppings):
+    cv2.circle(frame, (cx, cy), PIZZA_RADIUS, (30, 105, 190), -1)      # crust
+    cv2.circle(frame, (cx, cy), PIZZA_RADIUS - 5, PIZZA_BGR, -1)
+    for dx, dy in toppings:
+        cv2.circle(frame, (cx + dx, cy + dy), 3, (40, 40, 170), -1)
+
+def _pizza_paths(config):
+    """Per-object list of (frame, cx, cy) plus whether it is a sale."""
+    rng = np.random.default_rng(config["seed"])
+    frames = config["fps"] * config["seconds"]
+    polygon = SYNTHETIC_POLYGON
+    target_x = (polygon['x1'] + polygon['x3']) // 2
+    paths = []
+    spacing = max(1, (frames - 150) // max(1, config["pizzas"]))
+    for i in range(config["pizzas"]):
+        start, lane = 10 + i * spacing, LANES[i % len(LANES)]
+        speed, dwell = rng.uniform(6, 10), int(rng.integers(20, 50))
+        x, points, f = -PIZZA_RADIUS, [], start
+        while x < target_x and f < frames:
+            points.append((f, int(x), lane))
+            x += speed
+            f += 1
+        points += [(g, target_x, lane) for g in range(f, min(frames, f + dwell))]
+        paths.append((points, True))
+    for i in range(config["decoys"]):
+        start, speed = int(rng.integers(0, max(1, frames - 200))), rng.uniform(8, 12)
+        n = int((config["width"] + 2 * PIZZA_RADIUS) / speed)
+        paths.append(([(start + k, int(-PIZZA_RADIUS + k * speed), DECOY_LANE) for k in range(n)
+                       if start + k < frames], False))
+    return paths
+
+def make_synthetic_video(output_dir=None, **config):
+    """
+    Write a deterministic synthetic test video (same config, same frames) and its sidecar
+    JSON with the counting polygon, the true sale count and the frame each sale enters the
+    polygon. Reused if it already exists. Returns the video path.
+    """
+    config = {**SYNTHETIC_DEFAULTS, **config}
+    output_dir = output_dir or os.path.join(BENCHMARK_DIR, "videos")
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"synthetic_{settings_hash(config)}.mp4")
+    if os.path.exists(path) and os.path.exists(_sidecar(path)):
+        return path
+
+    rng = np.random.default_rng(config["seed"])
+    w, h, frames = config["width"], config["height"], config["fps"] * config["seconds"]
+    background = rng.integers(80, 120, (h, w, 3), dtype=np.uint8)
+    cv2.rectangle(background, (0, h - 40), (w, h), (60, 60, 60), -1)  # counter edge
+    paths = _pizza_paths(config)
+    toppings = [[tuple(rng.integers(-14, 15, 2)) for _ in range(6)] for _ in paths]
+    by_frame = {}
+    for obj, (points, _) in enumerate(paths):
+        for f, cx, cy in points:
+            by_frame.setdefault(f, []).append((obj, cx, cy))
+
+    contour = np.array([[SYNTHETIC_POLYGON[f'x{i}'], SYNTHETIC_POLYGON[f'y{i}']] for i in range(1, 5)], np.int32)
+    sales = []
+    for points, is_sale in paths:
+        entered = next((f for f, cx, cy in points if cv2.pointPolygonTest(contour, (cx, cy), False) > 0), None)
+        if is_sale and entered is not None:
+            sales.append(entered + 1)  # 1-based, as in the sales CSV
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), config["fps"], (w, h))
+    for f in range(frames):
+        frame = background.copy()
+        for obj, cx, cy in by_frame.get(f, []):
+            _draw_pizza(frame, cx, cy, toppings[obj])
+        noise = np.random.default_rng((config["seed"], f)).integers(-3, 4, frame.shape, dtype=np.int16)
+        writer.write(np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8))
+    writer.release()
+    with open(_sidecar(path), "w") as f:
+        json.dump({"config": config, "count_polygon": SYNTHETIC_POLYGON, "ground_truth": len(sales),
+                   "sale_frames": sorted(sales)}, f, indent=2)
+    print(f"Synthetic video: {path} ({frames} frames, {len(sales)} sales)")
+    return path
+
+def _sidecar(video_path):
+    return os.path.splitext(video_path)[0] + ".json"
+
+def load_ground_truth(video_path):
+    """Sidecar {count_polygon, ground_truth, sale_frames} of a benchmark video, or None."""
+    if not os.path.exists(_sidecar(video_path)):
+        return None
+    with open(_sidecar(video_path), "r") as f:
+        return json.load(f)
+
+# ============== Stub detector ==============
+class StubDetector:
+    """
+    Deterministic stand-in for the YOLO backends on synthetic videos: pizza-coloured blobs
+    found by an HSV threshold and connected components. Same interface as backends.py
+    (predict, names, last_timings), so the whole pipeline runs unchanged around it.
+    """
+    name = "stub"
+
+    def __init__(self, min_area=600):
+        self.names = {0: "pizza"}
+        self.min_area = min_area
+        self.last_timings = {}
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
+
+    def predict(self, frames):
+        results, prep, infer = [], 0.0, 0.0
+        for frame in frames:
+            start = time.perf_counter()
+            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+            mask = cv2.inRange(hsv, (5, 120, 120), (30, 255, 255))
+            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self._kernel)
+            mid = time.perf_counter()
+            n, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+            blobs = stats[1:][stats[1:, cv2.CC_STAT_AREA] >= self.min_area]
+            boxes = np.stack([blobs[:, 0], blobs[:, 1], blobs[:, 0] + blobs[:, 2], blobs[:, 1] + blobs[:, 3]], axis=1)
+            results.append(FrameDetections(boxes.astype(np.float32), np.full(len(blobs), 0.9, np.float32),
+                                           np.zeros(len(blobs), np.float32)))
+            prep += mid - start
+            infer += time.perf_counter() - mid
+        self.last_timings = {"preprocess": prep, "inference": infer, "nms": 0.0}
+        return results
+
+def register_stub_detector(model_path=DEFAULT_MODEL_PATH):
+    """Make get_detector(model_path, backend='stub') return a StubDetector in this process."""
+    return REGISTRY.get("detector:stub", model_path, None, StubDetector)
+
+# ============== Cases ==============
+class FrameClock:
+    """
+    Passed as track_and_count_pizzas' stop_flag, which the counting loop calls once per
+    frame: the gaps between calls are the per-frame latency at the counting stage.
+    """
+
+    def __init__(self):
+        self.stamps = []
+
+    def __call__(self):
+        self.stamps.append(time.perf_counter())
+        return False
+
+    def latencies(self):
+        return np.diff(self.stamps)
+
+
+def _limit_threads(threads):
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # kilobytes on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20, 1)
+
+def _run_case(case):
+    """One benchmark run, in a fresh process so peak RSS belongs to this case alone."""
+    from src.detection.counter import track_and_count_pizzas
+    from src.detection.session import PipelineSession
+    _limit_threads(case["threads"])
+    if case["backend"] == "stub":
+        register_stub_detector()
+    truth = load_ground_truth(case["video_path"]) or {}
+    if "count_polygon" not in truth:
+        # Real footage without a sidecar: the camera's configured zone, no ground truth
+        from src.detection.counter import get_camera_key
+        from src.detection.zones import camera_zone_spec
+        truth["count_polygon"] = camera_zone_spec(get_camera_key(case["video_path"]))
+    output_path = os.path.join(case["output_dir"], f"{case['name']}.mp4")
+    params = dict(conf_thres=0.5, count_polygon=truth["count_polygon"], batch_size=case["batch_size"],
+                  video_mode=case["video_mode"], backend=case["backend"], tracker_backend=case["tracker"])
+
+    clock, streamed = FrameClock(), []
+    start = time.perf_counter()
+    if case["kind"] == "stream":
+        # The /stream path: a PipelineSession publishing every annotated frame to one JPEG viewer
+        class ClockedSession(PipelineSession):
+            def _publish(self, frame, info):
+                clock()
+                super()._publish(frame, info)
+
+        session = ClockedSession(camera_key=case["name"], video_path=case["video_path"],
+                                 output_path=output_path, **params)
+
+        def viewer():
+            for jpeg in session.jpeg_frames(width=640, max_fps=None):
+                streamed.append(len(jpeg))
+
+        viewer_thread = threading.Thread(target=viewer, daemon=True)
+        viewer_thread.start()
+        session.run()
+        viewer_thread.join(timeout=5)
+        stats = session.stats
+    else:
+        stats = track_and_count_pizzas(case["video_path"], output_path, stop_flag=clock,
+                                       checkpoint_every=None, **params)
+    wall = time.perf_counter() - start
+
+    latencies = clock.latencies()
+    frames = stats["frames"]
+    result = {
+        "frames": frames,
+        "seconds": round(wall, 3),
+        "fps": round(frames / wall, 2) if wall else None,
+        "latency_p50_ms": round(1000 * float(np.percentile(latencies, 50)), 3) if len(latencies) else None,
+        "latency_p99_ms": round(1000 * float(np.percentile(latencies, 99)), 3) if len(latencies) else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "pizza_count": stats["pizza_count"],
+        # Per-stage throughput: frames per second of time spent in that stage
+        "stages": {stage: dict(s, fps=round(frames / s["total_s"], 1) if s["total_s"] else None)
+                   for stage, s in stats["stages"].items()}
+    }
+    if case["kind"] == "stream":
+        result["streamed_frames"] = len(streamed)
+        result["streamed_fps"] = round(len(streamed) / wall, 2) if wall else None
+    if "ground_truth" in truth:
+        from src.detection.tracker_benchmark import event_agreement, _event_frames
+        events = _event_frames(output_path.replace(".mp4", "_sales.csv"))
+        result["ground_truth"] = truth["ground_truth"]
+        result["count_error"] = stats["pizza_count"] - truth["ground_truth"]
+        result["matched_sales"] = event_agreement(truth["sale_frames"], events, tolerance=case["tolerance_frames"])
+    return result
+
+def _median_run(runs):
+    """The run with the median fps (latency and RSS then come from the same run)."""
+    ranked = sorted(runs, key=lambda r: r["fps"] or 0.0)
+    return dict(ranked[len(ranked) // 2], fps_runs=[r["fps"] for r in runs])
+
+def run_suite(videos=None, backend="stub", tracker="iou", kinds=("count", "annotate", "stream"),
+              repeats=3, batch_size=1, threads=4, output_dir=None, synthetic=None):
+    """
+    Benchmark every video (default: one synthetic video) for each kind of run:
+      count    - detection, tracking and counting only (video_mode='none'),
+      annotate - plus drawing and MP4 encoding (video_mode='full'),
+      stream   - a PipelineSession feeding one /stream JPEG viewer.
+    Each run is a separate process; with `repeats` > 1 the median-fps run is reported.
+    backend='stub' uses StubDetector (no model needed); any backends.DETECTOR_BACKENDS
+    runs the real model.
+    """
+    output_dir = output_dir or os.path.join(BENCHMARK_DIR, "runs")
+    os.makedirs(output_dir, exist_ok=True)
+    videos = videos or [make_synthetic_video(**(synthetic or {}))]
+    config = dict(backend=backend, tracker=tracker, repeats=repeats, batch_size=batch_size, threads=threads)
+    report = {"created_at": datetime.now().isoformat(timespec="seconds"), "environment": environment(),
+              "config": config, "cases": {}}
+
+    # spawn: CUDA and the model registry do not survive fork
+    ctx = mp.get_context("spawn")
+    for video_path in videos:
+        fps = cv2.VideoCapture(video_path).get(cv2.CAP_PROP_FPS) or 25.0
+        for kind in kinds:
+            name = f"{os.path.splitext(os.path.basename(video_path))[0]}-{kind}"
+            case = dict(config, name=name, kind=kind, video_path=video_path, output_dir=output_dir,
+                        video_mode="full" if kind == "annotate" else "none", tolerance_frames=int(fps))
+            runs = []
+            for _ in range(repeats):
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                    runs.append(pool.submit(_run_case, case).result())
+            report["cases"][name] = _median_run(runs)
+            print(f"{name}: {report['cases'][name]['fps']} fps")
+    return report
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=project_root,
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__
+    }
+
+# ============== Results and regressions ==============
+def save_report(report, path=None):
+    path = path or os.path.join(BENCHMARK_DIR, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+def compare_reports(baseline, current, tolerance=0.1, min_stage_ms=0.2):
+    """
+    Regressions of `current` against `baseline` for the cases both contain: fps down, p99
+    latency or peak RSS up by more than `tolerance` (relative), a larger count error, or a
+    stage's time per call up by more than `tolerance` and `min_stage_ms`.
+    """
+    regressions = []
+    for name, cur in current["cases"].items():
+        base = baseline["cases"].get(name)
+        if base is None:
+            continue
+
+        def worse(key, higher_is_better):
+            b, c = base.get(key), cur.get(key)
+            if not b or c is None:
+                return
+            change = (c - b) / b
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{name}: {key} {b} -> {c} ({change:+.0%})")
+
+        worse("fps", True)
+        worse("streamed_fps", True)
+        worse("latency_p99_ms", False)
+        worse("peak_rss_mb", False)
+        if abs(cur.get("count_error") or 0) > abs(base.get("count_error") or 0):
+            regressions.append(f"{name}: count error {base.get('count_error')} -> {cur.get('count_error')}")
+        for stage, s in cur.get("stages", {}).items():
+            b = base.get("stages", {}).get(stage)
+            if b and s["mean_ms"] - b["mean_ms"] > max(min_stage_ms, tolerance * b["mean_ms"]):
+                regressions.append(f"{name}: stage {stage} {b['mean_ms']} -> {s['mean_ms']} ms/call")
+    return regressions
+
+def latest_report(directory=BENCHMARK_DIR, exclude=None):
+    if not os.path.isdir(directory):
+        return None
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                   if name.startswith("benchmark_") and name.endswith(".json"))
+    paths = [p for p in paths if p != exclude]
+    return paths[-1] if paths else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput/accuracy benchmark of the counting pipeline")
+    parser.add_argument("videos", nargs="*", help="videos with a <name>.json sidecar (default: a synthetic video)")
+    parser.add_argument("--backend", default="stub", help="stub, or a real detector backend (torch, onnx, ...)")
+    parser.add_argument("--tracker", default="iou")
+    parser.add_argument("--kinds", default="count,annotate,stream")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--seconds", type=int, default=SYNTHETIC_DEFAULTS["seconds"])
+    parser.add_argument("--baseline", help="report to compare with (default: the previous one)")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    report = run_suite(args.videos, backend=args.backend, tracker=args.tracker, kinds=args.kinds.split(","),
+                       repeats=args.repeats, batch_size=args.batch_size, synthetic={"seconds": args.seconds})
+    path = save_report(report)
+    print(json.dumps(report["cases"], indent=2))
+    print(f"Benchmark report saved to: {path}")
+    baseline_path = args.baseline or latest_report(exclude=path)
+    if baseline_path:
+        with open(baseline_path, "r") as f:
+            regressions = compare_reports(json.load(f), report, tolerance=args.tolerance)
+        print(f"Compared with {baseline_path}: {len(regressions)} regression(s)")
+        for line in regressions:
+            print(f"  REGRESSION {line}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,163 @@
+# src/detection/capture.py
+import time
+import threading
+from collections import deque
+import cv2
+
+LIVE_SCHEMES = ("rtsp://", "rtsps://", "rtmp://", "http://", "https://", "udp://", "tcp://")
+
+def is_live_source(source):
+    """Stream URLs and local devices (an index like 0 / '0', or /dev/video*) are live; anything else is a file."""
+    if isinstance(source, int):
+        return True
+    source = str(source)
+    return source.isdigit() or source.lower().startswith(LIVE_SCHEMES) or source.startswith("/dev/video")
+
+def _cv2_target(source):
+    return int(source) if str(source).isdigit() else source
+
+def probe_source(source, default_fps=25.0):
+    """(width, height, fps) of a source, opening it briefly."""
+    cap = cv2.VideoCapture(_cv2_target(source))
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if (not width or not height) and cap.isOpened():
+        ret, frame = cap.read()
+        if ret:
+            height, width = frame.shape[:2]
+    cap.release()
+    # Cameras often report 0 or nonsense (e.g. 90000, the RTP clock) as their frame rate
+    if not fps or fps > 240:
+        fps = default_fps
+    return width, height, fps
+
+def open_capture(source, live=None, **live_params):
+    """
+    cv2.VideoCapture for files; LiveCapture (same read/get/release interface) for cameras
+    and stream URLs. live=True forces LiveCapture, e.g. to simulate a camera with a file.
+    """
+    if live is None:
+        live = is_live_source(source)
+    if live:
+        return LiveCapture(source, **live_params)
+    return cv2.VideoCapture(source)
+
+# ============== Live capture ==============
+class LiveCapture:
+    """
+    Grabs frames from a camera on its own thread so a slow consumer never delays the grab.
+    Only the newest `buffer_size` frames are kept (1: latest frame wins); older ones are
+    counted as dropped. When the stream fails or ends, it reconnects with exponential
+    backoff (`backoff` .. `max_backoff` seconds), forever or up to `max_retries` attempts
+    in a row. A file source is simply reopened, i.e. looped; pace=True reads it at its fps.
+
+    Duck-types the parts of cv2.VideoCapture the pipeline uses: isOpened, read, get, set,
+    release.
+    """
+
+    def __init__(self, source, buffer_size=1, backoff=0.5, max_backoff=30.0, max_retries=None, pace=False):
+        self.source = source
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retries = max_retries
+        self.pace = pace and not is_live_source(source)
+        self._frames = deque(maxlen=max(1, buffer_size))
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._closed = False
+        self._props = {}
+        self.grabbed = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self._opened = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"capture-{source}", daemon=True)
+        self._thread.start()
+        # Wait briefly for the first connection so get() can report the stream size
+        self._opened.wait(timeout=10.0)
+
+    # ---- grab thread ----
+    def _connect(self):
+        cap = cv2.VideoCapture(_cv2_target(self.source))
+        if not cap.isOpened():
+            cap.release()
+            return None
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # keep the backend from queueing stale frames, where supported
+        for prop in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT, cv2.CAP_PROP_FPS):
+            self._props[prop] = cap.get(prop)
+        self._opened.set()
+        return cap
+
+    def _run(self):
+        delay = self.backoff
+        failures = 0
+        while not self._stop.is_set():
+            cap = self._connect()
+            if cap is None:
+                failures += 1
+                if self.max_retries is not None and failures > self.max_retries:
+                    print(f"Capture {self.source}: giving up after {failures} failed attempts")
+                    break
+                print(f"Capture {self.source}: connection failed, retrying in {delay:.1f}s")
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.max_backoff)
+                continue
+            failures = 0
+            delay = self.backoff
+            interval = 1.0 / (self._props.get(cv2.CAP_PROP_FPS) or 25) if self.pace else 0.0
+            while not self._stop.is_set():
+                start = time.monotonic()
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                with self._cond:
+                    if len(self._frames) == self._frames.maxlen:
+                        self.dropped += 1
+                    self._frames.append(frame)
+                    self.grabbed += 1
+                    self._cond.notify_all()
+                if interval:
+                    self._stop.wait(max(0.0, interval - (time.monotonic() - start)))
+            cap.release()
+            if not self._stop.is_set():
+                self.reconnects += 1
+                print(f"Capture {self.source}: stream lost, reconnecting")
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._opened.set()
+
+    # ---- cv2.VideoCapture interface ----
+    def isOpened(self):
+        with self._cond:
+            return not self._closed or bool(self._frames)
+
+    def read(self):
+        """Block until a frame newer than the last one read is available; (False, None) once closed."""
+        with self._cond:
+            while not self._frames and not self._closed:
+                self._cond.wait(0.5)
+            if not self._frames or self._stop.is_set():
+                return False, None
+            self.delivered += 1
+            return True, self._frames.popleft()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return -1  # unbounded
+        return self._props.get(prop, 0.0)
+
+    def set(self, prop, value):
+        return False  # no seeking on a live stream
+
+    def release(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if threading.current_thread() is not self._thread:
+            self._thread.join(timeout=5.0)
+
+    def summary(self):
+        return (f"Capture {self.source}: grabbed {self.grabbed}, processed {self.delivered}, "
+                f"dropped {self.dropped} stale frames, {self.reconnects} reconnects")
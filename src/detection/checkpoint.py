@@ -0,0 +1,52 @@
+# src/detection/checkpoint.py
+import os
+import pickle
+import time
+
+CHECKPOINT_VERSION = 2
+
+def checkpoint_path(output_path):
+    return output_path.replace(".mp4", "_checkpoint.pkl")
+
+# ============== Checkpoints ==============
+def save_checkpoint(path, video_path, frame_idx, tracker, counter):
+    """
+    Snapshot everything needed to continue counting after `frame_idx` frames:
+    the tracker from tracking.build_tracker (DeepSort's Kalman states, appearance gallery
+    and next track id, or the IoU tracker's arrays; it holds no model since embeddings are
+    computed outside it) and the PizzaCounter state.
+    Written to a temp file and renamed, so a crash mid-write keeps the previous checkpoint.
+    """
+    state = {
+        "version": CHECKPOINT_VERSION,
+        "video_path": os.path.abspath(video_path),
+        "frame_idx": frame_idx,
+        "saved_at": time.time(),
+        "tracker": tracker,
+        "counter": counter.state()
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def load_checkpoint(path, video_path):
+    """The checkpoint at `path` if it belongs to `video_path`, else None."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+    except Exception as e:
+        print(f"Could not read checkpoint {path}: {e}")
+        return None
+    if state.get("version") != CHECKPOINT_VERSION or state.get("video_path") != os.path.abspath(video_path):
+        print(f"Ignoring checkpoint {path}: it was written for another video or version")
+        return None
+    return state
+
+def remove_checkpoint(path):
+    if os.path.exists(path):
+        os.remove(path)
@@ -1,10 +1,22 @@
 import cv2
 import sys, os
+import time
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
-import csv
-from src.config.camera_zones import CAMERA_ZONES 
-from src.detection.utils import point_in_polygon, draw_polygon
-from src.detection.tracking import pizza_tracker
+from src.config.camera_zones import DEFAULT_ROI_PADDING, DEFAULT_PROXIMITY
+from src.detection.zones import CountingZone
+from src.detection.tracking import pizza_tracker, build_tracker, replay_detections
+from src.detection.model_registry import DEFAULT_MODEL_PATH
+from src.detection.backends import DEFAULT_BACKEND
+from src.detection.detection_cache import (CacheRecorder, detection_key, tracks_key, open_detections,
+                                           open_tracks, replay_tracks)
+from src.detection.pipeline import StageTimer
+from src.detection.metrics import METRICS
+from src.detection.video_output import open_video_output
+from src.detection.scheduler import AdaptiveScheduler
+from src.detection.proximity import LostTrackIndex
+from src.detection.events import SaleEventSink, video_start_time
+from src.detection.capture import probe_source, is_live_source
+from src.detection.checkpoint import checkpoint_path, save_checkpoint, load_checkpoint, remove_checkpoint
 
 def get_camera_key(video_path):
     """Extract camera key from video filename, e.g. '1461_CH01' from '1461_CH01_20250607193711_203711.mp4'."""
@@ -12,138 +24,370 @@ def get_camera_key(video_path):
     parts = base.split("_")
     return f"{parts[0]}_{parts[1]}"
 
+# ============== Counting state ==============
+class TrackState:
+    """Everything the counting logic needs about one track: its latest position, not its history."""
+    __slots__ = ("cx", "cy", "inside", "first_frame", "last_frame", "counted")
+
+    def __init__(self, cx, cy, inside, frame_idx):
+        self.cx = cx
+        self.cy = cy
+        self.inside = inside
+        self.first_frame = frame_idx
+        self.last_frame = frame_idx
+        self.counted = False
+
+
+class PizzaCounter:
+    """
+    Per-camera counting state. A pizza is counted when its track is first seen inside the
+    zone (unless a track was just lost nearby) or when it moves from outside to inside.
+    Tracks unseen for more than `max_age` frames (the tracker's own max_age) are dropped,
+    so memory stays flat on long streams.
+
+    proximity: {"radius", "match_frames", "retain_frames"} for the recently-lost check
+    (defaults in camera_zones.DEFAULT_PROXIMITY, overridable per camera).
+    """
+
+    def __init__(self, zone, max_age=90, proximity=None):
+        self.zone = zone
+        self.max_age = max_age
+        self.tracks = {}         # track_id: TrackState
+        self.active_ids = set()  # tracks seen in the previous frame
+        self.recently_lost = LostTrackIndex(**{**DEFAULT_PROXIMITY, **(proximity or {})})
+        self.pizza_count = 0
+
+    def update(self, frame_idx, track_ids, centers):
+        """Update with this frame's track ids and centers; return the sale events it produced."""
+        events = []
+        zone = self.zone
+        # One vectorised membership test for every track center in this frame
+        inside = zone.contains(centers) if zone is not None and centers else [False] * len(centers)
+        active_ids = set()
+        for track_id, (cx, cy), curr_inside in zip(track_ids, centers, inside):
+            curr_inside = bool(curr_inside)
+            active_ids.add(track_id)
+            state = self.tracks.get(track_id)
+
+            if state is None:
+                state = self.tracks[track_id] = TrackState(cx, cy, curr_inside, frame_idx)
+                # --- Count if first detection is inside the polygon ---
+                if zone is not None and curr_inside:
+                    # Proximity check: skip if close to a recently lost track
+                    if not self.recently_lost.near(cx, cy, frame_idx):
+                        state.counted = True
+                        events.append({"frame": frame_idx, "pizza_id": track_id, "cx": cx, "cy": cy})
+            else:
+                # --- Count if crossing into the polygon ---
+                if zone is not None and not state.counted and not state.inside and curr_inside:
+                    state.counted = True
+                    events.append({"frame": frame_idx, "pizza_id": track_id, "cx": cx, "cy": cy})
+                state.cx, state.cy, state.inside = cx, cy, curr_inside
+                state.last_frame = frame_idx
+
+        # --- Proximity check: update recently lost tracks ---
+        for lost_id in self.active_ids - active_ids:
+            state = self.tracks[lost_id]
+            self.recently_lost.add(state.cx, state.cy, state.last_frame, frame_idx)
+        self.active_ids = active_ids
+
+        # --- Expire tracks the tracker itself has deleted by now ---
+        if frame_idx % self.max_age == 0:
+            self.expire(frame_idx)
+
+        self.pizza_count += len(events)
+        return events
+
+    def expire(self, frame_idx):
+        stale = [tid for tid, state in self.tracks.items() if frame_idx - state.last_frame > self.max_age]
+        for tid in stale:
+            del self.tracks[tid]
+
+    def state(self):
+        """Picklable counting state (everything but the zone) for checkpoints."""
+        return {
+            "tracks": self.tracks,
+            "active_ids": self.active_ids,
+            "recently_lost": self.recently_lost,
+            "pizza_count": self.pizza_count
+        }
+
+    def load_state(self, state):
+        self.tracks = state["tracks"]
+        self.active_ids = state["active_ids"]
+        self.recently_lost = state["recently_lost"]
+        self.pizza_count = state["pizza_count"]
+
+
 def track_and_count_pizzas(
     video_path, 
     output_path, 
     conf_thres=0.5, 
     count_polygon=None,
-    stop_flag=lambda: False
+    stop_flag=lambda: False,
+    frame_callback=None,
+    info_callback=None,
+    batch_size=1,
+    queue_size=8,
+    roi_padding=None,
+    adaptive=False,
+    idle_interval=5,
+    track_max_age=90,
+    proximity=None,
+    parquet=False,
+    resume=False,
+    checkpoint_every=60.0,
+    start_frame=0,
+    end_frame=None,
+    video_mode="full",
+    preview_width=640,
+    preview_fps=5,
+    clip_before=3.0,
+    clip_after=3.0,
+    backend=None,
+    tracker_backend="deepsort",
+    camera_key=None,
+    detection_cache=False,
+    replay=None
 ):
+    """
+    Count pizzas entering `count_polygon` and write the annotated video plus a sales CSV.
+    `count_polygon` may be a polygon dict, a list of them, or a compiled zones.CountingZone.
+    Decode, inference, tracking/counting and encoding run as separate pipeline stages
+    connected by bounded queues of `queue_size` frames; per-stage timing is printed at the end.
+
+    roi_padding: if set, detection only runs on the polygon's bounding box padded by this many pixels.
+    adaptive: run YOLO only every `idle_interval` frames while nothing moves around the polygon
+    and no track is alive; every frame otherwise.
+    Sale events are appended to the CSV as they happen (see events.SaleEventSink);
+    parquet=True also rolls them over into Parquet part files next to the CSV.
+
+    Every `checkpoint_every` seconds the frame index, tracker and counter state are saved
+    next to the output (see checkpoint.py); the checkpoint is removed once the video is done.
+    resume=True continues from that checkpoint: the capture seeks past the frames already
+    counted, the CSV keeps its rows up to there, and the annotated video of the new part is
+    written to `output_path` (the interrupted one is kept as *_until<frame>.mp4).
+
+    start_frame / end_frame: only process frames start_frame+1 .. end_frame (1-based, as in
+    the CSV), e.g. one segment of a sharded run (see sharding.py).
+
+    video_mode: 'full' annotated video at source resolution and fps; 'preview' downscaled to
+    `preview_width` px at about `preview_fps`; 'events' preview-quality clips from
+    `clip_before` s before to `clip_after` s after each sale, in *_clips/; 'none' no video
+    (frames are then not even annotated unless a frame_callback needs them).
+
+    frame_callback(frame, info) gets every annotated frame and its metadata (frame, pizza_count,
+    tracks, events); info_callback(info) only the metadata, without forcing annotation.
+
+    backend: detector backend for pizza_tracker ('torch', 'onnx', 'onnx-int8', 'openvino').
+    tracker_backend: 'deepsort', 'deepsort-sparse' (fewer appearance embeddings) or 'iou'
+    (no appearance model), see tracking.build_tracker.
+
+    camera_key: export per-stage latency histograms, fps, queue depths and dropped frames
+    under this camera on /metrics (see metrics.py).
+
+    detection_cache: persist the raw detections and tracker outputs of a whole recorded video
+    (see detection_cache.py), keyed by video content, model, backend, ROI and adaptive settings
+    (plus conf_thres and tracker for the tracks).
+    replay: count from that cache without decoding or running the model, in thousands of frames
+    per second and without video output. 'tracks' reuses the cached tracks (try other polygons
+    or proximity settings); 'detections' re-runs the tracker on the cached detections (other
+    conf_thres, tracker_backend='iou' only), storing the new tracks if detection_cache is set.
+
+    Returns {"pizza_count", "frames", "seconds", "fps", "stages"} for the processed range,
+    plus "adaptive" (frames detected / on demand, see AdaptiveScheduler.stats) with adaptive=True.
+    """
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    ckpt_path = checkpoint_path(output_path)
+    checkpoint = load_checkpoint(ckpt_path, video_path) if resume else None
+    if checkpoint:
+        start_frame = checkpoint["frame_idx"]
+        print(f"Resuming {video_path} after frame {start_frame} ({checkpoint['counter']['pizza_count']} pizzas counted so far)")
+        if video_mode in ("full", "preview") and os.path.exists(output_path):
+            os.replace(output_path, output_path.replace(".mp4", f"_until{start_frame}.mp4"))
+    else:
+        if resume:
+            print(f"No usable checkpoint at {ckpt_path}, starting from the first frame")
+        remove_checkpoint(ckpt_path)
 
-    cap = cv2.VideoCapture(video_path)
-    width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps    = cap.get(cv2.CAP_PROP_FPS)
+    live = is_live_source(video_path)
+    width, height, fps = probe_source(video_path)
 
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+    zone = CountingZone.build(count_polygon)
+    roi = None
+    if roi_padding is not None and zone is not None:
+        roi = zone.roi((width, height), roi_padding)
+        print(f"Detecting on ROI {roi} of {width}x{height} frame")
 
-    pizza_tracks = {}
-    counted_ids = set()
-    pizza_count = 0
-    sale_events = []
+    scheduler = None
+    region = None
+    if adaptive:
+        region = roi
+        if region is None and zone is not None:
+            region = zone.roi((width, height), DEFAULT_ROI_PADDING)
+        if not replay:
+            scheduler = AdaptiveScheduler(region=region, idle_interval=idle_interval)
 
-    last_positions = {}  # track_id: (cx, cy, frame_idx)
-    recently_lost = []   # [{'cx':..., 'cy':..., 'frame':...}]
+    det_key = trk_key = None
+    if detection_cache or replay:
+        if live or start_frame or end_frame is not None:
+            raise ValueError("The detection cache only covers whole recorded videos (no live source, resume or frame range)")
+        det_key = detection_key(video_path, DEFAULT_MODEL_PATH, backend or DEFAULT_BACKEND, roi,
+                                adaptive, idle_interval, region)
+        trk_key = tracks_key(det_key, conf_thres, tracker_backend)
+    if replay == "detections" and tracker_backend != "iou":
+        raise ValueError("Replaying detections needs tracker_backend='iou' (DeepSort embeds frame crops)")
+    if replay:
+        # Nothing is decoded: no frames to annotate, write or show
+        video_mode, frame_callback, checkpoint_every = "none", None, None
 
+    metrics = METRICS.camera(camera_key) if camera_key else None
+    timer = StageTimer(metrics=metrics)
+    out = open_video_output(video_mode, output_path, fps, (width, height), maxsize=queue_size, timer=timer,
+                            preview_width=preview_width, preview_fps=preview_fps,
+                            clip_before=clip_before, clip_after=clip_after, resume=bool(checkpoint))
+    annotate = out.annotate or frame_callback is not None
+    timer.watch_queue("encode", out.qsize)
+
+    counter = PizzaCounter(zone, max_age=track_max_age, proximity=proximity)
+    if checkpoint:
+        counter.load_state(checkpoint["counter"])
+        tracker = checkpoint["tracker"]
+    elif replay == "tracks":
+        tracker = None  # the cached tracks already are the tracker's output
+    else:
+        tracker = build_tracker(tracker_backend, conf_thres=conf_thres)
+    csv_path = output_path.replace(".mp4", "_sales.csv")
+    sink = SaleEventSink(
+        csv_path,
+        fps=fps,
+        start_time=None if live else video_start_time(video_path),
+        wall_clock=live,
+        parquet_dir=output_path.replace(".mp4", "_sales_parquet") if parquet else None,
+        resume_frame=start_frame if checkpoint else None
+    )
+
+    recorder = None
+    if replay == "tracks":
+        cached = open_tracks(trk_key)
+        if cached is None:
+            raise FileNotFoundError(f"No cached tracks for {video_path} with these settings; run with detection_cache=True first")
+        print(f"Replaying {len(cached)} frames of cached tracks")
+        tracker_stream = replay_tracks(cached)
+    elif replay == "detections":
+        cached = open_detections(det_key)
+        if cached is None:
+            raise FileNotFoundError(f"No cached detections for {video_path} with these settings; run with detection_cache=True first")
+        print(f"Replaying {len(cached)} frames of cached detections")
+        recorder = CacheRecorder(trk_key=trk_key) if detection_cache else None
+        tracker_stream = replay_detections(cached, tracker, conf_thres, timer=timer, recorder=recorder)
+    elif replay:
+        raise ValueError(f"Unknown replay mode: {replay} (expected 'tracks' or 'detections')")
+    else:
+        recorder = CacheRecorder(det_key, trk_key) if detection_cache else None
+        tracker_stream = pizza_tracker(video_path, conf_thres=conf_thres, batch_size=batch_size,
+                                       queue_size=queue_size, timer=timer, roi=roi,
+                                       scheduler=scheduler, start_frame=start_frame, tracker=tracker,
+                                       backend=backend, recorder=recorder)
+    finished = False
+    last_checkpoint = time.monotonic()
+    run_start = time.perf_counter()
+    frame_idx = start_frame
     try:
-        frame_idx = 0
-        for frame, tracks in pizza_tracker(video_path, conf_thres=conf_thres):
+        for frame, tracks in tracker_stream:
             if stop_flag():
                 print("Counting stopped by user.")
                 break
-            if frame is None:
+            if tracks is None or (end_frame is not None and frame_idx >= end_frame):
+                finished = True
                 break
             frame_idx += 1
-            active_ids = set()
-            for track in tracks or []:
-                x1, y1, x2, y2 = map(int, track[:4])
-                track_id = int(track[5])
-                cx = int((x1 + x2) / 2)
-                cy = int((y1 + y2) / 2)
-
-                if track_id not in pizza_tracks:
-                    pizza_tracks[track_id] = []
-                pizza_tracks[track_id].append((cx, cy))
-                active_ids.add(track_id)
+            with timer.time("count"):
+                boxes = [tuple(map(int, track[:4])) for track in tracks or []]
+                track_ids = [int(track[5]) for track in tracks or []]
+                centers = [(int((x1 + x2) / 2), int((y1 + y2) / 2)) for x1, y1, x2, y2 in boxes]
+                events = counter.update(frame_idx, track_ids, centers)
+            if events:
+                with timer.time("write"):
+                    for event in events:
+                        sink.write(event)
+            pizza_count = counter.pizza_count
 
-                # --- Count if first detection is inside the polygon ---
-                if (
-                    count_polygon and
-                    len(pizza_tracks[track_id]) == 1 and
-                    track_id not in counted_ids and
-                    point_in_polygon((cx, cy), count_polygon)
-                ):
-                    # Proximity check: skip if close to a recently lost track
-                    skip = False
-                    for lost in recently_lost:
-                        if abs(lost['cx'] - cx) < 40 and abs(lost['cy'] - cy) < 40 and (frame_idx - lost['frame']) < 20:
-                            skip = True
-                            break
-                    if not skip:
-                        pizza_count += 1
-                        counted_ids.add(track_id)
-                        sale_events.append({
-                            "frame": frame_idx,
-                            "pizza_id": track_id,
-                            "cx": cx,
-                            "cy": cy
-                        })
+            if annotate:
+                draw_start = time.perf_counter()
+                for track_id, (x1, y1, x2, y2), (cx, cy) in zip(track_ids, boxes, centers):
+                    color = (0, 165, 255)
+                    cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+                    cv2.putText(frame, f"pizza ID {track_id}", (x1, y1 - 10),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+                    cv2.circle(frame, (cx, cy), 4, (255, 0, 0), -1)
 
-                # --- Count if crossing into the polygon ---
-                if (
-                    count_polygon and
-                    len(pizza_tracks[track_id]) >= 2 and
-                    track_id not in counted_ids
-                ):
-                    prev = pizza_tracks[track_id][-2]
-                    curr = pizza_tracks[track_id][-1]
-                    if not point_in_polygon(prev, count_polygon) and point_in_polygon(curr, count_polygon):
-                        pizza_count += 1
-                        counted_ids.add(track_id)
-                        sale_events.append({
-                            "frame": frame_idx,
-                            "pizza_id": track_id,
-                            "cx": curr[0],
-                            "cy": curr[1]
-                        })
-
-                last_positions[track_id] = (cx, cy, frame_idx)
-
-                color = (0, 165, 255)
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                cv2.putText(frame, f"pizza ID {track_id}", (x1, y1 - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-                cv2.circle(frame, (cx, cy), 4, (255, 0, 0), -1)
-
-            # --- Proximity check: update recently lost tracks ---
-            lost_ids = set(last_positions.keys()) - active_ids
-            for lost_id in list(lost_ids):
-                cx, cy, lost_frame = last_positions[lost_id]
-                recently_lost.append({'cx': cx, 'cy': cy, 'frame': lost_frame})
-                # Keep only recent lost tracks (last 30 frames)
-                recently_lost = [l for l in recently_lost if frame_idx - l['frame'] < 30]
-                del last_positions[lost_id]
-
-            # Draw counting polygon and count
-            if count_polygon:
-                draw_polygon(frame, count_polygon, color=(0,0,255), thickness=2)
-            cv2.putText(frame, f"Pizzas Sold: {pizza_count}", (20, 40),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 255), 3)
-
-            out.write(frame)
+                # Draw counting polygon and count
+                if zone is not None:
+                    zone.draw(frame, color=(0,0,255), thickness=2)
+                cv2.putText(frame, f"Pizzas Sold: {pizza_count}", (20, 40),
+                            cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 255), 3)
+                timer.add("draw", time.perf_counter() - draw_start)
+
+            # Share the annotated frame and its metadata with live viewers (see session.PipelineSession)
+            if frame_callback is not None or info_callback is not None:
+                with timer.time("publish"):
+                    info = {
+                        "frame": frame_idx,
+                        "pizza_count": pizza_count,
+                        "tracks": [{"id": tid, "box": list(box)} for tid, box in zip(track_ids, boxes)],
+                        "events": events
+                    }
+                    if info_callback is not None:
+                        info_callback(info)
+                    if frame_callback is not None:
+                        frame_callback(frame, info)
+
+            out.write(frame, frame_idx, events)
+            timer.frame_done()
+
+            # The tracker is only updated between yields, so it is in step with the counter here
+            if checkpoint_every and time.monotonic() - last_checkpoint >= checkpoint_every:
+                with timer.time("checkpoint"):
+                    sink.sync()
+                    save_checkpoint(ckpt_path, video_path, frame_idx, tracker, counter)
+                last_checkpoint = time.monotonic()
     finally:
+        tracker_stream.close()  # stops the reader/inference threads if we broke out early
         out.release()
-        cap.release()
-        # Save sale events to CSV even if interrupted
-        csv_path = output_path.replace(".mp4", "_sales.csv")
-        with open(csv_path, "w", newline="") as csvfile:
-            fieldnames = ["frame", "pizza_id", "cx", "cy"]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            for event in sale_events:
-                writer.writerow(event)
-        print(f"Counting video saved to: {output_path}")
-        print(f"Total pizzas sold: {pizza_count}")
+        sink.close()
+        if recorder is not None:
+            recorder.close(complete=finished)  # a partial run is not a valid cache entry
+        if finished:
+            remove_checkpoint(ckpt_path)
+        if video_mode in ("full", "preview"):
+            print(f"Counting video saved to: {output_path}")
+        elif video_mode == "events":
+            print(f"Sale clips saved to: {out.clip_dir} ({len(out.clips)} clips)")
+        print(f"Total pizzas sold: {counter.pizza_count}")
         print(f"Pizza sale events saved to: {csv_path}")
+        if metrics is not None:
+            metrics.end_job()
+        seconds = time.perf_counter() - run_start
+        frames = frame_idx - start_frame
+        print(f"Processed {frames} frames in {seconds:.1f}s ({frames / seconds if seconds else 0.0:.2f} fps)")
+        timer.print_summary()
+    stats = {
+        "pizza_count": counter.pizza_count,
+        "frames": frames,
+        "seconds": round(seconds, 3),
+        "fps": round(frames / seconds, 2) if seconds else None,
+        "stages": timer.summary()
+    }
+    if scheduler is not None:
+        stats["adaptive"] = scheduler.stats()
+    return stats
 
 if __name__ == "__main__":
     video_path = "data/raw_videos/cut_video_test/1464_CH02_20250607180000_190000 - Trim.mp4"
     camera_key = get_camera_key(video_path)
-    # Use "count_polygon" or fallback to "count_box" for backward compatibility
-    zone = CAMERA_ZONES[camera_key]
-    count_polygon = zone.get("count_polygon") or zone.get("count_box")
+    # "count_polygons", "count_polygon" or fallback to "count_box" for backward compatibility
+    count_polygon = CountingZone.for_camera(camera_key)
 
     track_and_count_pizzas(
         video_path=video_path,
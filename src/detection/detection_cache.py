@@ -0,0 +1,265 @@
+# src/detection/detection_cache.py
+import os
+import json
+import shutil
+import numpy as np
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from src.detection.fingerprint import video_fingerprint, weights_hash, settings_hash
+from src.detection.backends import FrameDetections
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+CACHE_DIR = os.environ.get("PIZZA_DETECTION_CACHE", os.path.join(project_root, "data", "cache", "detections"))
+CACHE_VERSION = 1
+# Cache directory budget; least recently used entries are removed beyond it
+DEFAULT_MAX_BYTES = int(float(os.environ.get("PIZZA_DETECTION_CACHE_MAX_GB", "5")) * 1024 ** 3)
+
+# ============== Cache keys ==============
+def detection_key(video_path, model_path, backend, roi=None, adaptive=False, idle_interval=None, region=None):
+    """
+    Key of a video's raw detections: its content, the model weights, the detector backend and
+    everything that decides what the model sees (ROI crop, adaptive skipping). The polygon,
+    proximity settings and conf_thres are not part of it, so they can change and be replayed.
+    """
+    return "det-" + settings_hash(
+        CACHE_VERSION, video_fingerprint(video_path), weights_hash(model_path), backend,
+        roi, adaptive, idle_interval if adaptive else None, region if adaptive else None
+    )
+
+def tracks_key(det_key, conf_thres, tracker_backend, tracker_params=None):
+    """Key of the tracker outputs computed from `det_key`'s detections."""
+    return "trk-" + settings_hash(det_key, conf_thres, tracker_backend, tracker_params)
+
+def cache_path(key, cache_dir=None):
+    return os.path.join(cache_dir or CACHE_DIR, key)
+
+# ============== Column store ==============
+class ColumnWriter:
+    """
+    Streams per-frame variable-length rows into one flat binary file per column plus an
+    `offsets` column (row range of each frame), so memory stays flat on long videos.
+    `frame_columns` hold exactly one value per frame.
+    Written into a temp directory that replaces `path` on close(complete=True).
+    """
+
+    def __init__(self, path, columns, frame_columns=None):
+        self.path = path
+        self.columns = columns  # name: (dtype, row shape)
+        self.frame_columns = frame_columns or {}
+        self.tmp_path = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        names = [*self.columns, *self.frame_columns, "offsets"]
+        self._files = {name: open(os.path.join(self.tmp_path, f"{name}.bin"), "wb") for name in names}
+        self.frames = 0
+        self.rows = 0
+        np.array([0], np.int64).tofile(self._files["offsets"])
+
+    def append(self, n, **values):
+        """One frame with `n` rows: an array of n rows per column, one value per frame column."""
+        if n:
+            for name, (dtype, _) in self.columns.items():
+                np.ascontiguousarray(values[name], dtype=dtype).tofile(self._files[name])
+        for name, (dtype, _) in self.frame_columns.items():
+            np.asarray([values[name]], dtype=dtype).tofile(self._files[name])
+        self.rows += n
+        self.frames += 1
+        np.array([self.rows], np.int64).tofile(self._files["offsets"])
+
+    def close(self, complete=True, **meta):
+        for f in self._files.values():
+            f.close()
+        if not complete:
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+            return
+        def spec(columns):
+            return {name: {"dtype": np.dtype(dtype).str, "shape": list(shape)} for name, (dtype, shape) in columns.items()}
+        meta = dict(meta, version=CACHE_VERSION, frames=self.frames, rows=self.rows,
+                    columns=spec(self.columns), frame_columns=spec(self.frame_columns))
+        with open(os.path.join(self.tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp_path, self.path)
+
+
+def _map(path, spec, n):
+    shape = (n, *spec["shape"])
+    if not n:
+        return np.zeros(shape, spec["dtype"])
+    return np.memmap(path, dtype=spec["dtype"], mode="r", shape=shape)
+
+
+class ColumnReader:
+    """
+    Memory-mapped view of a ColumnWriter directory: `rows(i)` slices frame i of every
+    column, `frame_columns[name][i]` is frame i's value.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        self.frames = self.meta["frames"]
+        self.offsets = np.fromfile(os.path.join(path, "offsets.bin"), dtype=np.int64)
+        self.columns = {name: _map(os.path.join(path, f"{name}.bin"), spec, self.meta["rows"])
+                        for name, spec in self.meta["columns"].items()}
+        self.frame_columns = {name: _map(os.path.join(path, f"{name}.bin"), spec, self.frames)
+                              for name, spec in self.meta.get("frame_columns", {}).items()}
+
+    def __len__(self):
+        return self.frames
+
+    def rows(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return {name: column[start:end] for name, column in self.columns.items()}
+
+
+def _open(key, cache_dir=None):
+    path = cache_path(key, cache_dir)
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    reader = ColumnReader(path)
+    if reader.meta.get("version") != CACHE_VERSION:
+        return None
+    try:
+        os.utime(meta_path)  # meta.json's mtime is the entry's last access, for evict()
+    except OSError:
+        pass
+    return reader
+
+# ============== Eviction ==============
+def evict(max_bytes=DEFAULT_MAX_BYTES, cache_dir=None, keep=()):
+    """
+    Delete least recently used (written or opened) entries until the cache fits in
+    max_bytes. Entries in `keep` and unfinished writes are never deleted. Returns the evicted keys.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    entries = []
+    try:
+        names = os.listdir(cache_dir)
+    except OSError:
+        return []
+    for key in names:
+        try:
+            last_access = os.path.getmtime(os.path.join(cache_dir, key, "meta.json"))
+        except OSError:
+            continue  # being written (.tmp-*), or already evicted
+        entries.append((last_access, key, _dir_size(os.path.join(cache_dir, key))))
+    total = sum(size for _, _, size in entries)
+    removed = []
+    for _, key, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if key in keep:
+            continue
+        # Moved aside first so a concurrent _open never sees a half-deleted entry
+        trash = os.path.join(cache_dir, f".evicted-{key}-{os.getpid()}")
+        try:
+            os.replace(os.path.join(cache_dir, key), trash)
+        except OSError:
+            continue
+        shutil.rmtree(trash, ignore_errors=True)
+        total -= size
+        removed.append(key)
+        print(f"Evicted cached detections {key}")
+    return removed
+
+def _dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                continue
+    return total
+
+# ============== Detections and tracks ==============
+DETECTION_COLUMNS = {"boxes": (np.float32, (4,)), "scores": (np.float32, ()), "classes": (np.int16, ())}
+TRACK_COLUMNS = {"boxes": (np.int32, (4,)), "ids": (np.int64, ())}
+
+class CacheRecorder:
+    """
+    Persists one run's per-frame detections (full-frame boxes, scores, classes; frames the
+    scheduler skipped are flagged) and/or confirmed tracker outputs.
+    Either key may be None to record only the other. A complete recording then evicts
+    least recently used entries beyond `max_bytes` (see evict).
+    """
+
+    def __init__(self, det_key=None, trk_key=None, names=None, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.names = names or {}
+        self.keys = tuple(key for key in (det_key, trk_key) if key)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._dets = ColumnWriter(cache_path(det_key, cache_dir), DETECTION_COLUMNS,
+                                  frame_columns={"detected": (np.bool_, ())}) if det_key else None
+        self._tracks = ColumnWriter(cache_path(trk_key, cache_dir), TRACK_COLUMNS) if trk_key else None
+
+    def record(self, detections, tracks):
+        """detections: backends.FrameDetections in frame coordinates, or None if not run on this frame."""
+        if self._dets is not None:
+            if detections is None:
+                self._dets.append(0, detected=False)
+            else:
+                self._dets.append(len(detections), boxes=detections.boxes, scores=detections.scores,
+                                  classes=detections.classes, detected=True)
+        if self._tracks is not None:
+            self._tracks.append(len(tracks), boxes=[t[:4] for t in tracks], ids=[int(t[5]) for t in tracks])
+
+    def close(self, complete=True):
+        if self._dets is not None:
+            self._dets.close(complete, names={str(k): v for k, v in self.names.items()})
+        if self._tracks is not None:
+            self._tracks.close(complete)
+        if complete:
+            evict(self.max_bytes, self.cache_dir, keep=self.keys)
+
+
+class DetectionCache:
+    """Replays cached detections frame by frame: FrameDetections, or None where detection was skipped."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.names = {int(k): v for k, v in reader.meta.get("names", {}).items()}
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __iter__(self):
+        detected = self.reader.frame_columns["detected"]
+        for i in range(len(self.reader)):
+            if not detected[i]:
+                yield None
+                continue
+            rows = self.reader.rows(i)
+            yield FrameDetections(rows["boxes"], rows["scores"], rows["classes"])
+
+
+class TrackCache:
+    """Replays cached confirmed tracks frame by frame as [x1, y1, x2, y2, 1.0, track_id] lists."""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __iter__(self):
+        for i in range(len(self.reader)):
+            rows = self.reader.rows(i)
+            yield [[*box, 1.0, tid] for box, tid in zip(rows["boxes"].tolist(), rows["ids"].tolist())]
+
+
+def open_detections(key, cache_dir=None):
+    reader = _open(key, cache_dir)
+    return DetectionCache(reader) if reader is not None else None
+
+def open_tracks(key, cache_dir=None):
+    reader = _open(key, cache_dir)
+    return TrackCache(reader) if reader is not None else None
+
+def replay_tracks(tracks):
+    """A TrackCache as pizza_tracker's stream: (None, tracks) per frame, then (None, None)."""
+    for frame_tracks in tracks:
+        yield None, frame_tracks
+    yield None, None
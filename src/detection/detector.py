@@ -1,12 +1,97 @@
-from ultralytics import YOLO
 import cv2
 import os
+import time
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
 from tqdm import tqdm
 from detection.utils import apply_clahe
-
-def extract_and_classify_frames(video_path, output_dir, frame_interval=60, conf_thres=0.5, model_path="models/yolov8m.pt", show_preview=True):
+from detection.model_registry import get_yolo
+
+TARGET_DISPLAY_CLASSES = ["pizza", "person"]
+DISPLAY_COLORS = {"person": (255, 0, 0), "pizza": (0, 165, 255)}
+
+# ============== Frame sampling ==============
+def sampled_frames(cap, frame_interval, seek=False):
+    """
+    Yield (frame_idx, frame) for every `frame_interval`-th frame.
+    Frames in between are only grabbed (demuxed, never decoded to BGR); with seek=True the
+    capture jumps straight to the next sampled frame, which is faster for sparse sampling of
+    keyframe-dense videos but lands on a nearby frame in some codecs.
+    """
+    frame_idx = 0
+    while True:
+        if seek and frame_idx:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+        ret, frame = cap.read()
+        if not ret:
+            return
+        yield frame_idx, frame
+        if not seek:
+            for _ in range(frame_interval - 1):
+                if not cap.grab():
+                    return
+        frame_idx += frame_interval
+
+def dhash(frame, size=8):
+    """64-bit difference hash: near-identical frames differ in only a few bits."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+class DuplicateFilter:
+    """Drops frames whose dhash is within `max_distance` bits of one of the last `history` kept frames."""
+
+    def __init__(self, max_distance=6, history=16):
+        self.max_distance = max_distance
+        self.recent = deque(maxlen=history)
+        self.dropped = 0
+
+    def keep(self, frame):
+        h = dhash(frame)
+        if any(bin(h ^ other).count("1") <= self.max_distance for other in self.recent):
+            self.dropped += 1
+            return False
+        self.recent.append(h)
+        return True
+
+# ============== Detection ==============
+def draw_detections(frame, result, names, conf_thres):
+    """Boxes of the display classes drawn on a copy of `frame`; also whether a confident pizza was found."""
+    annotated = frame.copy()
+    boxes = result.boxes
+    has_pizza = False
+    for (x1, y1, x2, y2), conf, cls_id in zip(boxes.xyxy.cpu().numpy().astype(int),
+                                              boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy().astype(int)):
+        label = names[cls_id]
+        if conf < conf_thres or label not in TARGET_DISPLAY_CLASSES:
+            continue
+        has_pizza |= label == "pizza"
+        color = DISPLAY_COLORS.get(label, (0, 255, 0))
+        cv2.rectangle(annotated, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(annotated, f"{label} {conf:.2f}", (x1, y1 - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 1, cv2.LINE_AA)
+    return annotated, has_pizza
+
+def extract_and_classify_frames(video_path, output_dir, frame_interval=60, conf_thres=0.5, model_path="models/yolov8m.pt",
+                                show_preview=True, batch_size=8, write_workers=4, dedup_distance=None, seek=False):
+    """
+    Save every `frame_interval`-th frame to all_frames/ and a copy with pizza/person boxes to
+    contains_pizza/ or no_pizza/.
+
+    Skipped frames are grabbed without decoding (see sampled_frames), sampled frames go
+    through CLAHE and YOLO `batch_size` at a time, and JPEGs are written by `write_workers`
+    threads. dedup_distance: drop frames within that many dhash bits of a recently kept one
+    (e.g. 6), before they reach the model. show_preview opens a window; leave it off for
+    headless runs (see extract_dataset).
+
+    Returns {"video", "sampled", "duplicates", "saved", "with_pizza", "seconds"}.
+    """
     try:
-        model = YOLO(model_path)
+        model_entry = get_yolo(model_path)
+        model = model_entry.model
     except Exception as e:
         print(f"Error loading model from {model_path}: {e}")
         print("Please ensure your model weights (e.g., yolov8m.pt) are in the 'models/' directory.")
@@ -28,78 +113,112 @@ def extract_and_classify_frames(video_path, output_dir, frame_interval=60, conf_
     fps = cap.get(cv2.CAP_PROP_FPS)
     print(f"Total frames: {total_frames}, FPS: {fps}")
 
-    frame_count, saved_count = 0, 0
-    pbar = tqdm(total=total_frames, desc=f"Processing {os.path.basename(video_path)}")
-
-    TARGET_DISPLAY_CLASSES = ["pizza", "person"]
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        if frame_count % frame_interval == 0:
-            frame_name = f"frame_{frame_count:05d}.jpg"
-            
-            processed_frame = apply_clahe(frame)
-
-            frame_with_detections = processed_frame.copy() 
-
-            results = model(processed_frame, verbose=False)[0] 
-
-            has_pizza_for_dir_classification = False 
-
-            for box in results.boxes:
-                cls_id = int(box.cls)
-                conf = float(box.conf)
-                label = model.model.names[cls_id]
-
-                if label == "pizza" and conf >= conf_thres:
-                    has_pizza_for_dir_classification = True
-
-                if label in TARGET_DISPLAY_CLASSES and conf >= conf_thres:
-                    xyxy = box.xyxy[0].cpu().numpy().astype(int)
-                    x1, y1, x2, y2 = xyxy
-                    
-                    color = (0, 255, 0) 
-                    if label == "person":
-                        color = (255, 0, 0) 
-                    elif label == "pizza":
-                        color = (0, 165, 255) 
-                        
-                    cv2.rectangle(frame_with_detections, (x1, y1), (x2, y2), color, 2)
-                    cv2.putText(frame_with_detections, f"{label} {conf:.2f}", (x1, y1 - 10),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 1, cv2.LINE_AA)
-
-            cv2.imwrite(os.path.join(all_dir, frame_name), frame) # Lưu frame gốc vào all_dir
-            
-            save_path = os.path.join(pizza_dir if has_pizza_for_dir_classification else no_pizza_dir, frame_name)
-            cv2.imwrite(save_path, frame_with_detections) # Lưu frame đã xử lý và vẽ box
-            saved_count += 1
-
-            if show_preview:
-                scale = 0.5  
+    names = model.model.names
+    duplicates = DuplicateFilter(dedup_distance) if dedup_distance is not None else None
+    writer = ThreadPoolExecutor(max_workers=max(1, write_workers), thread_name_prefix="frame-writer")
+    pending = deque()  # imwrite futures; bounded so slow disks apply back-pressure
+    counts = {"sampled": 0, "saved": 0, "with_pizza": 0}
+    start = time.perf_counter()
+    stopped = False
+
+    def write(path, image):
+        pending.append(writer.submit(cv2.imwrite, path, image))
+        while len(pending) > 4 * batch_size:
+            pending.popleft().result()
+
+    def flush(batch):
+        nonlocal stopped
+        processed = [apply_clahe(frame) for _, frame in batch]
+        with model_entry.lock:
+            results = model(processed, verbose=False)
+        for (frame_idx, frame), processed_frame, result in zip(batch, processed, results):
+            frame_name = f"frame_{frame_idx:05d}.jpg"
+            frame_with_detections, has_pizza = draw_detections(processed_frame, result, names, conf_thres)
+            write(os.path.join(all_dir, frame_name), frame)  # original frame
+            write(os.path.join(pizza_dir if has_pizza else no_pizza_dir, frame_name), frame_with_detections)
+            counts["saved"] += 1
+            counts["with_pizza"] += has_pizza
+
+            if show_preview and not stopped:
+                scale = 0.5
                 h, w = frame_with_detections.shape[:2]
                 display_frame = cv2.resize(frame_with_detections, (int(w * scale), int(h * scale)))
                 cv2.imshow("Detection Preview (Pizza & Person)", display_frame)
                 if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
-
-        frame_count += 1
-        pbar.update(1)
+                    stopped = True
 
-    pbar.close()
-    cap.release()
-    if show_preview:
-        cv2.destroyAllWindows()
-    print(f"✅ Done. Saved {saved_count} frames to '{output_dir}' (preview mode = {show_preview}).")
+    pbar = tqdm(total=total_frames, desc=f"Processing {os.path.basename(video_path)}")
+    batch = []
+    try:
+        for frame_idx, frame in sampled_frames(cap, frame_interval, seek=seek):
+            pbar.update(min(frame_interval, max(0, total_frames - pbar.n)))
+            counts["sampled"] += 1
+            if duplicates is not None and not duplicates.keep(frame):
+                continue
+            batch.append((frame_idx, frame))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+            if stopped:
+                break
+        if batch and not stopped:
+            flush(batch)
+    finally:
+        writer.shutdown(wait=True)
+        pbar.close()
+        cap.release()
+        if show_preview:
+            cv2.destroyAllWindows()
+
+    summary = {
+        "video": video_path,
+        "sampled": counts["sampled"],
+        "duplicates": duplicates.dropped if duplicates is not None else 0,
+        "saved": counts["saved"],
+        "with_pizza": counts["with_pizza"],
+        "seconds": round(time.perf_counter() - start, 2)
+    }
+    print(f"✅ Done. Saved {summary['saved']} frames to '{output_dir}' ({summary['duplicates']} near-duplicates "
+          f"dropped, {summary['seconds']}s, preview mode = {show_preview}).")
+    return summary
+
+# ============== Parallel dataset build ==============
+def _extract_worker(args):
+    video_path, output_dir, threads, kwargs = args
+    # Every worker process runs its own model: cap intra-op threads so they do not oversubscribe the CPU
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    return extract_and_classify_frames(video_path, output_dir, show_preview=False, **kwargs)
+
+def extract_dataset(video_paths, output_root, processes=None, threads_per_process=None, **kwargs):
+    """
+    Headless extract_and_classify_frames over many videos in parallel worker processes,
+    each video into output_root/<video name>/. Keyword arguments are passed through
+    (frame_interval, conf_thres, model_path, batch_size, write_workers, dedup_distance, seek).
+    Returns the per-video summaries.
+    """
+    cores = os.cpu_count() or 1
+    processes = max(1, min(processes or max(1, cores // 4), len(video_paths)))
+    threads = threads_per_process or max(1, cores // processes)
+    jobs = [(path, os.path.join(output_root, os.path.splitext(os.path.basename(path))[0]), threads, kwargs)
+            for path in video_paths]
+    # spawn: CUDA and the model registry do not survive fork
+    with ProcessPoolExecutor(max_workers=processes, mp_context=mp.get_context("spawn")) as pool:
+        summaries = [summary for summary in pool.map(_extract_worker, jobs) if summary]
+    total = sum(s["saved"] for s in summaries)
+    print(f"Extracted {total} frames from {len(summaries)} videos into '{output_root}' with {processes} processes")
+    return summaries
 
 
 if __name__ == "__main__":
     extract_and_classify_frames(
-        video_path="data/raw_videos/1461_CH01_20250607193711_203711.mp4",  
-        output_dir="data/frames/train_video_1461_CH01", 
+        video_path="data/raw_videos/1461_CH01_20250607193711_203711.mp4",
+        output_dir="data/frames/train_video_1461_CH01",
         frame_interval=60,
         show_preview=True,
         model_path="models/yolov8l.pt"
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,139 @@
+# src/detection/events.py
+import os
+import csv
+import time
+from datetime import datetime, timedelta
+
+def video_start_time(video_path):
+    """Recording start from names like '1461_CH01_20250607193711_203711.mp4', else None."""
+    parts = os.path.basename(video_path).split("_")
+    if len(parts) < 3:
+        return None
+    try:
+        return datetime.strptime(parts[2][:14], "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+
+# ============== Sale event sink ==============
+class SaleEventSink:
+    """
+    Append-only writer for sale events. Every event is written and flushed as soon as it
+    is counted, so the CSV can be served while the job is still running and a crash loses
+    at most the OS buffer since the last fsync (every `fsync_interval` seconds).
+
+    With `parquet_dir`, events are also rolled over into Parquet part files of
+    `rollover_events` rows each (requires pyarrow).
+
+    wall_clock: timestamp events with the time they are counted (live cameras, where frames
+    are dropped and frame numbers do not map to time), instead of start_time + frame / fps.
+
+    resume_frame: continue an interrupted run from a checkpoint. Rows up to that frame are
+    kept, later ones (counted after the checkpoint, so about to be counted again) are dropped,
+    and the Parquet parts are rebuilt from the kept rows.
+    """
+    FIELDNAMES = ["frame", "pizza_id", "cx", "cy", "timestamp"]
+
+    def __init__(self, csv_path, fps=None, start_time=None, fsync_interval=5.0,
+                 parquet_dir=None, rollover_events=1000, resume_frame=None, wall_clock=False):
+        self.csv_path = csv_path
+        self.fps = fps
+        self.start_time = start_time
+        self.wall_clock = wall_clock
+        self.fsync_interval = fsync_interval
+        self.rollover_events = rollover_events
+
+        kept = self._read_until(csv_path, resume_frame) if resume_frame is not None else []
+        self.count = len(kept)
+        # Rewrite the kept rows atomically so a crash right now cannot lose them
+        tmp_path = csv_path + ".tmp"
+        with open(tmp_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.FIELDNAMES)
+            writer.writeheader()
+            writer.writerows(kept)
+        os.replace(tmp_path, csv_path)
+        self._file = open(csv_path, "a", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=self.FIELDNAMES)
+        self._last_fsync = time.monotonic()
+
+        self.parquet_dir = parquet_dir
+        self._pending = []
+        self._part = 0
+        if parquet_dir:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                print("pyarrow is not installed, Parquet output disabled")
+                self.parquet_dir = None
+            else:
+                os.makedirs(parquet_dir, exist_ok=True)
+                for name in os.listdir(parquet_dir):
+                    if name.endswith(".parquet"):
+                        os.remove(os.path.join(parquet_dir, name))
+                for row in kept:
+                    self._pending.append(row)
+                    if len(self._pending) >= self.rollover_events:
+                        self._roll()
+
+    @classmethod
+    def _read_until(cls, csv_path, frame_idx):
+        if not os.path.exists(csv_path):
+            return []
+        with open(csv_path, "r", newline="") as f:
+            rows = [row for row in csv.DictReader(f) if row.get("frame")]
+        kept = []
+        for row in rows:
+            if int(row["frame"]) > frame_idx:
+                continue
+            row.update(frame=int(row["frame"]), cx=int(row["cx"]), cy=int(row["cy"]))
+            kept.append({k: row[k] for k in cls.FIELDNAMES})
+        return kept
+
+    def timestamp(self, frame_idx):
+        if self.wall_clock:
+            return datetime.now().isoformat(timespec="milliseconds")
+        if self.start_time is None or not self.fps:
+            return ""
+        # frame_idx is 1-based: frame 1 is the first frame of the recording
+        return (self.start_time + timedelta(seconds=(frame_idx - 1) / self.fps)).isoformat(timespec="milliseconds")
+
+    def write(self, event):
+        row = dict(event)
+        row["timestamp"] = self.timestamp(event["frame"])
+        self._writer.writerow(row)
+        self._file.flush()
+        self.count += 1
+        if time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self.sync()
+        if self.parquet_dir:
+            self._pending.append(row)
+            if len(self._pending) >= self.rollover_events:
+                self._roll()
+
+    def _roll(self):
+        if not self._pending:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.table({
+            "frame": pa.array([r["frame"] for r in self._pending], pa.int64()),
+            "pizza_id": pa.array([int(r["pizza_id"]) for r in self._pending], pa.int64()),
+            "cx": pa.array([r["cx"] for r in self._pending], pa.int32()),
+            "cy": pa.array([r["cy"] for r in self._pending], pa.int32()),
+            "timestamp": pa.array([r["timestamp"] for r in self._pending], pa.string())
+        })
+        path = os.path.join(self.parquet_dir, f"part-{self._part:05d}.parquet")
+        pq.write_table(table, path, compression="zstd")
+        self._part += 1
+        self._pending = []
+
+    def sync(self):
+        """Flush and fsync the CSV, e.g. before a checkpoint refers to it."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_fsync = time.monotonic()
+
+    def close(self):
+        if self.parquet_dir:
+            self._roll()
+        self.sync()
+        self._file.close()
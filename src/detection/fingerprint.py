@@ -0,0 +1,72 @@
+# src/detection/fingerprint.py
+import os
+import json
+import hashlib
+import threading
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+# ============== Content fingerprints ==============
+def sampled_file_hash(path, samples=16, chunk_size=1 << 16):
+    """
+    Hash of `samples` chunks spread evenly over a file, plus its size. Reads about 1 MB
+    whatever the file size, so hour-long videos are fingerprinted in milliseconds while a
+    re-encode, trim or different recording still changes the hash.
+    """
+    size = os.path.getsize(path)
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        if size <= samples * chunk_size:
+            h.update(f.read())
+        else:
+            step = (size - chunk_size) // (samples - 1)
+            for i in range(samples):
+                f.seek(i * step)
+                h.update(f.read(chunk_size))
+    return h.hexdigest()
+
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+def _memoised(kind, path, compute):
+    # Keyed by (path, size, mtime): an unchanged file is never read twice
+    st = os.stat(path)
+    key = (kind, os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _file_hashes_lock:
+        if key in _file_hashes:
+            return _file_hashes[key]
+    digest = compute(path)
+    with _file_hashes_lock:
+        _file_hashes[key] = digest
+    return digest
+
+def _full_hash(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def file_hash(path):
+    """Full content hash of a (model weights) file, memoised per (path, size, mtime)."""
+    return _memoised("full", path, _full_hash)
+
+def video_fingerprint(path):
+    """sampled_file_hash of a video, memoised per (path, size, mtime)."""
+    return _memoised("sampled", path, sampled_file_hash)
+
+def weights_hash(model_path):
+    """
+    file_hash of the weights; relative paths are resolved against the repository root, whatever
+    the working directory. Raises FileNotFoundError if there is no such file: a key that ignores
+    the weights would keep serving results of a replaced model.
+    """
+    path = os.path.join(project_root, model_path)  # unchanged if model_path is absolute
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Model weights not found: {path}")
+    return file_hash(path)
+
+def settings_hash(*parts):
+    """Stable short hash of JSON-serialisable settings (dict keys sorted, tuples as lists)."""
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.blake2b(text.encode(), digest_size=10).hexdigest()
@@ -0,0 +1,147 @@
+# src/detection/iou_tracker.py
+import numpy as np
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from src.detection.utils import iou_matrix
+
+IOU_TRACKER_PARAMS = dict(
+    max_age=90,
+    n_init=2,
+    match_iou=0.3,
+    low_match_iou=0.5,
+    low_thres=0.1,
+    velocity_smoothing=0.5
+)
+
+# ============== Motion / IoU tracker ==============
+class IoUTracker:
+    """
+    Appearance-free tracker in the SORT / ByteTrack style, for counters where every pizza
+    looks alike. Boxes move with a smoothed constant velocity; each frame, confident
+    detections (>= high_thres) are matched to all tracks by IoU, then weak ones
+    (low_thres .. high_thres) may only continue confirmed tracks left unmatched, at a
+    stricter `low_match_iou`. Only confident detections start tracks.
+
+    Track state lives in parallel numpy arrays, so association is one IoU matrix per stage
+    and the tracker pickles as-is for checkpoints.
+    """
+    needs_frames = False
+
+    def __init__(self, max_age=90, n_init=2, match_iou=0.3, low_match_iou=0.5, high_thres=0.5,
+                 low_thres=0.1, velocity_smoothing=0.5):
+        self.max_age = max_age
+        self.n_init = n_init
+        self.match_iou = match_iou
+        self.low_match_iou = low_match_iou
+        self.high_thres = high_thres
+        self.low_thres = min(low_thres, high_thres)
+        self.velocity_smoothing = velocity_smoothing
+        self.ids = np.zeros(0, np.int64)
+        self.boxes = np.zeros((0, 4))      # predicted x1, y1, x2, y2
+        self.last = np.zeros((0, 4))       # box at the last match
+        self.velocity = np.zeros((0, 4))   # px per frame
+        self.hits = np.zeros(0, np.int64)
+        self.misses = np.zeros(0, np.int64)  # frames since the last match
+        self.confirmed = np.zeros(0, bool)
+        self.next_id = 1
+
+    def detection_thres(self, conf_thres):
+        """Lowest detection confidence worth passing in: weak boxes still continue tracks."""
+        return min(conf_thres, self.low_thres)
+
+    def alive(self):
+        return len(self.ids) > 0
+
+    def model_entries(self):
+        """Shared models this tracker uses (none)."""
+        return []
+
+    def predict(self):
+        """Advance every track one frame without detections (e.g. frames the scheduler skips)."""
+        self.boxes = self.boxes + self.velocity
+        self.misses += 1
+        return self.tracks()
+
+    def tracks(self):
+        """Confirmed tracks as [x1, y1, x2, y2, 1.0, track_id]."""
+        return [[*map(int, box), 1.0, int(tid)] for box, tid in zip(self.boxes[self.confirmed], self.ids[self.confirmed])]
+
+    @staticmethod
+    def _associate(ious, thres):
+        """Greedy one-to-one matching by descending IoU. Returns [(row, col)] with IoU >= thres."""
+        matches = []
+        if not ious.size:
+            return matches
+        rows, cols = set(), set()
+        order = np.argsort(-ious, axis=None)
+        for r, c in zip(*np.unravel_index(order, ious.shape)):
+            if ious[r, c] < thres:
+                break
+            if r in rows or c in cols:
+                continue
+            rows.add(r)
+            cols.add(c)
+            matches.append((int(r), int(c)))
+        return matches
+
+    def update(self, detections, frame=None):
+        """
+        detections: DeepSort-style ([x, y, w, h], conf, cls) tuples; frame is unused.
+        Returns the confirmed tracks after this frame.
+        """
+        self.predict()
+        if detections:
+            ltwh = np.array([d[0] for d in detections], dtype=np.float64)
+            det_boxes = np.concatenate([ltwh[:, :2], ltwh[:, :2] + ltwh[:, 2:]], axis=1)
+            det_conf = np.array([d[1] for d in detections], dtype=np.float64)
+        else:
+            det_boxes, det_conf = np.zeros((0, 4)), np.zeros(0)
+        high = np.flatnonzero(det_conf >= self.high_thres)
+        low = np.flatnonzero((det_conf >= self.low_thres) & (det_conf < self.high_thres))
+
+        # Stage 1: confident detections against every track
+        all_tracks = np.arange(len(self.ids))
+        ious = iou_matrix(self.boxes, det_boxes[high])
+        matches = [(all_tracks[r], high[c]) for r, c in self._associate(ious, self.match_iou)]
+        matched_tracks = {t for t, _ in matches}
+        matched_high = {d for _, d in matches}
+
+        # Stage 2: weak detections may only continue confirmed tracks
+        rest = np.array([t for t in all_tracks if t not in matched_tracks and self.confirmed[t]], np.int64)
+        if len(rest) and len(low):
+            ious = iou_matrix(self.boxes[rest], det_boxes[low])
+            matches += [(rest[r], low[c]) for r, c in self._associate(ious, self.low_match_iou)]
+
+        for t, d in matches:
+            measured = (det_boxes[d] - self.last[t]) / max(1, self.misses[t])
+            s = self.velocity_smoothing
+            self.velocity[t] = s * self.velocity[t] + (1 - s) * measured
+            self.boxes[t] = self.last[t] = det_boxes[d]
+            self.misses[t] = 0
+            self.hits[t] += 1
+            self.confirmed[t] |= self.hits[t] >= self.n_init
+
+        # Tentative tracks die on their first miss, confirmed ones after max_age missed frames
+        keep = (self.misses == 0) | (self.confirmed & (self.misses <= self.max_age))
+        self._select(keep)
+
+        new = [d for d in high if d not in matched_high]
+        if new:
+            n = len(new)
+            self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + n)])
+            self.next_id += n
+            self.boxes = np.concatenate([self.boxes, det_boxes[new]])
+            self.last = np.concatenate([self.last, det_boxes[new]])
+            self.velocity = np.concatenate([self.velocity, np.zeros((n, 4))])
+            self.hits = np.concatenate([self.hits, np.ones(n, np.int64)])
+            self.misses = np.concatenate([self.misses, np.zeros(n, np.int64)])
+            self.confirmed = np.concatenate([self.confirmed, np.full(n, self.n_init <= 1)])
+        return self.tracks()
+
+    def _select(self, keep):
+        self.ids, self.boxes, self.last = self.ids[keep], self.boxes[keep], self.last[keep]
+        self.velocity, self.hits = self.velocity[keep], self.hits[keep]
+        self.misses, self.confirmed = self.misses[keep], self.confirmed[keep]
+
+    def summary(self):
+        return f"IoU tracker: {self.next_id - 1} tracks started, {len(self.ids)} alive"
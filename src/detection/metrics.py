@@ -0,0 +1,236 @@
+# src/detection/metrics.py
+import bisect
+import threading
+import time
+
+# Upper bounds (seconds) of the per-stage latency buckets
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# ============== Histogram ==============
+class Histogram:
+    """Fixed-bucket latency histogram (Prometheus style). Not locked: callers serialise access."""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q):
+        """Approximate quantile, interpolated linearly inside the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def cumulative(self):
+        """[(le, cumulative count)] including '+Inf'."""
+        total, out = 0, []
+        for le, n in zip([*map(str, self.buckets), "+Inf"], self.counts):
+            total += n
+            out.append((le, total))
+        return out
+
+
+# ============== Per-camera metrics ==============
+class CameraMetrics:
+    """
+    Everything exported for one camera across its jobs: a latency histogram per stage,
+    processed and dropped frame totals, the current fps (over ~1 s windows) and the live
+    depth of the running job's queues.
+    """
+
+    def __init__(self, camera, fps_window=1.0):
+        self.camera = camera
+        self.fps_window = fps_window
+        self.stages = {}   # stage: Histogram
+        self.frames = 0
+        self.dropped = 0   # from finished jobs; the running job's count is read through _dropped_fn
+        self.fps = 0.0
+        self._dropped_fn = None
+        self._queues = {}  # name: qsize function of the running job
+        self._remote = None  # running job's export() while it runs in a worker process
+        self._window_start = time.monotonic()
+        self._window_frames = 0
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = self.stages[stage] = Histogram()
+            hist.observe(seconds)
+
+    def frame_done(self):
+        with self._lock:
+            self.frames += 1
+            self._window_frames += 1
+            now = time.monotonic()
+            elapsed = now - self._window_start
+            if elapsed >= self.fps_window:
+                self.fps = self._window_frames / elapsed
+                self._window_start, self._window_frames = now, 0
+
+    def watch_queue(self, name, qsize):
+        with self._lock:
+            self._queues[name] = qsize
+
+    def watch_dropped(self, dropped):
+        with self._lock:
+            self._dropped_fn = dropped
+
+    def end_job(self):
+        """Forget the finished job's queues and fold its dropped frames into the total."""
+        with self._lock:
+            if self._dropped_fn is not None:
+                self.dropped += self._dropped_fn()
+            self._dropped_fn = None
+            self._queues = {}
+            self.fps = 0.0
+
+    def export(self):
+        """
+        Picklable totals (frames, dropped, stage histograms) plus the current fps and queue
+        depths, to hand metrics to another process.
+        """
+        with self._lock:
+            dropped = self.dropped + (self._dropped_fn() if self._dropped_fn is not None else 0)
+            stages = {}
+            for stage, hist in self.stages.items():
+                copy = stages[stage] = Histogram(hist.buckets)
+                copy.merge(hist)
+            return {"frames": self.frames, "dropped": dropped, "stages": stages,
+                    "fps": self.fps, "queues": self._queue_depths()}
+
+    def absorb(self, exported):
+        """Add totals export()ed by a worker process (e.g. a finished shard or job) to this camera's."""
+        with self._lock:
+            self._remote = None
+            self.frames += exported["frames"]
+            self.dropped += exported["dropped"]
+            for stage, hist in exported["stages"].items():
+                self.stages.setdefault(stage, Histogram(hist.buckets)).merge(hist)
+
+    def follow(self, exported):
+        """
+        Show the running job's latest export() from its worker process on top of this camera's
+        totals, until the job's final export is absorbed (None: the job ended without one).
+        """
+        with self._lock:
+            self._remote = exported
+
+    def _queue_depths(self):
+        # Caller holds self._lock
+        queues = {}
+        for name, qsize in self._queues.items():
+            try:
+                queues[name] = qsize()
+            except Exception:
+                continue
+        return queues
+
+    def snapshot(self):
+        with self._lock:
+            frames, fps, queues = self.frames, self.fps, self._queue_depths()
+            dropped = self.dropped + (self._dropped_fn() if self._dropped_fn is not None else 0)
+            stages = self.stages
+            remote = self._remote
+            if remote is not None:
+                frames, dropped = frames + remote["frames"], dropped + remote["dropped"]
+                fps, queues = remote["fps"], remote["queues"]
+                stages = dict(stages)
+                for stage, hist in remote["stages"].items():
+                    merged = stages[stage] = Histogram(hist.buckets)
+                    merged.merge(hist)
+                    if stage in self.stages:
+                        merged.merge(self.stages[stage])
+            stages = {stage: (hist.cumulative(), hist.sum, hist.count) for stage, hist in stages.items()}
+            return {"frames": frames, "dropped": dropped, "fps": fps, "queues": queues, "stages": stages}
+
+
+class MetricsRegistry:
+    """Process-wide CameraMetrics by camera key, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._cameras = {}
+        self._lock = threading.Lock()
+
+    def camera(self, camera_key):
+        with self._lock:
+            metrics = self._cameras.get(camera_key)
+            if metrics is None:
+                metrics = self._cameras[camera_key] = CameraMetrics(camera_key)
+            return metrics
+
+    def take(self, camera_key):
+        """Remove and return a camera's metrics (None if it has none), e.g. to export them."""
+        with self._lock:
+            return self._cameras.pop(camera_key, None)
+
+    def render(self, models=None):
+        """`models`: model stats (see ModelRegistry.stats) to export instead of this process's."""
+        from src.detection.model_registry import REGISTRY
+        with self._lock:
+            cameras = dict(self._cameras)
+        snapshots = {key: metrics.snapshot() for key, metrics in sorted(cameras.items())}
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        family("pizza_stage_seconds", "histogram", "Time spent per pipeline stage call.")
+        for cam, snap in snapshots.items():
+            for stage, (buckets, total, count) in sorted(snap["stages"].items()):
+                labels = f'camera="{_escape(cam)}",stage="{stage}"'
+                for le, n in buckets:
+                    lines.append(f'pizza_stage_seconds_bucket{{{labels},le="{le}"}} {n}')
+                lines.append(f"pizza_stage_seconds_sum{{{labels}}} {total:.6f}")
+                lines.append(f"pizza_stage_seconds_count{{{labels}}} {count}")
+
+        family("pizza_frames_total", "counter", "Frames processed.")
+        for cam, snap in snapshots.items():
+            lines.append(f'pizza_frames_total{{camera="{_escape(cam)}"}} {snap["frames"]}')
+        family("pizza_frames_dropped_total", "counter", "Stale live frames dropped before processing.")
+        for cam, snap in snapshots.items():
+            lines.append(f'pizza_frames_dropped_total{{camera="{_escape(cam)}"}} {snap["dropped"]}')
+        family("pizza_fps", "gauge", "Frames processed per second by the running job.")
+        for cam, snap in snapshots.items():
+            lines.append(f'pizza_fps{{camera="{_escape(cam)}"}} {snap["fps"]:.2f}')
+        family("pizza_queue_depth", "gauge", "Items waiting in the running job's pipeline queues.")
+        for cam, snap in snapshots.items():
+            for queue_name, depth in sorted(snap["queues"].items()):
+                lines.append(f'pizza_queue_depth{{camera="{_escape(cam)}",queue="{queue_name}"}} {depth}')
+
+        family("pizza_model_load_seconds", "gauge", "Load time of each resident model.")
+        for info in REGISTRY.stats() if models is None else models:
+            labels = f'kind="{_escape(info["kind"])}",path="{_escape(info["path"])}",device="{_escape(info["device"])}"'
+            if "worker" in info:
+                labels += f',worker="{_escape(info["worker"])}"'
+            lines.append(f"pizza_model_load_seconds{{{labels}}} {info['load_seconds']}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+METRICS = MetricsRegistry()
@@ -0,0 +1,231 @@
+# src/detection/model_registry.py
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+DEFAULT_MODEL_PATH = os.path.join(project_root, "models", "yolov8l.pt")
+
+# ============== Model registry ==============
+class ModelEntry:
+    """
+    A loaded model shared by every job in the process. Use `lock` around inference.
+    `users` counts the runs holding it (ModelRegistry.acquire/release); only unused entries are evicted.
+    """
+
+    def __init__(self, key, model, load_seconds, device=None):
+        self.key = key
+        self.model = model
+        self.device = device
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        self.hits = 0
+        self.users = 0
+        self.lock = threading.Lock()
+
+    def info(self):
+        kind, path, device = self.key
+        return {
+            "kind": kind,
+            "path": path,
+            "device": device,
+            "load_seconds": round(self.load_seconds, 3),
+            "loaded_at": self.loaded_at,
+            "last_used": self.last_used,
+            "hits": self.hits,
+            "users": self.users
+        }
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models keyed by (kind, weight path, device).
+    Each model is loaded once and shared. Detectors are limited to `max_models`
+    resident entries and DeepSort embedders, counted separately, to `max_embedders`.
+    Beyond a limit the least recently used entry *that no run holds* is evicted; while
+    every entry is in use the limit is exceeded rather than unloading a model mid-run,
+    and the surplus goes as soon as a run releases its model.
+
+    Anything else that keeps a reference to a model (e.g. batching.BatchedDetector)
+    registers on_evict() so it lets go of the entry when it is unloaded.
+    """
+
+    def __init__(self, max_models=4, max_embedders=2):
+        self.max_models = max_models
+        self.max_embedders = max_embedders
+        self._entries = OrderedDict()
+        self._load_locks = {}
+        self._lock = threading.Lock()
+        self._evict_callbacks = []
+
+    def on_evict(self, callback):
+        """Call callback(entry) for every entry unloaded from now on."""
+        self._evict_callbacks.append(callback)
+
+    def _evicted(self, entries):
+        # Called without self._lock, so callbacks may use the registry
+        for entry in entries:
+            for callback in self._evict_callbacks:
+                try:
+                    callback(entry)
+                except Exception as e:
+                    print(f"Evict callback failed for {entry.key[0]} model {entry.key[1]}: {e}")
+
+    def get(self, kind, path, device, loader, acquire=False):
+        """The loaded entry, loading it on first use. acquire=True also holds it for the caller (see release)."""
+        key = (kind, os.path.abspath(path) if path else None, device or "auto")
+        with self._lock:
+            entry = self._touch(key, acquire)
+            if entry is not None:
+                return entry
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Load outside the registry lock so other models stay available, but only once per key
+        with load_lock:
+            with self._lock:
+                entry = self._touch(key, acquire)
+                if entry is not None:
+                    return entry
+            start = time.perf_counter()
+            model = loader()
+            entry = ModelEntry(key, model, time.perf_counter() - start, device=device)
+            print(f"Loaded {kind} model {key[1]} on {key[2]} in {entry.load_seconds:.2f}s")
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                entry.hits += 1
+                entry.users += acquire
+                evicted = self._evict_unused(keep=key)
+            self._evicted(evicted)
+            return entry
+
+    def acquire(self, entry):
+        with self._lock:
+            entry.users += 1
+
+    def release(self, entry):
+        with self._lock:
+            entry.users = max(0, entry.users - 1)
+            evicted = self._evict_unused()
+        self._evicted(evicted)
+
+    def _touch(self, key, acquire=False):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            entry.last_used = time.time()
+            entry.hits += 1
+            entry.users += acquire
+        return entry
+
+    @staticmethod
+    def _is_embedder(key):
+        return key[0].startswith("embedder:")
+
+    def _evict_unused(self, keep=None):
+        # Caller holds self._lock; `keep` is the entry just loaded for a caller. Returns the evicted entries.
+        evicted = []
+        for embedders, limit in ((False, self.max_models), (True, self.max_embedders)):
+            keys = [key for key in self._entries if self._is_embedder(key) == embedders]
+            excess = len(keys) - limit
+            for key in keys:  # least recently used first
+                if excess <= 0:
+                    break
+                if key == keep or self._entries[key].users:
+                    continue
+                excess -= 1
+                evicted.append(self._entries.pop(key))
+                self._load_locks.pop(key, None)
+                print(f"Evicted {key[0]} model {key[1]} (LRU)")
+        return evicted
+
+    def evict(self, kind=None):
+        """Unload every unused entry (of `kind`); entries held by a run stay."""
+        evicted = []
+        with self._lock:
+            for key in [k for k in self._entries if kind is None or k[0] == kind]:
+                if self._entries[key].users:
+                    continue
+                evicted.append(self._entries.pop(key))
+                self._load_locks.pop(key, None)
+        self._evicted(evicted)
+
+    def stats(self):
+        with self._lock:
+            return [entry.info() for entry in self._entries.values()]
+
+
+REGISTRY = ModelRegistry(max_models=int(os.environ.get("PIZZA_MAX_MODELS", 4)),
+                         max_embedders=int(os.environ.get("PIZZA_MAX_EMBEDDERS", 2)))
+
+# ============== Loaders ==============
+def get_yolo(model_path=DEFAULT_MODEL_PATH, device=None, warmup=False):
+    def load():
+        from ultralytics import YOLO
+        model = YOLO(model_path)
+        if warmup:
+            # First call builds the predictor and fuses layers; pay that cost at load time
+            model(np.zeros((640, 640, 3), dtype=np.uint8), device=device, verbose=False)
+        return model
+    return REGISTRY.get("yolo", model_path, device, load)
+
+
+def get_detector(model_path=DEFAULT_MODEL_PATH, backend=None, device=None, warmup=False, acquire=False):
+    """
+    Shared detector behind one of backends.DETECTOR_BACKENDS (PyTorch, ONNX Runtime FP32/INT8,
+    OpenVINO). Its `predict(frames)` returns one backends.FrameDetections per frame.
+    acquire=True holds it against eviction until REGISTRY.release(entry).
+    """
+    from src.detection.backends import load_backend, DEFAULT_BACKEND
+    backend = backend or DEFAULT_BACKEND
+
+    def load():
+        detector = load_backend(backend, model_path, device=device)
+        if warmup:
+            detector.predict([np.zeros((640, 640, 3), dtype=np.uint8)])
+        return detector
+    return REGISTRY.get(f"detector:{backend}", model_path, device, load, acquire=acquire)
+
+
+def cuda_available():
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except ImportError:
+        return False
+
+
+def get_embedder(embedder="mobilenet", half=False, device=None, embedder_wts=None, acquire=False):
+    """
+    Shared DeepSort appearance embedder. DeepSort instances are created with embedder=None.
+    Half precision only applies on a GPU; on CPU-only hosts the embedder runs in full precision.
+    """
+    gpu = device != "cpu" and cuda_available()
+    half = half and gpu
+
+    def load():
+        if embedder != "mobilenet":
+            raise ValueError(f"Unsupported shared embedder: {embedder}")
+        from deep_sort_realtime.embedder.embedder_pytorch import MobileNetv2_Embedder
+        model = MobileNetv2_Embedder(
+            model_wts_path=embedder_wts,
+            half=half,
+            max_batch_size=16,
+            bgr=True,
+            gpu=gpu
+        )  # runs its own warm-up prediction
+        return model
+    return REGISTRY.get(f"embedder:{embedder}:{'half' if half else 'full'}", embedder_wts, device, load,
+                        acquire=acquire)
+
+
+def preload_models():
+    """Load and warm up the default detector and embedder so the first job does not pay for it."""
+    try:
+        get_detector(DEFAULT_MODEL_PATH, warmup=True)
+        get_embedder("mobilenet", half=True)
+    except Exception as e:
+        print(f"Model preload failed, models will load on first use: {e}")
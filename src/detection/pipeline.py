@@ -0,0 +1,188 @@
+# src/detection/pipeline.py
+import queue
+import threading
+import time
+from contextlib import contextmanager
+import cv2
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from src.detection.metrics import Histogram
+
+# ============== Stage timing ==============
+class StageTimer:
+    """
+    Accumulates wall time per pipeline stage; safe to share between stage threads.
+    With `metrics` (a metrics.CameraMetrics), every timing, processed frame and watched
+    queue is also exported to the process-wide /metrics.
+    """
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self._totals = {}
+        self._counts = {}
+        self._hists = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self._totals[stage] = self._totals.get(stage, 0.0) + seconds
+            self._counts[stage] = self._counts.get(stage, 0) + 1
+            hist = self._hists.get(stage)
+            if hist is None:
+                hist = self._hists[stage] = Histogram()
+            hist.observe(seconds)
+        if self.metrics is not None:
+            self.metrics.observe(stage, seconds)
+
+    def frame_done(self):
+        if self.metrics is not None:
+            self.metrics.frame_done()
+
+    def watch_queue(self, name, qsize):
+        if self.metrics is not None:
+            self.metrics.watch_queue(name, qsize)
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def summary(self):
+        with self._lock:
+            return {
+                stage: {
+                    "count": self._counts[stage],
+                    "total_s": round(total, 3),
+                    "mean_ms": round(1000 * total / max(1, self._counts[stage]), 2),
+                    "p50_ms": round(1000 * self._hists[stage].quantile(0.5), 2),
+                    "p99_ms": round(1000 * self._hists[stage].quantile(0.99), 2)
+                }
+                for stage, total in self._totals.items()
+            }
+
+    def print_summary(self, title="Stage timing"):
+        print(f"{title}:")
+        for stage, s in self.summary().items():
+            print(f"  {stage:<10} {s['count']:>7} calls  {s['total_s']:>9.2f}s total  {s['mean_ms']:>8.2f} ms/call"
+                  f"  p50 {s['p50_ms']:>8.2f}  p99 {s['p99_ms']:>8.2f} ms")
+
+
+# ============== Threaded stages ==============
+class ThreadedStage:
+    """
+    Runs `producer` (any iterator) in its own thread and hands items to the consumer
+    through a bounded queue. A full queue blocks the producer (backpressure) and a
+    single producer thread keeps items in order.
+    """
+    _END = object()
+
+    def __init__(self, producer, maxsize=8, name="stage"):
+        self.name = name
+        self._producer = producer
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            for item in self._producer:
+                if not self._put(item):
+                    break
+        except Exception as e:
+            self._error = e
+        finally:
+            self._put(self._END)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is self._END:
+                if self._error is not None:
+                    raise self._error
+                return
+            yield item
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def _drain(self):
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def close(self):
+        self._stop.set()
+        while self._thread.is_alive():
+            self._drain()
+            self._thread.join(timeout=0.05)
+        self._drain()
+        self._queue.put_nowait(self._END)  # unblock a consumer still waiting on us
+
+
+def read_frames(cap, timer=None):
+    """Decode frames from an open cv2.VideoCapture (the reader stage)."""
+    while cap.isOpened():
+        start = time.perf_counter()
+        ret, frame = cap.read()
+        if timer is not None:
+            timer.add("decode", time.perf_counter() - start)
+        if not ret:
+            break
+        yield frame
+
+
+class AsyncVideoWriter:
+    """cv2.VideoWriter whose encoding runs on a writer thread behind a bounded queue."""
+
+    def __init__(self, output_path, fourcc, fps, size, maxsize=16, timer=None):
+        self._out = cv2.VideoWriter(output_path, fourcc, fps, size)
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._timer = timer
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                return
+            if self._error is not None:
+                continue
+            try:
+                start = time.perf_counter()
+                self._out.write(frame)
+                if self._timer is not None:
+                    self._timer.add("encode", time.perf_counter() - start)
+            except Exception as e:
+                self._error = e
+
+    def write(self, frame):
+        # Blocks when the encoder falls behind, so memory stays bounded
+        self._queue.put(frame)
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def release(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._out.release()
+        if self._error is not None:
+            raise self._error
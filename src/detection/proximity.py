@@ -0,0 +1,50 @@
+# src/detection/proximity.py
+from collections import deque
+
+# ============== Recently lost tracks ==============
+class LostTrackIndex:
+    """
+    Time-windowed spatial hash of positions where tracks were recently lost.
+
+    Cells are `radius` pixels wide, so every point within `radius` of a query lies in the
+    3x3 block of cells around it. Entries are appended in frame order, which makes expiry
+    a pop from the left of one global deque and of the matching cell's deque.
+    """
+
+    def __init__(self, radius=40, match_frames=20, retain_frames=30):
+        self.radius = radius
+        self.match_frames = match_frames
+        self.retain_frames = max(retain_frames, match_frames)
+        self._cells = {}        # (gx, gy): deque of (cx, cy, frame)
+        self._order = deque()   # (frame, cell) in insertion order
+
+    def __len__(self):
+        return len(self._order)
+
+    def _cell(self, cx, cy):
+        return int(cx // self.radius), int(cy // self.radius)
+
+    def expire(self, frame_idx):
+        while self._order and frame_idx - self._order[0][0] >= self.retain_frames:
+            _, cell = self._order.popleft()
+            bucket = self._cells[cell]
+            bucket.popleft()
+            if not bucket:
+                del self._cells[cell]
+
+    def add(self, cx, cy, lost_frame, frame_idx):
+        self.expire(frame_idx)
+        cell = self._cell(cx, cy)
+        self._cells.setdefault(cell, deque()).append((cx, cy, lost_frame))
+        self._order.append((lost_frame, cell))
+
+    def near(self, cx, cy, frame_idx):
+        """True if a track was lost within `radius` px (per axis) less than `match_frames` ago."""
+        gx, gy = self._cell(cx, cy)
+        for nx in (gx - 1, gx, gx + 1):
+            for ny in (gy - 1, gy, gy + 1):
+                for lx, ly, lost_frame in self._cells.get((nx, ny), ()):
+                    if (abs(lx - cx) < self.radius and abs(ly - cy) < self.radius
+                            and frame_idx - lost_frame < self.match_frames):
+                        return True
+        return False
@@ -0,0 +1,106 @@
+# src/detection/scheduler.py
+import cv2
+import numpy as np
+
+# ============== Motion gate ==============
+class MotionGate:
+    """
+    Cheap frame differencing on a downscaled grayscale region of the frame.
+    Returns True when enough pixels changed since the previous frame.
+    """
+
+    def __init__(self, region=None, scale=0.25, diff_thres=25, min_changed_ratio=0.002):
+        self.region = region  # (x1, y1, x2, y2) or None for the full frame
+        self.scale = scale
+        self.diff_thres = diff_thres
+        self.min_changed_ratio = min_changed_ratio
+        self._prev = None
+
+    def update(self, frame):
+        if self.region is not None:
+            x1, y1, x2, y2 = self.region
+            frame = frame[y1:y2, x1:x2]
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(small, (5, 5), 0)
+        prev, self._prev = self._prev, small
+        if prev is None:
+            return True
+        diff = cv2.absdiff(small, prev)
+        changed = np.count_nonzero(diff > self.diff_thres) / diff.size
+        return changed >= self.min_changed_ratio
+
+
+# ============== Adaptive detection scheduler ==============
+class _DetectPolicy:
+    """Detect while hot (a trigger within the last `cooldown_frames` frames), else every `idle_interval`-th frame."""
+
+    def __init__(self, idle_interval, cooldown_frames):
+        self.idle_interval = idle_interval
+        self.cooldown_frames = cooldown_frames
+        self._hot = 0
+        self._idle = 0
+
+    def step(self, trigger):
+        if trigger:
+            self._hot = self.cooldown_frames
+        if self._hot > 0:
+            self._hot -= 1
+            detect = True
+        else:
+            self._idle += 1
+            detect = self._idle >= self.idle_interval
+        if detect:
+            self._idle = 0
+        return detect
+
+
+class AdaptiveScheduler:
+    """
+    Decides per frame whether to run YOLO.
+    - Every frame while there is motion in the region, live tracks, or for `cooldown_frames` after either.
+    - Every `idle_interval` frames otherwise.
+    Frames without detection are carried by the tracker's Kalman prediction.
+
+    Motion is measured in the inference stage (prefetch), which runs up to a queue of
+    frames ahead of the tracker, so it only knows a lagging `tracks_alive` hint and batches
+    the frames it expects to need. The decision that counts is taken in the tracking stage
+    (decide) with the tracker's state after the previous frame: frames it needs that were
+    not prefetched are detected on demand, and prefetched results it does not need are
+    dropped. The frames the tracker sees detections on therefore do not depend on timing.
+    """
+
+    def __init__(self, region=None, idle_interval=5, cooldown_frames=50, **gate_params):
+        self.gate = MotionGate(region=region, **gate_params)
+        self.idle_interval = max(1, int(idle_interval))
+        self.cooldown_frames = cooldown_frames
+        self.tracks_alive = False  # hint for prefetch; set by the tracking stage
+        self.frames = 0
+        self.detected = 0
+        self.on_demand = 0  # needed by decide() but not prefetched
+        self.wasted = 0     # prefetched but not needed
+        self._ahead = _DetectPolicy(self.idle_interval, cooldown_frames)
+        self._policy = _DetectPolicy(self.idle_interval, cooldown_frames)
+
+    def prefetch(self, frame):
+        """Inference stage: (motion in the region, whether to detect this frame ahead of decide)."""
+        motion = self.gate.update(frame)
+        return motion, self._ahead.step(motion or self.tracks_alive)
+
+    def decide(self, motion, tracks_alive, prefetched):
+        """Tracking stage: whether this frame gets detections, given the tracker's current state."""
+        self.frames += 1
+        detect = self._policy.step(motion or tracks_alive)
+        self.detected += detect
+        self.on_demand += detect and not prefetched
+        self.wasted += prefetched and not detect
+        return detect
+
+    def stats(self):
+        return {"frames": self.frames, "detected": self.detected, "on_demand": self.on_demand, "wasted": self.wasted}
+
+    def summary(self):
+        skipped = self.frames - self.detected
+        ratio = self.detected / self.frames if self.frames else 0.0
+        return (f"Adaptive detection: YOLO ran on {self.detected}/{self.frames} frames ({ratio:.0%}), {skipped} carried by tracker "
+                f"({self.on_demand} detected on demand, {self.wasted} prefetched and dropped)")
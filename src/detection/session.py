@@ -0,0 +1,301 @@
+# src/detection/session.py
+import threading
+import time
+import queue
+import cv2
+from collections import deque
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from src.detection.counter import track_and_count_pizzas
+from src.detection.sharding import process_sharded
+from src.detection.metrics import METRICS
+
+def encode_jpeg(frame, width=None, quality=70):
+    """JPEG bytes of `frame`, downscaled to `width` px (aspect preserved, never upscaled)."""
+    h, w = frame.shape[:2]
+    if width and width < w:
+        frame = cv2.resize(frame, (int(width), max(1, round(h * width / w))), interpolation=cv2.INTER_AREA)
+    _, jpeg = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    return jpeg.tobytes()
+
+# ============== Pipeline session ==============
+class PipelineSession:
+    """
+    A single detection/tracking/counting run for one camera.
+    track_and_count_pizzas drives pizza_tracker exactly once; every annotated frame
+    (the same one that is counted and written to the MP4) is published here so any
+    number of stream subscribers can follow the run without re-running the model.
+    The run happens in this process (start / run) or in a job scheduler's worker process
+    (run_in), which sends the frames back only while there are stream viewers.
+    """
+
+    OPTIONS = ("video_path", "output_path", "conf_thres", "count_polygon", "batch_size", "roi_padding",
+               "adaptive", "proximity", "parquet", "resume", "shards", "video_mode", "backend",
+               "tracker_backend")
+
+    def __init__(self, camera_key, video_path, output_path, conf_thres=0.5, count_polygon=None, batch_size=1,
+                 roi_padding=None, adaptive=False, proximity=None, parquet=False, resume=False,
+                 shards=1, video_mode="full", backend=None,
+                 tracker_backend="deepsort"):
+        self.camera_key = camera_key
+        self.video_path = video_path
+        self.output_path = output_path
+        self.conf_thres = conf_thres
+        self.count_polygon = count_polygon
+        self.batch_size = batch_size
+        self.roi_padding = roi_padding
+        self.adaptive = adaptive
+        self.proximity = proximity
+        self.parquet = parquet
+        self.resume = resume
+        self.shards = shards
+        self.video_mode = video_mode
+        self.backend = backend
+        self.tracker_backend = tracker_backend
+        self.stats = None  # track_and_count_pizzas summary once the run ends
+
+        self._cond = threading.Condition()
+        self._thread = None
+        self._cancel = threading.Event()
+        self._done = False
+        self._seq = 0
+        self._frame_seq = 0  # seq of self._frame: metadata can be published without a frame
+        self._frame = None
+        self._info = None
+        self._messages = deque(maxlen=256)  # (seq, info) for metadata subscribers
+        self._variants = {}  # (width, quality): [lock, seq, jpeg bytes] shared by all viewers
+        self._variants_lock = threading.Lock()
+        self._viewers = 0
+        self._worker = None  # jobs.WorkerProcess running this session, if any
+
+    # ---- lifecycle ----
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def run(self):
+        try:
+            self.stats = self._count(self._publish, self._cancel.is_set)
+        finally:
+            self.close()
+
+    def _count(self, frame_callback, stop_flag):
+        if self.shards > 1:
+            # Segments run in worker processes: no live frames, only the merged results.
+            # /process rejects the options a sharded run cannot honour (parquet, resume,
+            # preview / events video).
+            return process_sharded(
+                camera_key=self.camera_key,
+                video_path=self.video_path,
+                output_path=self.output_path,
+                shards=self.shards,
+                concat_video=self.video_mode == "full",
+                stop_flag=stop_flag,
+                conf_thres=self.conf_thres,
+                count_polygon=self.count_polygon,
+                batch_size=self.batch_size,
+                roi_padding=self.roi_padding,
+                adaptive=self.adaptive,
+                proximity=self.proximity,
+                backend=self.backend,
+                tracker_backend=self.tracker_backend
+            )
+        return track_and_count_pizzas(
+            camera_key=self.camera_key,
+            video_path=self.video_path,
+            output_path=self.output_path,
+            conf_thres=self.conf_thres,
+            count_polygon=self.count_polygon,
+            stop_flag=stop_flag,
+            frame_callback=frame_callback,
+            batch_size=self.batch_size,
+            roi_padding=self.roi_padding,
+            adaptive=self.adaptive,
+            proximity=self.proximity,
+            parquet=self.parquet,
+            resume=self.resume,
+            video_mode=self.video_mode,
+            backend=self.backend,
+            tracker_backend=self.tracker_backend
+        )
+
+    def run_in(self, worker):
+        """
+        Run in a job scheduler's WorkerProcess (see src/api/jobs.py) and publish the frames,
+        metadata and metrics it sends back. Raises RuntimeError if the run fails there.
+        """
+        metrics = METRICS.camera(self.camera_key)
+        with self._cond:
+            self._worker = worker
+            worker.submit(run_job, camera_key=self.camera_key,
+                          options={name: getattr(self, name) for name in self.OPTIONS})
+            worker.want_frames.value = self._viewers > 0
+        if self._cancel.is_set():
+            worker.cancel.set()  # stopped while being handed over
+        try:
+            while True:
+                message = worker.receive()
+                if message[0] == "frame":
+                    self._publish(message[1], message[2])
+                elif message[0] == "metrics":
+                    metrics.follow(message[1])
+                elif message[0] == "final_metrics":
+                    metrics.absorb(message[1])
+                elif message[0] == "done":
+                    self.stats = message[1]
+                    return
+                else:
+                    raise RuntimeError(message[1])
+        finally:
+            metrics.follow(None)
+            with self._cond:
+                self._worker = None
+            self.close()
+
+    def stop(self):
+        # Cooperative cancellation: the counting loop checks this once per frame
+        self._cancel.set()
+        with self._cond:
+            if self._worker is not None:
+                self._worker.cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def close(self):
+        """Mark the session finished and release every subscriber."""
+        with self._cond:
+            self._done = True
+            self._cond.notify_all()
+
+    def is_running(self):
+        if self._worker is not None:
+            return not self._done
+        return not self._done and self._thread is not None and self._thread.is_alive()
+
+    # ---- fan-out ----
+    def _publish(self, frame, info):
+        with self._cond:
+            self._seq += 1
+            if frame is not None:
+                self._frame, self._frame_seq = frame, self._seq
+            self._info = info
+            self._messages.append((self._seq, info))
+            self._cond.notify_all()
+
+    def latest(self):
+        with self._cond:
+            return self._seq, self._frame, self._info
+
+    def _watch(self, delta):
+        # Frames are only sent over from a worker process while someone is watching them
+        with self._cond:
+            self._viewers += delta
+            if self._worker is not None:
+                self._worker.want_frames.value = self._viewers > 0
+
+    def _latest_frames(self, timeout=1.0):
+        last_seq = 0
+        self._watch(1)
+        try:
+            while True:
+                with self._cond:
+                    while self._frame_seq == last_seq and not self._done:
+                        self._cond.wait(timeout)
+                    if self._frame_seq == last_seq and self._done:
+                        return
+                    last_seq = self._frame_seq
+                    frame = self._frame
+                yield last_seq, frame
+        finally:
+            self._watch(-1)
+
+    def frames(self, timeout=1.0):
+        """
+        Yield the latest annotated frame each time a new one is published.
+        Slow subscribers skip intermediate frames instead of holding back the pipeline.
+        """
+        for _, frame in self._latest_frames(timeout):
+            yield frame
+
+    def encoded(self, seq, frame, width=None, quality=70):
+        """JPEG of frame `seq` for one (width, quality) variant, encoded once for all viewers."""
+        with self._variants_lock:
+            variant = self._variants.setdefault((width, quality), [threading.Lock(), 0, None])
+        with variant[0]:
+            if variant[1] < seq:
+                variant[1], variant[2] = seq, encode_jpeg(frame, width, quality)
+            return variant[2]
+
+    def jpeg_frames(self, width=None, max_fps=None, quality=70, timeout=1.0):
+        """
+        Yield JPEG bytes of the latest frame, at most `max_fps` per second.
+        A viewer that is slow to consume (or capped) skips straight to the newest frame;
+        viewers asking for the same width/quality share one encode per frame.
+        """
+        min_interval = 1.0 / max_fps if max_fps else 0.0
+        for seq, frame in self._latest_frames(timeout):
+            sent_at = time.monotonic()
+            yield self.encoded(seq, frame, width, quality)
+            if min_interval:
+                remaining = min_interval - (time.monotonic() - sent_at)
+                if remaining > 0:
+                    time.sleep(remaining)
+
+    def updates(self, max_fps=None, timeout=1.0):
+        """
+        Yield per-frame metadata dicts (frame, pizza_count, tracks, events) as they are published.
+        Frames without sale events are thinned to at most `max_fps`; frames carrying events are
+        always delivered unless the subscriber falls more than the buffer behind.
+        """
+        last_seq = 0
+        min_interval = 1.0 / max_fps if max_fps else 0.0
+        last_sent = 0.0
+        while True:
+            with self._cond:
+                while self._seq == last_seq and not self._done:
+                    self._cond.wait(timeout)
+                if self._seq == last_seq and self._done:
+                    return
+                pending = [(seq, info) for seq, info in self._messages if seq > last_seq]
+                last_seq = self._seq
+            for i, (seq, info) in enumerate(pending):
+                now = time.monotonic()
+                is_latest = i == len(pending) - 1
+                if info["events"] or not min_interval or (is_latest and now - last_sent >= min_interval):
+                    last_sent = now
+                    yield info
+
+
+# ============== Worker process side ==============
+def run_job(camera_key, options, messages, stop_flag, want_frames, metrics_interval=1.0):
+    """
+    Run one PipelineSession in this worker process for PipelineSession.run_in: every frame's
+    metadata is sent back, the annotated frame itself only while want_frames(), and the
+    camera's metrics about once per `metrics_interval` seconds. Returns the run's stats.
+    """
+    METRICS.take(camera_key)  # earlier jobs' metrics were already handed over
+    session = PipelineSession(camera_key, **options)
+    next_metrics = [time.monotonic() + metrics_interval]
+
+    def relay(frame, info):
+        sent = False
+        if want_frames():
+            try:
+                messages.put_nowait(("frame", frame, info))
+                sent = True
+            except queue.Full:
+                pass  # the API process is behind: skip this frame, still send its metadata
+        if not sent:
+            messages.put(("frame", None, info))
+        if time.monotonic() >= next_metrics[0]:
+            messages.put(("metrics", METRICS.camera(camera_key).export()))
+            next_metrics[0] = time.monotonic() + metrics_interval
+
+    try:
+        return session._count(relay, stop_flag)
+    finally:
+        metrics = METRICS.take(camera_key)
+        if metrics is not None:
+            messages.put(("final_metrics", metrics.export()))
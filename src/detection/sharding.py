@@ -0,0 +1,269 @@
+# src/detection/sharding.py
+import os
+import csv
+import time
+import shutil
+import multiprocessing as mp
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import cv2
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from src.config.camera_zones import DEFAULT_PROXIMITY
+from src.detection.events import SaleEventSink
+from src.detection.metrics import METRICS
+
+ID_STRIDE = 1_000_000  # track ids of shard k are offset by k * ID_STRIDE unless matched to shard k-1
+
+def plan_segments(frame_count, shards, overlap_frames):
+    """
+    Split frames 1..frame_count into `shards` segments (start, end], each preceded by up to
+    `overlap_frames` warm-up frames that the previous segment also processes. The last
+    segment's end is None: it runs to the end of the video, since containers may report a
+    frame count that is a little off. Returns [(warmup_start, start, end)].
+    """
+    if frame_count <= 0:
+        raise ValueError("Cannot shard a video without a known frame count")
+    shards = max(1, min(shards, frame_count))
+    bounds = [round(i * frame_count / shards) for i in range(shards)] + [None]
+    return [(max(0, start - overlap_frames), start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+# ============== Shard worker ==============
+_stop_event = None
+
+def _init_worker(stop_event, threads):
+    global _stop_event
+    _stop_event = stop_event
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+def _run_shard(index, video_path, shard_path, warmup_start, start, end, overlap_frames, count_params):
+    """Count one segment; return its sale events and the track centers seen in both overlap windows."""
+    from src.detection.counter import track_and_count_pizzas
+
+    head, tail = {}, {}  # frame: [(track_id, cx, cy)] in [warmup_start, start] and [end - overlap, end]
+
+    def collect(info):
+        f = info["frame"]
+        if f <= start or (end is not None and f > end - overlap_frames):
+            centers = [(t["id"], (t["box"][0] + t["box"][2]) // 2, (t["box"][1] + t["box"][3]) // 2) for t in info["tracks"]]
+            (head if f <= start else tail)[f] = centers
+
+    stats = track_and_count_pizzas(
+        video_path, shard_path,
+        stop_flag=_stop_event.is_set if _stop_event is not None else (lambda: False),
+        info_callback=collect,  # track centres only: shards are not annotated unless their video is kept
+        checkpoint_every=None,
+        start_frame=warmup_start,
+        end_frame=end,
+        **count_params
+    )
+    # This process's /metrics are not served: hand the shard's totals to the parent
+    camera_key = count_params.get("camera_key")
+    metrics = METRICS.take(camera_key) if camera_key else None
+    with open(shard_path.replace(".mp4", "_sales.csv"), "r", newline="") as f:
+        events = [row for row in csv.DictReader(f) if start < int(row["frame"]) and (end is None or int(row["frame"]) <= end)]
+    return {"index": index, "warmup_start": warmup_start, "start": start, "end": end,
+            "video": shard_path, "events": events, "head": head, "tail": tail, "stats": stats,
+            "metrics": metrics.export() if metrics is not None else None}
+
+# ============== Stitching ==============
+def match_tracks(prev_windows, next_windows, radius=None, min_votes=3):
+    """
+    Map track ids of the later shard to those of the earlier one over their shared overlap
+    frames: each later track votes, per frame, for the nearest earlier track within `radius`
+    px; pairs are accepted greedily by votes, one to one. Returns {next_id: prev_id}.
+    """
+    radius = radius or DEFAULT_PROXIMITY["radius"]
+    votes = Counter()
+    for frame, tracks in next_windows.items():
+        prev = prev_windows.get(frame)
+        if not prev:
+            continue
+        for nid, nx, ny in tracks:
+            pid, px, py = min(prev, key=lambda p: (p[1] - nx) ** 2 + (p[2] - ny) ** 2)
+            if abs(px - nx) < radius and abs(py - ny) < radius:
+                votes[(nid, pid)] += 1
+    mapping, used = {}, set()
+    for (nid, pid), n in votes.most_common():
+        if n < min_votes or nid in mapping or pid in used:
+            continue
+        mapping[nid] = pid
+        used.add(pid)
+    return mapping
+
+def stitch_events(results, radius=None):
+    """
+    Merge per-shard events into one list ordered by frame. A pizza whose track continues
+    across a boundary keeps the earlier shard's id and is only counted once.
+    """
+    results = sorted(results, key=lambda r: r["index"])
+    global_ids = []  # per shard: {local_id: global_id}
+    for k, result in enumerate(results):
+        mapping = match_tracks(results[k - 1]["tail"], result["head"], radius) if k else {}
+        global_ids.append({nid: global_ids[k - 1].get(pid, (k - 1) * ID_STRIDE + pid) for nid, pid in mapping.items()})
+
+    merged, seen = [], set()
+    events = [(int(e["frame"]), k, e) for k, r in enumerate(results) for e in r["events"]]
+    for frame, k, event in sorted(events, key=lambda x: (x[0], x[1])):
+        local_id = int(event["pizza_id"])
+        gid = global_ids[k].get(local_id, k * ID_STRIDE + local_id)
+        if gid in seen:
+            continue
+        seen.add(gid)
+        merged.append({**event, "pizza_id": gid})
+    return merged
+
+def concat_videos(results, output_path):
+    """Concatenate shard videos into `output_path`, skipping each shard's warm-up frames."""
+    writer = None
+    for result in sorted(results, key=lambda r: r["index"]):
+        cap = cv2.VideoCapture(result["video"])
+        skip = result["start"] - result["warmup_start"]
+        if writer is None:
+            size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*"mp4v"), cap.get(cv2.CAP_PROP_FPS), size)
+        n = 0
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            n += 1
+            if n > skip:
+                writer.write(frame)
+        cap.release()
+    if writer is not None:
+        writer.release()
+
+def merge_stats(results, events, seconds):
+    """
+    One track_and_count_pizzas-style summary for a sharded run: the stitched count, every
+    frame the shards processed (warm-up included) over the wall-clock time, and per-stage
+    calls and totals summed across shards (p50 / p99 are the slowest shard's).
+    """
+    frames = sum(r["stats"]["frames"] for r in results)
+    stages = {}
+    for r in results:
+        for stage, s in r["stats"]["stages"].items():
+            merged = stages.setdefault(stage, {"count": 0, "total_s": 0.0, "p50_ms": 0.0, "p99_ms": 0.0})
+            merged["count"] += s["count"]
+            merged["total_s"] += s["total_s"]
+            merged["p50_ms"] = max(merged["p50_ms"], s["p50_ms"])
+            merged["p99_ms"] = max(merged["p99_ms"], s["p99_ms"])
+    for merged in stages.values():
+        merged["total_s"] = round(merged["total_s"], 3)
+        merged["mean_ms"] = round(1000 * merged["total_s"] / max(1, merged["count"]), 2)
+    return {
+        "pizza_count": len(events),
+        "frames": frames,
+        "seconds": round(seconds, 3),
+        "fps": round(frames / seconds, 2) if seconds else None,
+        "shards": len(results),
+        "stages": stages
+    }
+
+# ============== Sharded run ==============
+def process_sharded(video_path, output_path, shards=None, overlap_seconds=10.0, concat_video=False,
+                    stop_flag=lambda: False, threads_per_shard=None, **count_params):
+    """
+    Count a long video as `shards` time segments in parallel worker processes.
+
+    Each segment is processed with `overlap_seconds` of warm-up from the previous segment
+    so tracks are established at its start; only events inside the segment are kept, and
+    tracks seen by both shards in the overlap are reconciled so a pizza crossing a boundary
+    is counted exactly once. Writes one merged `*_sales.csv` and, with concat_video, the
+    annotated video (overlay counts are per segment). `count_params` go to track_and_count_pizzas;
+    with a camera_key among them, each shard's frame and stage totals are added to this
+    process's /metrics when it finishes.
+
+    Returns the merged summary (see merge_stats).
+    """
+    # Shard videos are only needed to build the concatenated one
+    count_params.setdefault("video_mode", "full" if concat_video else "none")
+
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    if frame_count <= 0:
+        raise ValueError(f"Cannot shard {video_path}: its frame count is unknown (process it with shards=1)")
+
+    cores = os.cpu_count() or 1
+    shards = shards or max(1, cores // 4)
+    threads_per_shard = threads_per_shard or max(1, cores // shards)
+    overlap_frames = int(overlap_seconds * fps)
+    segments = plan_segments(frame_count, shards, overlap_frames)
+
+    shard_dir = output_path.replace(".mp4", "_shards")
+    os.makedirs(shard_dir, exist_ok=True)
+    print(f"Processing {video_path} as {len(segments)} shards of ~{frame_count // len(segments)} frames "
+          f"with {overlap_frames} frames of overlap")
+
+    # spawn: CUDA and the model registry do not survive fork
+    ctx = mp.get_context("spawn")
+    stop_event = ctx.Event()
+    results = []
+    start_time = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=len(segments), mp_context=ctx,
+                                 initializer=_init_worker, initargs=(stop_event, threads_per_shard)) as pool:
+            pending = {
+                pool.submit(_run_shard, i, video_path, os.path.join(shard_dir, f"shard_{i:03d}.mp4"),
+                            warmup_start, start, end, overlap_frames, count_params)
+                for i, (warmup_start, start, end) in enumerate(segments)
+            }
+            try:
+                while pending:
+                    done, pending = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results.append(future.result())
+                        if results[-1]["metrics"] is not None:
+                            METRICS.camera(count_params["camera_key"]).absorb(results[-1]["metrics"])
+                    if stop_flag() and not stop_event.is_set():
+                        print("Sharded processing stopped by user.")
+                        stop_event.set()
+            except BaseException:
+                # One shard failed: stop the others now instead of waiting for their whole segments
+                stop_event.set()
+                for future in pending:
+                    future.cancel()
+                raise
+    except BaseException:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        raise
+
+    events = stitch_events(results)
+    csv_path = output_path.replace(".mp4", "_sales.csv")
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SaleEventSink.FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(events)
+    if concat_video:
+        concat_videos(results, output_path)
+    if not stop_event.is_set():
+        shutil.rmtree(shard_dir, ignore_errors=True)
+    stats = merge_stats(results, events, time.perf_counter() - start_time)
+
+    print(f"Total pizzas sold: {len(events)}")
+    print(f"Pizza sale events saved to: {csv_path}")
+    return stats
+
+
+if __name__ == "__main__":
+    from src.detection.counter import get_camera_key
+    from src.detection.zones import camera_zone_spec
+    video_path = "data/raw_videos/1461_CH01_20250607193711_203711.mp4"
+    camera_key = get_camera_key(video_path)
+
+    process_sharded(
+        video_path=video_path,
+        output_path=f"data/results/counted_{camera_key}.mp4",
+        shards=4,
+        concat_video=True,
+        conf_thres=0.5,
+        count_polygon=camera_zone_spec(camera_key)
+    )
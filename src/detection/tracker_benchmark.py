@@ -0,0 +1,103 @@
+# src/detection/tracker_benchmark.py
+import os
+import csv
+import json
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from src.detection.counter import track_and_count_pizzas, get_camera_key
+from src.detection.tracking import TRACKER_BACKENDS
+from src.detection.zones import camera_zone_spec
+from src.detection.capture import probe_source
+
+def _event_frames(csv_path):
+    with open(csv_path, "r", newline="") as f:
+        return [int(row["frame"]) for row in csv.DictReader(f)]
+
+def event_agreement(reference, candidate, tolerance):
+    """Sale events of `candidate` within `tolerance` frames of a distinct `reference` event."""
+    unmatched = sorted(reference)
+    matched = 0
+    for frame in sorted(candidate):
+        near = [f for f in unmatched if abs(f - frame) <= tolerance]
+        if near:
+            unmatched.remove(min(near, key=lambda f: abs(f - frame)))
+            matched += 1
+    return matched
+
+def compare_trackers(video_path, output_dir, trackers=TRACKER_BACKENDS, tolerance_seconds=2.0, **count_params):
+    """
+    Count `video_path` once per tracker backend (no video output) and report fps, tracking
+    time per frame and how many sale events agree with the first backend's, within
+    `tolerance_seconds`.
+    """
+    camera_key = get_camera_key(video_path)
+    count_params.setdefault("count_polygon", camera_zone_spec(camera_key))
+    count_params.setdefault("video_mode", "none")
+    os.makedirs(output_dir, exist_ok=True)
+    _, _, fps = probe_source(video_path)
+    tolerance = int(tolerance_seconds * fps)
+    report, reference = {}, None
+    for kind in trackers:
+        output_path = os.path.join(output_dir, f"{camera_key}_{kind}.mp4")
+        stats = track_and_count_pizzas(video_path, output_path, tracker_backend=kind,
+                                       checkpoint_every=None, **count_params)
+        events = _event_frames(output_path.replace(".mp4", "_sales.csv"))
+        track = stats["stages"].get("track", {})
+        entry = {
+            "pizza_count": stats["pizza_count"],
+            "fps": stats["fps"],
+            "track_ms": track.get("mean_ms")
+        }
+        if reference is None:
+            reference = events
+        else:
+            entry["agreeing_events"] = event_agreement(reference, events, tolerance)
+            entry["reference_events"] = len(reference)
+        report[kind] = entry
+    return report
+
+def compare_adaptive(video_path, output_dir, tolerance_seconds=2.0, **count_params):
+    """
+    Count `video_path` with YOLO on every frame and with adaptive=True (motion / track gated)
+    and report fps, the share of frames detected and how many of the ungated run's sale
+    events the gated run reproduces within `tolerance_seconds`.
+    """
+    camera_key = get_camera_key(video_path)
+    if "count_polygon" not in count_params:
+        count_params["count_polygon"] = camera_zone_spec(camera_key)
+    count_params.setdefault("video_mode", "none")
+    os.makedirs(output_dir, exist_ok=True)
+    _, _, fps = probe_source(video_path)
+    tolerance = int(tolerance_seconds * fps)
+    report, reference = {}, None
+    for name, adaptive in (("every_frame", False), ("adaptive", True)):
+        output_path = os.path.join(output_dir, f"{camera_key}_{name}.mp4")
+        stats = track_and_count_pizzas(video_path, output_path, adaptive=adaptive,
+                                       checkpoint_every=None, **count_params)
+        events = _event_frames(output_path.replace(".mp4", "_sales.csv"))
+        gate = stats.get("adaptive")
+        entry = {
+            "pizza_count": stats["pizza_count"],
+            "fps": stats["fps"],
+            "detected_ratio": round(gate["detected"] / gate["frames"], 3) if gate and gate["frames"] else 1.0
+        }
+        if gate:
+            entry["on_demand"] = gate["on_demand"]
+        if reference is None:
+            reference = events
+        else:
+            entry["agreeing_events"] = event_agreement(reference, events, tolerance)
+            entry["reference_events"] = len(reference)
+        report[name] = entry
+    return report
+
+
+if __name__ == "__main__":
+    videos = sys.argv[1:] or [
+        "data/raw_videos/cut_video_test/1465_CH02_20250607170555_172408 - Trim.mp4",
+        "data/raw_videos/cut_video_test/1464_CH02_20250607180000_190000 - Trim.mp4"
+    ]
+    for video_path in videos:
+        print(video_path)
+        print(json.dumps(compare_trackers(video_path, "data/results/tracker_benchmark"), indent=2))
+        print(json.dumps(compare_adaptive(video_path, "data/results/tracker_benchmark"), indent=2))
@@ -1,16 +1,195 @@
 # src/detection/tracking.py
 import cv2
-import os
-from ultralytics import YOLO
+import sys, os
+import time
 from tqdm import tqdm
 import numpy as np
 from deep_sort_realtime.deepsort_tracker import DeepSort
-import torchreid
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from src.detection.model_registry import REGISTRY, get_yolo, get_detector, get_embedder, DEFAULT_MODEL_PATH
+from src.detection.batching import get_batched_detector
+from src.detection.capture import open_capture, LiveCapture
+from src.detection.pipeline import StageTimer, ThreadedStage, read_frames
+from src.detection.iou_tracker import IoUTracker, IOU_TRACKER_PARAMS
+from src.detection.utils import iou_matrix
+from src.detection.backends import FrameDetections
+
+# ============== Shared-model DeepSort ==============
+DEFAULT_TRACKER_PARAMS = dict(
+    max_age=90,
+    n_init=2,
+    nms_max_overlap=0.7,
+    max_cosine_distance=0.5,
+    nn_budget=100,
+    embedder="mobilenet",
+    half=True
+)
+
+def build_deepsort(tracker_params, device=None, tracker=None):
+    """
+    Create a DeepSort tracker whose appearance embedder comes from the model registry.
+    The tracker itself holds per-video state and is never shared; the embedder is.
+    tracker: continue with an existing DeepSort (e.g. restored from a checkpoint) instead.
+    """
+    params = dict(tracker_params)
+    embedder = params.pop("embedder", "mobilenet")
+    half = params.pop("half", True)
+    embedder_wts = params.pop("embedder_wts", None)
+    params.pop("embedder_gpu", None)
+    if tracker is None:
+        tracker = DeepSort(embedder=None, **params)
+    embedder_entry = get_embedder(embedder, half=half, device=device, embedder_wts=embedder_wts)
+    return tracker, embedder_entry
+
+def update_deepsort(tracker, embedder_entry, detections, frame):
+    # Same filtering DeepSort applies before embedding, so embeds line up with detections
+    detections = [d for d in detections if d[0][2] > 0 and d[0][3] > 0]
+    embeds = []
+    if detections:
+        crops, _ = DeepSort.crop_bb(frame, detections)
+        with embedder_entry.lock:
+            embeds = embedder_entry.model.predict(crops)
+    return tracker.update_tracks(detections, embeds=embeds)
+
+def confirmed_tracks(ds_tracks):
+    """Confirmed DeepSort tracks as [x1, y1, x2, y2, 1.0, track_id] (1.0 as dummy score)."""
+    tracks = []
+    for track in ds_tracks:
+        if not track.is_confirmed():
+            continue
+        x1, y1, x2, y2 = map(int, track.to_ltrb())
+        tracks.append([x1, y1, x2, y2, 1.0, track.track_id])
+    return tracks
+
+# ============== Tracker backends ==============
+TRACKER_BACKENDS = ("deepsort", "deepsort-sparse", "iou")
+TRACKER_PARAMS = {
+    "deepsort": DEFAULT_TRACKER_PARAMS,
+    "deepsort-sparse": dict(DEFAULT_TRACKER_PARAMS, embed_every=10, ambiguity_iou=0.3),
+    "iou": IOU_TRACKER_PARAMS
+}
+
+class DeepSortTracker:
+    """
+    DeepSort with the shared appearance embedder, behind the same update/predict/tracks
+    interface as iou_tracker.IoUTracker.
+
+    embed_every=1 embeds every detection crop on every frame (plain DeepSort). With a larger
+    value, all crops are embedded only every `embed_every` frames; in between, a detection
+    that overlaps exactly one track (IoU >= ambiguity_iou), which overlaps no other
+    detection, reuses that track's last embedding, and only ambiguous or new detections are
+    embedded. Picklable for checkpoints: the shared embedder is looked up again on use.
+    """
+    needs_frames = True  # appearance crops come from the frame
+
+    def __init__(self, tracker_params=None, embed_every=1, ambiguity_iou=0.3):
+        self.params = dict(tracker_params or DEFAULT_TRACKER_PARAMS)
+        self.deepsort, self._embedder = build_deepsort(self.params)
+        self.embed_every = max(1, int(embed_every))
+        self.ambiguity_iou = ambiguity_iou
+        self.frames = 0
+        self.detections = 0
+        self.embedded = 0
+        self._features = {}  # track_id: last appearance embedding
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_embedder"] = None  # holds a lock; shared, not part of the tracker state
+        return state
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            _, self._embedder = build_deepsort(self.params, tracker=self.deepsort)
+        return self._embedder
+
+    def model_entries(self):
+        """Shared registry models this tracker uses, for the caller to hold while it runs."""
+        return [self.embedder]
+
+    def detection_thres(self, conf_thres):
+        return conf_thres
+
+    def alive(self):
+        return len(self.deepsort.tracker.tracks) > 0
+
+    def predict(self):
+        self.deepsort.tracker.predict()
+        return confirmed_tracks(self.deepsort.tracker.tracks)
+
+    def _reusable(self, detections):
+        """{detection index: track_id} for detections that unambiguously continue a track with a known embedding."""
+        tracks = [t for t in self.deepsort.tracker.tracks if t.track_id in self._features]
+        if not tracks:
+            return {}
+        det_boxes = [[x, y, x + w, y + h] for (x, y, w, h), _, _ in detections]
+        overlaps = iou_matrix(det_boxes, [t.to_ltrb() for t in tracks]) >= self.ambiguity_iou
+        reusable = {}
+        for i in np.flatnonzero(overlaps.sum(axis=1) == 1):
+            j = int(overlaps[i].argmax())
+            if overlaps[:, j].sum() == 1:
+                reusable[int(i)] = tracks[j].track_id
+        return reusable
+
+    def update(self, detections, frame):
+        # Same filtering DeepSort applies before embedding, so embeds line up with detections
+        detections = [d for d in detections if d[0][2] > 0 and d[0][3] > 0]
+        self.frames += 1
+        self.detections += len(detections)
+        embeds = [None] * len(detections)
+        if detections:
+            reusable = {} if self.embed_every == 1 or self.frames % self.embed_every == 1 else self._reusable(detections)
+            for i, track_id in reusable.items():
+                embeds[i] = self._features[track_id]
+            todo = [i for i in range(len(detections)) if i not in reusable]
+            if todo:
+                crops, _ = DeepSort.crop_bb(frame, [detections[i] for i in todo])
+                entry = self.embedder
+                with entry.lock:
+                    computed = entry.model.predict(crops)
+                for i, embed in zip(todo, computed):
+                    embeds[i] = embed
+                self.embedded += len(todo)
+        ds_tracks = self.deepsort.update_tracks(detections, embeds=embeds, others=list(range(len(detections))))
+
+        # Remember each matched track's embedding; forget deleted tracks
+        features = {}
+        for track in ds_tracks:
+            det_idx = track.get_det_supplementary() if track.time_since_update == 0 else None
+            if det_idx is not None:
+                features[track.track_id] = embeds[det_idx]
+            elif track.track_id in self._features:
+                features[track.track_id] = self._features[track.track_id]
+        self._features = features
+        return confirmed_tracks(ds_tracks)
+
+    def summary(self):
+        ratio = self.embedded / self.detections if self.detections else 0.0
+        return f"DeepSort: embedded {self.embedded}/{self.detections} detection crops ({ratio:.0%})"
+
+
+def build_tracker(kind="deepsort", tracker_params=None, conf_thres=0.5):
+    """
+    A tracker of one of TRACKER_BACKENDS:
+    - deepsort: DeepSort, appearance embedding of every detection on every frame.
+    - deepsort-sparse: DeepSort embedding only every `embed_every` frames and ambiguous detections.
+    - iou: motion/IoU-only ByteTrack-style tracker (no embedder), `conf_thres` as its high threshold.
+    tracker_params override the backend's TRACKER_PARAMS.
+    """
+    if kind not in TRACKER_PARAMS:
+        raise ValueError(f"Unknown tracker backend: {kind} (expected one of {', '.join(TRACKER_BACKENDS)})")
+    params = {**TRACKER_PARAMS[kind], **(tracker_params or {})}
+    if kind == "iou":
+        return IoUTracker(high_thres=conf_thres, **params)
+    embed_every = params.pop("embed_every", 1)
+    ambiguity_iou = params.pop("ambiguity_iou", 0.3)
+    return DeepSortTracker(params, embed_every=embed_every, ambiguity_iou=ambiguity_iou)
 
 # Test tracking function from video
 def track_pizzas_from_video(video_path, output_path, conf_thres=0.5):
-    model = YOLO("models/yolov8l.pt")
-    tracker = DeepSort(
+    model_entry = get_yolo(DEFAULT_MODEL_PATH)
+    model = model_entry.model
+    tracker, embedder_entry = build_deepsort(dict(
         max_age=120,         # Number of missed frames before a track is deleted
         n_init=3,           # Number of consecutive detections before track is confirmed
         nms_max_overlap=1.0,# Allow full overlap for pizzas on trays
@@ -18,7 +197,7 @@ def track_pizzas_from_video(video_path, output_path, conf_thres=0.5):
         nn_budget=100,      # Max number of appearance features to store per track
         embedder="mobilenet", # Lightweight and fast
         half=True           # Use half precision for speed
-    )
+    ))
 
     cap = cv2.VideoCapture(video_path)
     width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -36,7 +215,8 @@ def track_pizzas_from_video(video_path, output_path, conf_thres=0.5):
         if not ret:
             break
 
-        results = model(frame)[0]
+        with model_entry.lock:
+            results = model(frame)[0]
         detections = []
 
         for box in results.boxes:
@@ -50,7 +230,7 @@ def track_pizzas_from_video(video_path, output_path, conf_thres=0.5):
             w, h = x2 - x1, y2 - y1
             detections.append(([x1, y1, w, h], conf, 'pizza'))
 
-        tracks = tracker.update_tracks(detections, frame=frame)
+        tracks = update_deepsort(tracker, embedder_entry, detections, frame)
 
         for track in tracks:
             if not track.is_confirmed():
@@ -74,59 +254,223 @@ def track_pizzas_from_video(video_path, output_path, conf_thres=0.5):
     print(f"Tracking video saved to: {output_path}")
 
 # ============== Tracker ==============  
-def pizza_tracker(video_path, model_path="models/yolov8l.pt", conf_thres=0.5, tracker_params=None):
-    if tracker_params is None:
-        tracker_params = dict(
-            max_age=90,
-            n_init=2,
-            nms_max_overlap=0.7,
-            max_cosine_distance=0.5,
-            nn_budget=100,
-            embedder="mobilenet",
-            half=True
-        )
-    model = YOLO(model_path)
-    tracker = DeepSort(**tracker_params)
+def results_to_detections(results, names, conf_thres, offset=(0, 0)):
+    """
+    Keep confident pizza boxes of one frame's backends.FrameDetections as DeepSort
+    ([x, y, w, h], conf, cls) tuples.
+    offset: (dx, dy) of the detection crop, mapping boxes back to full-frame coordinates.
+    """
+    dx, dy = offset
+    pizza_ids = [cls_id for cls_id, label in names.items() if label == "pizza"]
+    keep = np.isin(results.classes, pizza_ids) & (results.scores >= conf_thres)
+    boxes = results.boxes[keep].astype(int)
+    detections = []
+    for (x1, y1, x2, y2), conf in zip(boxes.tolist(), results.scores[keep].tolist()):
+        detections.append(([x1 + dx, y1 + dy, x2 - x1, y2 - y1], conf, 'pizza'))
+    return detections
 
-    cap = cv2.VideoCapture(video_path)
-    width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps    = cap.get(cv2.CAP_PROP_FPS)
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+def shift_detections(results, offset):
+    """FrameDetections of an ROI crop in full-frame coordinates (None passes through)."""
+    if results is None or offset == (0, 0):
+        return results
+    dx, dy = offset
+    return FrameDetections(results.boxes + np.array([dx, dy, dx, dy], np.float32), results.scores, results.classes)
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
+def detect_chunk(chunk, detector, timer, roi=None):
+    """Detector results for a list of frames, or of their roi=(x1, y1, x2, y2) crops."""
+    if roi is not None:
+        x1, y1, x2, y2 = roi
+        with timer.time("preprocess"):
+            inputs = [np.ascontiguousarray(frame[y1:y2, x1:x2]) for frame in chunk]
+    else:
+        inputs = chunk
+    # "detect" is the wall time of the call, batching wait included; the detector adds
+    # this chunk's share of preprocess / inference / nms time
+    with timer.time("detect"):
+        return detector.detect(inputs, timer)
 
-        results = model(frame)[0]
-        detections = []
+def detect_batches(frames, detector, batch_size, timer, roi=None, scheduler=None):
+    """
+    Inference stage: group frames into chunks of `batch_size` and yield (frame, results, motion) in order.
+    With roi=(x1, y1, x2, y2) only that crop of each frame is sent to the model.
+    With an AdaptiveScheduler, frames it does not prefetch are yielded with results None, and
+    `motion` is its motion gate's verdict for the frame (None without a scheduler).
+    """
+    def flush(pending):
+        results = iter(detect_chunk([frame for frame, detect, _ in pending if detect], detector, timer, roi))
+        for frame, detect, motion in pending:
+            yield frame, next(results) if detect else None, motion
 
-        for box in results.boxes:
-            cls_id = int(box.cls)
-            conf = float(box.conf)
-            label = model.model.names[cls_id]
+    pending = []  # (frame, detect, motion) in frame order, starting with a frame to detect
+    n_detect = 0
+    for frame in frames:
+        if scheduler is None:
+            motion, detect = None, True
+        else:
+            with timer.time("motion"):
+                motion, detect = scheduler.prefetch(frame)
+        if not detect and not pending:
+            yield frame, None, motion
+            continue
+        pending.append((frame, detect, motion))
+        n_detect += detect
+        if n_detect < batch_size:
+            continue
+        yield from flush(pending)
+        pending, n_detect = [], 0
+    if pending:
+        yield from flush(pending)
 
-            if label != "pizza" or conf < conf_thres:
-                continue
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            w, h = x2 - x1, y2 - y1
-            detections.append(([x1, y1, w, h], conf, 'pizza'))
+def pizza_tracker(
+    video_path,
+    model_path=DEFAULT_MODEL_PATH,
+    conf_thres=0.5,
+    tracker_params=None,
+    batch_size=1,
+    max_batch_size=8,
+    max_wait_ms=10,
+    queue_size=8,
+    timer=None,
+    roi=None,
+    scheduler=None,
+    start_frame=0,
+    tracker=None,
+    backend=None,
+    tracker_backend="deepsort",
+    recorder=None
+):
+    """
+    Yield (frame, tracks) for every frame of the video, then a final (None, None).
+    `batch_size` frames are read ahead and detected in one forward pass; the shared
+    BatchedDetector also merges chunks from other cameras running at the same time
+    (up to `max_batch_size` frames, waiting at most `max_wait_ms` for them).
 
-        tracks = []
-        ds_tracks = tracker.update_tracks(detections, frame=frame)
-        for track in ds_tracks:
-            if not track.is_confirmed():
-                continue
-            track_id = track.track_id
-            ltrb = track.to_ltrb()
-            x1, y1, x2, y2 = map(int, ltrb)
-            tracks.append([x1, y1, x2, y2, 1.0, track_id])  # 1.0 as dummy score
+    Decoding and inference run on their own threads connected by bounded queues of
+    `queue_size` items; tracker updates happen in the consuming thread, in frame order.
 
-        yield frame, tracks
+    roi: optional (x1, y1, x2, y2) region (see zones.CountingZone.roi). YOLO only sees that
+    crop; boxes are mapped back to full-frame coordinates for DeepSort and the caller.
 
-    cap.release()
-    yield None, None 
+    video_path may also be an RTSP/HTTP URL or a camera device (see capture.open_capture):
+    frames are then grabbed on their own thread and stale ones are dropped while we lag behind.
+
+    scheduler: optional scheduler.AdaptiveScheduler. On frames it skips, YOLO is not run
+    and the tracker's motion prediction carries the existing tracks. The skip decision is
+    taken here, in frame order, from the tracker's state (see AdaptiveScheduler).
+
+    tracker_backend / tracker_params: see build_tracker ('deepsort', 'deepsort-sparse', 'iou').
+    start_frame / tracker: resume after `start_frame` already-processed frames with a tracker
+    from build_tracker as it was at that point (see checkpoint.py). The tracker is updated
+    in place, so the caller can snapshot it between two yielded frames.
+
+    backend: detector backend (see backends.DETECTOR_BACKENDS), e.g. 'onnx-int8' on CPU-only
+    hosts; defaults to backends.DEFAULT_BACKEND.
+
+    recorder: optional detection_cache.CacheRecorder; every frame's raw detections (in
+    full-frame coordinates) and confirmed tracks are persisted for replay_detections.
+    """
+    # Held for the whole run: the registry only unloads models no run is using
+    model_entry = get_detector(model_path, backend=backend, acquire=True)
+    held = [model_entry]
+    detector = None
+    try:
+        names = model_entry.model.names
+        if recorder is not None:
+            recorder.names = names
+        detector = get_batched_detector(model_entry, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        if tracker is None:
+            tracker = build_tracker(tracker_backend, tracker_params, conf_thres)
+        for entry in tracker.model_entries():
+            REGISTRY.acquire(entry)
+            held.append(entry)
+        det_thres = tracker.detection_thres(conf_thres)
+
+        cap = open_capture(video_path)
+        live = isinstance(cap, LiveCapture)
+        if start_frame:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps    = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        if timer is None:
+            timer = StageTimer()
+        # Live: no read-ahead queue of stale frames, LiveCapture already keeps the freshest ones
+        reader = ThreadedStage(read_frames(cap, timer), maxsize=1 if live else queue_size, name="reader")
+        inference = ThreadedStage(detect_batches(reader, detector, batch_size, timer, roi, scheduler), maxsize=queue_size, name="inference")
+        timer.watch_queue("decoded", reader.qsize)
+        timer.watch_queue("detected", inference.qsize)
+        timer.watch_queue("detector", detector.pending)
+        if live and timer.metrics is not None:
+            timer.metrics.watch_dropped(lambda: cap.dropped)
+        offset = (roi[0], roi[1]) if roi is not None else (0, 0)
+        try:
+            for frame, results, motion in inference:
+                if scheduler is not None:
+                    if not scheduler.decide(motion, tracker.alive(), results is not None):
+                        results = None
+                    elif results is None:
+                        # Tracks are alive but the inference stage, running ahead, did not know yet
+                        results = detect_chunk([frame], detector, timer, roi)[0]
+                if results is None:
+                    # No detection on this frame: predict only, tracks are neither confirmed nor missed
+                    with timer.time("track"):
+                        tracks = tracker.predict()
+                else:
+                    with timer.time("filter"):
+                        detections = results_to_detections(results, names, det_thres, offset)
+                    with timer.time("track"):
+                        tracks = tracker.update(detections, frame)
+                if scheduler is not None:
+                    scheduler.tracks_alive = tracker.alive()  # prefetch hint only
+                if recorder is not None:
+                    with timer.time("record"):
+                        recorder.record(shift_detections(results, offset), tracks)
+
+                yield frame, tracks
+        finally:
+            if live:
+                cap.release()  # unblocks a reader waiting on the camera
+            inference.close()
+            reader.close()
+            cap.release()
+            if live:
+                print(cap.summary())
+            if scheduler is not None:
+                print(scheduler.summary())
+            print(tracker.summary())
+    finally:
+        if detector is not None:
+            detector.unregister()
+        for entry in held:
+            REGISTRY.release(entry)
+
+    yield None, None
+
+
+def replay_detections(detections, tracker, conf_thres=0.5, timer=None, recorder=None):
+    """
+    pizza_tracker over a detection_cache.DetectionCache instead of the video: the same
+    (None, tracks) per frame and final (None, None), without decoding or running the model.
+    Only trackers that do not look at the frame (tracker.needs_frames False) can replay.
+    """
+    if tracker.needs_frames:
+        raise ValueError("Replaying detections needs a tracker without appearance features (tracker_backend='iou')")
+    if timer is None:
+        timer = StageTimer()
+    names = detections.names
+    det_thres = tracker.detection_thres(conf_thres)
+    for results in detections:
+        with timer.time("track"):
+            if results is None:
+                tracks = tracker.predict()
+            else:
+                tracks = tracker.update(results_to_detections(results, names, det_thres), None)
+        if recorder is not None:
+            recorder.record(results, tracks)
+        yield None, tracks
+    yield None, None
 
 
 if __name__ == "__main__":
@@ -15,6 +15,22 @@ def iou(box1, box2):
 
     return inter_area / union_area if union_area > 0 else 0
 
+def iou_matrix(boxes1, boxes2):
+    """Vectorised `iou` of every pair: (N, 4) and (M, 4) x1, y1, x2, y2 boxes -> (N, M) array."""
+    a = np.asarray(boxes1, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes2, dtype=np.float64).reshape(-1, 4)
+    xi1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    yi1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    xi2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    yi2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter_area = np.clip(xi2 - xi1, 0, None) * np.clip(yi2 - yi1, 0, None)
+
+    area1 = np.clip(a[:, 2] - a[:, 0], 0, None) * np.clip(a[:, 3] - a[:, 1], 0, None)
+    area2 = np.clip(b[:, 2] - b[:, 0], 0, None) * np.clip(b[:, 3] - b[:, 1], 0, None)
+    union_area = area1[:, None] + area2[None, :] - inter_area
+
+    return np.divide(inter_area, union_area, out=np.zeros_like(inter_area), where=union_area > 0)
+
 def apply_clahe(image, clip_limit=2.0, tile_grid_size=(8, 8)):
     lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
     l, a, b = cv2.split(lab)
@@ -152,23 +168,22 @@ def draw_polygon_on_frame(video_path, display_scale=0.5):
         print("Polygon not completed.")
         return None
 
+def polygon_points(polygon_dict):
+    """Vertices of a {'x1', 'y1', ..., 'xN', 'yN'} polygon dict as an (N, 2) int32 array."""
+    pts = []
+    idx = 1
+    while f'x{idx}' in polygon_dict:
+        pts.append([polygon_dict[f'x{idx}'], polygon_dict[f'y{idx}']])
+        idx += 1
+    return np.array(pts, np.int32)
+
 def point_in_polygon(pt, polygon_dict):
-    pts = np.array([
-        [polygon_dict['x1'], polygon_dict['y1']],
-        [polygon_dict['x2'], polygon_dict['y2']],
-        [polygon_dict['x3'], polygon_dict['y3']],
-        [polygon_dict['x4'], polygon_dict['y4']]
-    ], np.int32)
+    pts = polygon_points(polygon_dict)
     pts = pts.reshape((-1, 1, 2))
     return cv2.pointPolygonTest(pts, pt, False) >= 0
 
 def draw_polygon(frame, polygon_dict, color=(0,0,255), thickness=2):
-    pts = np.array([
-        [polygon_dict['x1'], polygon_dict['y1']],
-        [polygon_dict['x2'], polygon_dict['y2']],
-        [polygon_dict['x3'], polygon_dict['y3']],
-        [polygon_dict['x4'], polygon_dict['y4']]
-    ], np.int32)
+    pts = polygon_points(polygon_dict)
     pts = pts.reshape((-1, 1, 2))
     cv2.polylines(frame, [pts], isClosed=True, color=color, thickness=thickness)
 
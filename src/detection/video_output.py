@@ -0,0 +1,154 @@
+# src/detection/video_output.py
+import os
+import time
+from collections import deque
+import cv2
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from src.detection.pipeline import AsyncVideoWriter
+
+VIDEO_MODES = ("full", "preview", "events", "none")
+
+def clips_dir(output_path):
+    return output_path.replace(".mp4", "_clips")
+
+def _downscale(frame, size):
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+def _preview_size(size, width):
+    w, h = size
+    if not width or width >= w:
+        return size
+    return int(width), max(2, round(h * width / w) // 2 * 2)  # even height for the encoder
+
+# ============== Video outputs ==============
+class NoVideo:
+    annotate = False
+
+    def write(self, frame, frame_idx, events):
+        pass
+
+    def qsize(self):
+        return 0
+
+    def release(self):
+        pass
+
+
+class FullVideo:
+    """Every annotated frame at full resolution (the original behaviour)."""
+    annotate = True
+
+    def __init__(self, output_path, fps, size, maxsize=16, timer=None):
+        self._out = AsyncVideoWriter(output_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size,
+                                     maxsize=maxsize, timer=timer)
+
+    def write(self, frame, frame_idx, events):
+        self._out.write(frame)
+
+    def qsize(self):
+        return self._out.qsize()
+
+    def release(self):
+        self._out.release()
+
+
+class PreviewVideo:
+    """The whole run, downscaled to `width` px and sampled down to about `preview_fps`."""
+    annotate = True
+
+    def __init__(self, output_path, fps, size, width=640, preview_fps=5, maxsize=16, timer=None):
+        self.step = max(1, round(fps / preview_fps)) if preview_fps else 1
+        self.size = _preview_size(size, width)
+        self._out = AsyncVideoWriter(output_path, cv2.VideoWriter_fourcc(*"mp4v"), fps / self.step, self.size,
+                                     maxsize=maxsize, timer=timer)
+
+    def write(self, frame, frame_idx, events):
+        if frame_idx % self.step:
+            return
+        self._out.write(_downscale(frame, self.size))
+
+    def qsize(self):
+        return self._out.qsize()
+
+    def release(self):
+        self._out.release()
+
+
+class EventClips:
+    """
+    Downscaled, frame-sampled clips around sale events only: `before` seconds of pre-roll
+    from a small ring buffer, then up to `after` seconds past the last event. Events close
+    together share one clip. Clips are written to `clip_dir` as clip_<first event frame>.mp4;
+    clips of a previous run are removed unless `keep_existing` (resuming that run).
+    """
+    annotate = True
+
+    def __init__(self, clip_dir, fps, size, width=640, preview_fps=5, before=3.0, after=3.0, timer=None,
+                 keep_existing=False):
+        os.makedirs(clip_dir, exist_ok=True)
+        if not keep_existing:
+            for name in os.listdir(clip_dir):
+                if name.startswith("clip_") and name.endswith(".mp4"):
+                    os.remove(os.path.join(clip_dir, name))
+        self.clip_dir = clip_dir
+        self.step = max(1, round(fps / preview_fps)) if preview_fps else 1
+        self.fps = fps / self.step
+        self.size = _preview_size(size, width)
+        self.after_frames = int(after * fps)
+        self._timer = timer
+        self._preroll = deque(maxlen=max(1, int(before * self.fps)))
+        self._writer = None
+        self._until = 0
+        self.clips = []
+
+    def write(self, frame, frame_idx, events):
+        if events:
+            if self._writer is None:
+                path = os.path.join(self.clip_dir, f"clip_{frame_idx:07d}.mp4")
+                self._writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), self.fps, self.size)
+                self.clips.append(path)
+                for small in self._preroll:
+                    self._writer.write(small)
+                self._preroll.clear()
+            self._until = frame_idx + self.after_frames
+        elif self._writer is not None and frame_idx > self._until:
+            self._writer.release()
+            self._writer = None
+
+        # Sampled frames only; an event frame is always kept
+        if frame_idx % self.step and not events:
+            return
+        start = time.perf_counter()
+        small = _downscale(frame, self.size)
+        if self._writer is not None:
+            self._writer.write(small)
+        else:
+            self._preroll.append(small)
+        if self._timer is not None:
+            self._timer.add("encode", time.perf_counter() - start)
+
+    def qsize(self):
+        return 0  # clips are encoded inline
+
+    def release(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+
+def open_video_output(mode, output_path, fps, size, maxsize=16, timer=None, preview_width=640,
+                      preview_fps=5, clip_before=3.0, clip_after=3.0, resume=False):
+    """Video writer for an output mode: 'full', 'preview', 'events' (clips around sales) or 'none'."""
+    if mode == "full":
+        return FullVideo(output_path, fps, size, maxsize=maxsize, timer=timer)
+    if mode == "preview":
+        return PreviewVideo(output_path, fps, size, width=preview_width, preview_fps=preview_fps,
+                            maxsize=maxsize, timer=timer)
+    if mode == "events":
+        return EventClips(clips_dir(output_path), fps, size, width=preview_width, preview_fps=preview_fps,
+                          before=clip_before, after=clip_after, timer=timer,
+                          keep_existing=resume)
+    if mode == "none":
+        return NoVideo()
+    raise ValueError(f"Unknown video mode: {mode} (expected one of {', '.join(VIDEO_MODES)})")
@@ -0,0 +1,87 @@
+# src/detection/zones.py
+import cv2
+import numpy as np
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from src.config.camera_zones import CAMERA_ZONES
+from src.detection.utils import polygon_points
+
+def camera_zone_spec(camera_key, zones=CAMERA_ZONES):
+    """Counting polygon(s) of a camera: 'count_polygons' (list), else 'count_polygon' or 'count_box'."""
+    zone = zones[camera_key]
+    return zone.get("count_polygons") or zone.get("count_polygon") or zone.get("count_box")
+
+def _rasterize(contour, x1, y1, x2, y2):
+    """
+    Exact inside-or-on-edge mask of a polygon over the integer grid [x1, x2] x [y1, y2]
+    (even-odd rule plus an on-segment test), so it agrees with cv2.pointPolygonTest.
+    """
+    ys, xs = np.mgrid[y1:y2 + 1, x1:x2 + 1].astype(np.int64)
+    pts = contour.reshape(-1, 2).astype(np.int64)
+    inside = np.zeros(xs.shape, bool)
+    on_edge = np.zeros(xs.shape, bool)
+    for (ax, ay), (bx, by) in zip(pts, np.roll(pts, -1, axis=0)):
+        cross = (bx - ax) * (ys - ay) - (by - ay) * (xs - ax)
+        on_edge |= (cross == 0) & (xs >= min(ax, bx)) & (xs <= max(ax, bx)) & (ys >= min(ay, by)) & (ys <= max(ay, by))
+        if ay != by:
+            straddles = (ay > ys) != (by > ys)
+            x_cross = ax + (ys - ay) * (bx - ax) / (by - ay)
+            inside ^= straddles & (xs < x_cross)
+    return inside | on_edge
+
+# ============== Counting zone ==============
+class CountingZone:
+    """
+    One or more counting polygons compiled once: contours, their joint bounding box for
+    fast rejection, and a precomputed mask of that box. Membership of a whole array of
+    points is a bounds check plus one mask lookup, matching cv2.pointPolygonTest(...) >= 0
+    (edges count as inside) for integer points.
+    """
+
+    def __init__(self, polygons):
+        self.contours = [polygon_points(p).reshape((-1, 1, 2)) for p in polygons]
+        all_pts = np.concatenate([c.reshape(-1, 2) for c in self.contours])
+        self.x1, self.y1 = map(int, all_pts.min(axis=0))
+        self.x2, self.y2 = map(int, all_pts.max(axis=0))
+
+        self.mask = np.zeros((self.y2 - self.y1 + 1, self.x2 - self.x1 + 1), bool)
+        for contour in self.contours:
+            self.mask |= _rasterize(contour, self.x1, self.y1, self.x2, self.y2)
+
+    @classmethod
+    def build(cls, spec):
+        """From a polygon dict, a list of polygon dicts, or an existing CountingZone."""
+        if spec is None or isinstance(spec, CountingZone):
+            return spec
+        if isinstance(spec, dict):
+            spec = [spec]
+        return cls(spec)
+
+    @classmethod
+    def for_camera(cls, camera_key, zones=CAMERA_ZONES):
+        return cls.build(camera_zone_spec(camera_key, zones))
+
+    def contains(self, points):
+        """Vectorised membership: (N, 2) array-like of (x, y) -> (N,) bool array."""
+        pts = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        xs, ys = pts[:, 0], pts[:, 1]
+        result = (xs >= self.x1) & (xs <= self.x2) & (ys >= self.y1) & (ys <= self.y2)
+        idx = np.flatnonzero(result)
+        result[idx] = self.mask[ys[idx] - self.y1, xs[idx] - self.x1]
+        return result
+
+    def contains_point(self, pt):
+        return bool(self.contains([pt])[0])
+
+    def roi(self, frame_size, padding=0):
+        """Padded bounding rectangle (x1, y1, x2, y2) of all polygons, clipped to the frame."""
+        width, height = frame_size
+        return (
+            max(0, int(self.x1) - padding),
+            max(0, int(self.y1) - padding),
+            min(width, int(self.x2) + padding + 1),
+            min(height, int(self.y2) + padding + 1)
+        )
+
+    def draw(self, frame, color=(0, 0, 255), thickness=2):
+        cv2.polylines(frame, self.contours, isClosed=True, color=color, thickness=thickness)
@@ -1,5 +1,6 @@
 import streamlit as st
 import requests
+import json
 import os
 
 BASE_URL = "http://localhost:8000"
@@ -47,7 +48,18 @@ if video_choice_display:
                 f"{BASE_URL}/process",
                 json={"video_path": f"data/raw_videos/cut_video_test/{video_choice_file}"}
             )
-            if resp.status_code == 200:
+            if resp.status_code == 200 and "error" in resp.json():
+                st.error(f"Failed to start processing: {resp.json()['error']}")
+            elif resp.status_code == 200 and resp.json().get("status") == "cached":
+                # Same video and settings were processed before: show that result, nothing to stream
+                cached = resp.json()
+                summary = cached.get("summary") or {}
+                st.success("This video was already processed with these settings; showing the stored result.")
+                if summary.get("pizza_count") is not None:
+                    st.metric("Pizzas Sold", summary["pizza_count"])
+                st.markdown(f"[Download CSV Result]({BASE_URL}/results/{cached['result_key']})")
+                st.markdown(f"[Download Processed Video]({BASE_URL}/video/{cached['result_key']})")
+            elif resp.status_code == 200:
                 st.session_state["show_stream"] = True
                 st.session_state["processing_started"] = True
                 st.success("Processing started! Now streaming...")
@@ -58,12 +70,14 @@ if video_choice_display:
 
     # Show stream and Stop button
     if st.session_state["show_stream"]:
-        st.markdown(
-            f"""
-            <img src="{BASE_URL}/stream/{video_choice_file}" width="1200" />
-            """,
-            unsafe_allow_html=True,
-        )
+        counts_only = st.checkbox("Counts only (no video, much lighter on the server)", value=False)
+        if not counts_only:
+            st.markdown(
+                f"""
+                <img src="{BASE_URL}/stream/{video_choice_file}?width=1200&max_fps=10&quality=70" width="1200" />
+                """,
+                unsafe_allow_html=True,
+            )
         if st.button("Stop Processing"):
             resp = requests.post(f"{BASE_URL}/stop/{video_id}")
             if resp.status_code == 200:
@@ -75,6 +89,25 @@ if video_choice_display:
             else:
                 st.error("Failed to stop processing.")
 
+        # Follow live counts over Server-Sent Events; clicking a button reruns the script and ends this loop
+        count_placeholder = st.empty()
+        events_placeholder = st.empty()
+        sales = []
+        try:
+            with requests.get(f"{BASE_URL}/events/{video_id}", params={"max_fps": 2}, stream=True, timeout=(5, 60)) as resp:
+                for line in resp.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data: "):
+                        continue
+                    msg = json.loads(line[len("data: "):])
+                    if "pizza_count" not in msg:
+                        break  # end of job
+                    sales.extend(msg["events"])
+                    count_placeholder.metric("Pizzas Sold", msg["pizza_count"], help=f"Frame {msg['frame']}, {len(msg['tracks'])} active tracks")
+                    if sales:
+                        events_placeholder.dataframe(sales[-10:])
+        except requests.RequestException as e:
+            st.info(f"Live count unavailable: {e}")
+
 if st.session_state.get("just_stopped", False):
     result_url = f"{BASE_URL}/results/{video_id}"
     resp = requests.get(result_url)
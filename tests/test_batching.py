@@ -0,0 +1,36 @@
+# tests/test_batching.py
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.detection import batching
+from src.detection.model_registry import REGISTRY
+
+
+class EchoModel:
+    def predict(self, frames):
+        return list(frames)
+
+
+def test_evicted_model_stops_its_detector():
+    entry = REGISTRY.get("detector:test-evict", "echo.pt", "cpu", EchoModel)
+    detector = batching.get_batched_detector(entry)
+    assert detector.detect([1, 2]) == [1, 2]
+    detector.unregister()
+
+    REGISTRY.evict("detector:test-evict")
+
+    detector._thread.join(timeout=5)
+    assert not detector._thread.is_alive()
+    assert entry.key not in batching._detectors
+
+
+def test_evicted_model_in_use_stops_after_last_client():
+    entry = REGISTRY.get("detector:test-busy", "echo.pt", "cpu", EchoModel)
+    detector = batching.get_batched_detector(entry)
+
+    REGISTRY.evict("detector:test-busy")  # not acquired, so unloaded while the client still runs
+    assert entry.key not in batching._detectors
+    assert detector.detect([3]) == [3]
+
+    detector.unregister()
+    detector._thread.join(timeout=5)
+    assert not detector._thread.is_alive()
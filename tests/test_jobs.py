@@ -0,0 +1,47 @@
+# tests/test_jobs.py
+import os
+import signal
+import time
+import sys
+import pytest
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.api.jobs import WorkerProcess
+
+
+def thread_budget_task(messages, stop_flag, want_frames, value):
+    import cv2
+    messages.put(("frame", None, {"value": value}))
+    return cv2.getNumThreads()
+
+
+def wait_task(messages, stop_flag, want_frames):
+    while not stop_flag():
+        time.sleep(0.01)
+    return "stopped"
+
+
+def test_worker_process_runs_jobs_with_its_thread_budget():
+    worker = WorkerProcess("test-worker", threads=2).start()
+    try:
+        worker.submit(thread_budget_task, value=7)
+        assert worker.receive() == ("frame", None, {"value": 7})
+        assert worker.receive() == ("done", 2)
+    finally:
+        worker.stop()
+
+
+def test_dead_worker_process_fails_its_job_and_is_replaced():
+    worker = WorkerProcess("test-worker", threads=1).start()
+    try:
+        worker.submit(wait_task)
+        pid = worker.process.pid
+        os.kill(pid, signal.SIGKILL)
+        with pytest.raises(RuntimeError):
+            worker.receive(timeout=0.1)
+        assert worker.process.pid != pid
+
+        worker.submit(wait_task)
+        worker.cancel.set()
+        assert worker.receive() == ("done", "stopped")
+    finally:
+        worker.stop()